@@ -1270,8 +1270,12 @@ class EmptyModuleChecker:
 
 def convert_fragment(fragment, ports=(), name="top", *, emit_src=True, **kwargs):
     assert isinstance(fragment, (_ir.Fragment, _ir.Design))
-    name_map = _ast.SignalDict()
     netlist = _ir.build_netlist(fragment, ports=ports, name=name, **kwargs)
+    return _convert_netlist(netlist, emit_src=emit_src)
+
+
+def _convert_netlist(netlist, *, emit_src=True):
+    name_map = _ast.SignalDict()
     empty_checker = EmptyModuleChecker(netlist)
     builder = Design(emit_src=emit_src)
     for module_idx, module in enumerate(netlist.modules):
@@ -1,11 +1,15 @@
+import sys
+import json
 import argparse
+import importlib
 
+from .hdl import Period
 from .hdl._ir import Fragment
 from .back import rtlil, cxxrtl, verilog
-from .sim import Simulator
+from .sim import Simulator, run_batch
 
 
-__all__ = ["main"]
+__all__ = ["main", "batch_main"]
 
 
 def main_parser(parser=None):
@@ -78,3 +82,105 @@ def main_runner(parser, args, design, platform=None, name="top", ports=None):
 def main(*args, **kwargs):
     parser = main_parser()
     main_runner(parser, parser.parse_args(), *args, **kwargs)
+
+
+def _import_object(name):
+    py_module_name, py_object_name = name.rsplit(".", 1)
+    py_module = importlib.import_module(py_module_name)
+    return getattr(py_module, py_object_name)
+
+
+def batch_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(
+            description="run a testbench for many parameters in parallel")
+
+    parser.add_argument("design",
+        metavar="DESIGN", type=str,
+        help="construct the design by calling DESIGN (as 'module.name') without arguments")
+    parser.add_argument("testbench",
+        metavar="TESTBENCH", type=str,
+        help="run TESTBENCH (as 'module.name') with the context, design, and parameter")
+    parser.add_argument("-s", "--setup",
+        metavar="SETUP", type=str,
+        help="call SETUP (as 'module.name') with the simulator and design before running "
+             "(default: add a 'sync' clock)")
+    p_parameters = parser.add_mutually_exclusive_group(required=True)
+    p_parameters.add_argument("-n", "--count",
+        metavar="COUNT", type=int,
+        help="run the testbench with each parameter from 0 to COUNT-1")
+    p_parameters.add_argument("--parameters", dest="parameters_file",
+        metavar="JSON-FILE", type=str,
+        help="run the testbench with each parameter from the list in JSON-FILE")
+    parser.add_argument("-j", "--jobs",
+        metavar="JOBS", type=int,
+        help="run JOBS simulations at once (default: number of CPUs)")
+    parser.add_argument("-p", "--period", dest="sync_period",
+        metavar="TIME", type=float, default=1e-6,
+        help="set 'sync' clock domain period to TIME if SETUP is not given "
+             "(default: %(default)s)")
+    parser.add_argument("-d", "--deadline",
+        metavar="TIME", type=float,
+        help="stop each simulation after TIME (default: when the testbench returns)")
+    parser.add_argument("-v", "--vcd-dir",
+        metavar="VCD-DIR", type=str,
+        help="write execution trace of each simulation to VCD-DIR")
+    parser.add_argument("--json", dest="json_file",
+        metavar="JSON-FILE", type=str,
+        help="write the results to JSON-FILE")
+
+    return parser
+
+
+def batch_runner(parser, args):
+    design    = _import_object(args.design)
+    testbench = _import_object(args.testbench)
+    if args.setup is not None:
+        setup = _import_object(args.setup)
+    else:
+        sync_period = Period(s=args.sync_period)
+        def setup(sim, dut):
+            sim.add_clock(sync_period)
+
+    if args.parameters_file is not None:
+        with open(args.parameters_file) as f:
+            parameters = json.load(f)
+        if not isinstance(parameters, list):
+            parser.error(f"Parameters file {args.parameters_file} must contain a JSON list")
+    else:
+        parameters = range(args.count)
+
+    deadline = None
+    if args.deadline is not None:
+        deadline = Period(s=args.deadline)
+
+    results = run_batch(design, testbench, parameters, setup=setup, processes=args.jobs,
+                        vcd_dir=args.vcd_dir, deadline=deadline)
+
+    n_failed = 0
+    for result in results:
+        if not result.passed:
+            n_failed += 1
+            print(f"Run with parameter {result.parameter!r} failed:", file=sys.stderr)
+            print(result.failure, file=sys.stderr)
+    print(f"{len(results) - n_failed} passed, {n_failed} failed")
+
+    if args.json_file is not None:
+        with open(args.json_file, "w") as f:
+            json.dump([
+                {
+                    "parameter": result.parameter,
+                    "passed":    result.passed,
+                    "value":     result.value,
+                    "failure":   result.failure,
+                    "vcd_file":  result.vcd_file,
+                }
+                for result in results
+            ], f, indent=2, default=repr)
+
+    return 1 if n_failed else 0
+
+
+def batch_main():
+    parser = batch_parser()
+    sys.exit(batch_runner(parser, parser.parse_args()))
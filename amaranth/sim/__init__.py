@@ -1,5 +1,8 @@
 from .core import Simulator
 from ._async import DomainReset, BrokenTrigger, SimulatorContext, TickTrigger, TriggerCombination
+from ._batch import BatchResult, run_batch
+from ._profile import SimulationProfile
+from ._vcdgz import read_vcd_gz
 from ._pycoro import Settle, Delay, Tick, Passive, Active
 from ..hdl import Period
 
@@ -8,6 +11,9 @@ __all__ = [
     "DomainReset", "BrokenTrigger",
     "SimulatorContext", "Simulator", "TickTrigger", "TriggerCombination",
     "Period",
+    "BatchResult", "run_batch",
+    "SimulationProfile",
+    "read_vcd_gz",
     # deprecated
     "Settle", "Delay", "Tick", "Passive", "Active",
 ]
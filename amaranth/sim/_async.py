@@ -425,13 +425,80 @@ class TickTrigger:
     def __await__(self):
         trigger = self._engine.add_trigger_combination(self._collect_trigger(), oneshot=True)
         clk_edge, rst_edge, rst_sample, *values = yield from trigger.__await__()
-        return (clk_edge, bool(rst_edge or rst_sample), *values)
+        return (clk_edge, bool(_any_lane(rst_edge) or _any_lane(rst_sample)), *values)
 
     async def __aiter__(self):
         trigger = self._engine.add_trigger_combination(self._collect_trigger(), oneshot=False)
         while True:
             clk_edge, rst_edge, rst_sample, *values = await trigger
-            yield (clk_edge, bool(rst_edge or rst_sample), *values)
+            yield (clk_edge, bool(_any_lane(rst_edge) or _any_lane(rst_sample)), *values)
+
+
+def _any_lane(value):
+    # When simulating many instances of a design in lockstep (see the `lanes` option of
+    # `PySimEngine`), sampled values are arrays with one element for each lane.
+    if isinstance(value, int):
+        return value
+    return value.any()
+
+
+def _is_lane_values(value):
+    return hasattr(value, "__array_interface__")
+
+
+def _cast_lane_values(expr, value):
+    # Values for each lane that are provided as an array of integers are used as-is; any other
+    # array (e.g. of `dict`s for a `data.View`) is converted one element at a time.
+    if value.dtype.kind in "iub":
+        return value
+    return [_cast_value(expr, lane_value) for lane_value in value]
+
+
+def _cast_value(expr, value):
+    if isinstance(expr, ValueCastable):
+        shape = expr.shape()
+        if isinstance(shape, ShapeCastable):
+            value = shape.const(value)
+    return Const.cast(value).value
+
+
+def _cast_memory(memory):
+    from ..lib.memory import Memory
+    if isinstance(memory, Memory):
+        memory = memory.data
+    if not isinstance(memory, MemoryData):
+        raise TypeError(f"Memory must be a MemoryData or a Memory, not {memory!r}")
+    return memory
+
+
+def _cast_memory_offset(memory, offset):
+    offset = operator.index(offset)
+    if offset not in range(memory.depth + 1):
+        raise ValueError(f"Offset {offset} is out of range for a memory with depth {memory.depth}")
+    return offset
+
+
+class _ExternalWait:
+    # Returned by `TestbenchContext.external()`. The testbench awaiting it is not runnable until
+    # `Simulator.run_async()` awaits `awaitable` in the host event loop and calls `resume()` with
+    # the resulting future.
+    def __init__(self, engine: BaseEngine, process: BaseProcess, awaitable):
+        self._engine  = engine
+        self._process = process
+        self.awaitable = awaitable
+        self._future = None
+
+    def initial_eligible(self):
+        return False
+
+    def resume(self, future):
+        self._engine.external_waits.remove(self)
+        self._future = future
+        self._process.runnable = True
+
+    def __await__(self):
+        yield self
+        return self._future.result()
 
 
 class SimulatorContext:
@@ -510,6 +577,79 @@ class SimulatorContext:
         """
         raise NotImplementedError
 
+    def memory_load(self, memory, buffer, offset=0):
+        """Load the contents of a memory from a buffer.
+
+        The :py:`memory` may be either a :class:`~.hdl.MemoryData` or
+        a :class:`~amaranth.lib.memory.Memory`. The rows of the memory starting at :py:`offset`
+        are replaced with the contents of :py:`buffer`, which may be:
+
+        - a :class:`bytes`, :class:`bytearray`, or a :class:`memoryview` of bytes, containing
+          rows in little endian byte order, each occupying the smallest whole number of bytes
+          (e.g. 3 bytes for a 24-bit memory);
+        - any other buffer (such as an :class:`array.array` or a NumPy array) or iterable,
+          containing an integer for each row.
+
+        The values of the rows are always numeric, even if the shape of the memory is
+        a :class:`~.hdl.ShapeCastable`, and are truncated to the width of the memory. Other than
+        that, the effect is the same as calling :meth:`set` for each of the rows, but much faster.
+
+        This method is only available in testbenches.
+
+        Raises
+        ------
+        :exc:`TypeError`
+            If the caller is a process.
+        :exc:`ValueError`
+            If the rows do not fit in the memory after :py:`offset`, or if :py:`buffer` contains
+            bytes that do not form a whole number of rows.
+        """
+        raise NotImplementedError
+
+    def memory_dump(self, memory, offset=0, count=None):
+        """Read the contents of a memory.
+
+        The :py:`memory` may be either a :class:`~.hdl.MemoryData` or
+        a :class:`~amaranth.lib.memory.Memory`. Returns a :class:`list` with the numeric values of
+        :py:`count` rows starting at :py:`offset`, or of every row after :py:`offset` if
+        :py:`count` is :py:`None`.
+
+        This method is only available in testbenches.
+
+        Raises
+        ------
+        :exc:`TypeError`
+            If the caller is a process.
+        :exc:`ValueError`
+            If the requested rows are not all in the memory.
+        """
+        raise NotImplementedError
+
+    def external(self, awaitable) -> typing.Awaitable:
+        """Wait for an awaitable of the host event loop to complete.
+
+        This method returns an object that, when awaited, pauses the execution of the calling
+        testbench until :py:`awaitable` (for example, an :class:`asyncio.Future`, or a coroutine
+        that reads from an :class:`asyncio.Queue`) completes in the event loop that runs
+        :meth:`Simulator.run_async`, and returns its result or raises its exception.
+
+        The simulation time does not advance while any testbench is waiting for the host event
+        loop, so the behavior of the design does not depend on how long :py:`awaitable` takes to
+        complete. Other testbenches that are runnable at the current point in time continue
+        to execute, and the simulator yields to the host event loop instead of consuming CPU time
+        until :py:`awaitable` completes.
+
+        This method is only available in testbenches, and only if the simulation is run using
+        :meth:`Simulator.run_async`; the other methods that advance the simulation raise
+        :exc:`RuntimeError` once a testbench awaits the returned object.
+
+        Raises
+        ------
+        :exc:`TypeError`
+            If the caller is a process.
+        """
+        raise NotImplementedError
+
     @contextmanager
     def critical(self):
         """Context manager that temporarily makes the caller critical.
@@ -702,6 +842,15 @@ class ProcessContext(SimulatorContext):
         raise TypeError("`.get()` cannot be used to sample values in simulator processes; use "
                         "`.sample()` on a trigger object instead")
 
+    def memory_load(self, memory, buffer, offset=0) -> 'typing.Never':
+        raise TypeError("`.memory_load()` cannot be used in simulator processes")
+
+    def memory_dump(self, memory, offset=0, count=None) -> 'typing.Never':
+        raise TypeError("`.memory_dump()` cannot be used in simulator processes")
+
+    def external(self, awaitable) -> 'typing.Never':
+        raise TypeError("`.external()` cannot be used in simulator processes")
+
     @typing.overload
     def set(self, expr: Value, value: int) -> None: ... # :nocov:
 
@@ -709,11 +858,10 @@ class ProcessContext(SimulatorContext):
     def set(self, expr: ValueCastable, value: typing.Any) -> None: ... # :nocov:
 
     def set(self, expr, value):
-        if isinstance(expr, ValueCastable):
-            shape = expr.shape()
-            if isinstance(shape, ShapeCastable):
-                value = shape.const(value)
-        value = Const.cast(value).value
+        if _is_lane_values(value):
+            value = _cast_lane_values(expr, value)
+        else:
+            value = _cast_value(expr, value)
         self._engine.set_value(expr, value)
 
 
@@ -729,6 +877,8 @@ class TestbenchContext(SimulatorContext):
         if isinstance(expr, ValueCastable):
             shape = expr.shape()
             if isinstance(shape, ShapeCastable):
+                if _is_lane_values(value):
+                    return [shape.from_bits(int(lane_value)) for lane_value in value]
                 return shape.from_bits(value)
         return value
 
@@ -739,18 +889,38 @@ class TestbenchContext(SimulatorContext):
     def set(self, expr: ValueCastable, value: typing.Any) -> None: ... # :nocov:
 
     def set(self, expr, value):
-        if isinstance(expr, ValueCastable):
-            shape = expr.shape()
-            if isinstance(shape, ShapeCastable):
-                value = shape.const(value)
-        value = Const.cast(value).value
+        if _is_lane_values(value):
+            value = _cast_lane_values(expr, value)
+        else:
+            value = _cast_value(expr, value)
         self._engine.set_value(expr, value)
         self._engine.step_design()
 
+    def memory_load(self, memory, buffer, offset=0):
+        memory = _cast_memory(memory)
+        offset = _cast_memory_offset(memory, offset)
+        self._engine.memory_load(memory, offset, buffer)
+        self._engine.step_design()
+
+    def memory_dump(self, memory, offset=0, count=None):
+        memory = _cast_memory(memory)
+        offset = _cast_memory_offset(memory, offset)
+        if count is None:
+            count = memory.depth - offset
+        count = operator.index(count)
+        if count not in range(memory.depth - offset + 1):
+            raise ValueError(f"Cannot dump {count} rows at offset {offset} from a memory with "
+                             f"depth {memory.depth}")
+        return self._engine.memory_dump(memory, offset, count)
+
+    def external(self, awaitable):
+        return _ExternalWait(self._engine, self._process, awaitable)
+
 
 class AsyncProcess(BaseProcess):
     def __init__(self, design, engine, constructor, *, testbench, background):
         self.constructor = constructor
+        self.testbench = testbench
         if testbench:
             self.context = TestbenchContext(design, engine, self)
         else:
@@ -766,6 +936,20 @@ class AsyncProcess(BaseProcess):
         self.coroutine = self.constructor(self.context)
         self.first_await = True
 
+    def restart(self, *, finished):
+        # The state of a coroutine cannot be captured, so when a snapshot of the simulation is
+        # restored, the process is either restarted or, if it had finished when the snapshot was
+        # taken, finished again.
+        if self.coroutine is not None:
+            self.coroutine.close()
+        if finished:
+            self.runnable = False
+            self.critical = False
+            self.waits_on = None
+            self.coroutine = None
+        else:
+            self.reset()
+
     def run(self):
         try:
             self.waits_on = self.coroutine.send(None)
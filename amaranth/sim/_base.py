@@ -50,6 +50,8 @@ class BaseEngineState:
         raise NotImplementedError # :nocov:
 
     slots = NotImplemented
+    curr = NotImplemented
+    next = NotImplemented
 
     def set_delay_waker(self, interval, waker):
         raise NotImplementedError # :nocov:
@@ -57,6 +59,9 @@ class BaseEngineState:
     def add_signal_waker(self, signal, waker):
         raise NotImplementedError # :nocov:
 
+    def add_edge_waker(self, signal, bit, polarity, *, process=None, waker=None):
+        raise NotImplementedError # :nocov:
+
     def add_memory_waker(self, memory, waker):
         raise NotImplementedError # :nocov:
 
@@ -85,17 +90,36 @@ class BaseEngine:
     def add_trigger_combination(self, combination, *, oneshot):
         raise NotImplementedError # :nocov:
 
+    @property
+    def external_waits(self):
+        raise NotImplementedError # :nocov:
+
     def get_value(self, expr):
         raise NotImplementedError # :nocov:
 
     def set_value(self, expr, value):
         raise NotImplementedError # :nocov:
 
+    def memory_load(self, memory, offset, buffer):
+        raise NotImplementedError # :nocov:
+
+    def memory_dump(self, memory, offset, count):
+        raise NotImplementedError # :nocov:
+
     def step_design(self):
         raise NotImplementedError # :nocov:
 
-    def advance(self):
+    def advance(self, *, deadline=None):
+        raise NotImplementedError # :nocov:
+
+    def snapshot(self):
+        raise NotImplementedError # :nocov:
+
+    def restore(self, snapshot):
+        raise NotImplementedError # :nocov:
+
+    def write_vcd(self, *, vcd_file, gtkw_file, traces, fs_per_delta, window, trigger):
         raise NotImplementedError # :nocov:
 
-    def write_vcd(self, *, vcd_file, gtkw_file, traces, fs_per_delta):
+    def profile(self):
         raise NotImplementedError # :nocov:
@@ -0,0 +1,175 @@
+import os
+import traceback
+import multiprocessing
+
+from ..hdl import Period
+from .core import Simulator
+
+
+__all__ = ["BatchResult", "run_batch"]
+
+
+class BatchResult:
+    """Result of a simulation run by :func:`run_batch`.
+
+    Attributes
+    ----------
+    parameter : object
+        The parameter the testbench was called with.
+    value : object
+        The value returned by the testbench, or :py:`None` if it raised an exception.
+    failure : :class:`str` or None
+        The traceback of the exception raised by the simulation, or :py:`None` if it completed.
+    vcd_file : :class:`str` or None
+        The path of the waveform file written for this run, if any.
+    """
+    def __init__(self, parameter, *, value=None, failure=None, vcd_file=None):
+        self.parameter = parameter
+        self.value     = value
+        self.failure   = failure
+        self.vcd_file  = vcd_file
+
+    @property
+    def passed(self):
+        """:py:`True` if the simulation completed without raising an exception."""
+        return self.failure is None
+
+    def __repr__(self):
+        if self.passed:
+            return f"BatchResult({self.parameter!r}, value={self.value!r})"
+        else:
+            return f"BatchResult({self.parameter!r}, failed)"
+
+
+class _BatchWorker:
+    def __init__(self, design, testbench, *, setup, deadline, vcd_dir, engine_options):
+        self.dut = design()
+        self.sim = Simulator(self.dut, **engine_options)
+        if setup is not None:
+            setup(self.sim, self.dut)
+
+        self.deadline = deadline
+        self.vcd_dir  = vcd_dir
+
+        # The simulator is constructed and set up once, and restored to the state it had after
+        # the setup before each run. Any warm-up performed by the setup (e.g. booting a simulated
+        # system) is therefore also done once, and, if worker processes are forked, only in
+        # the parent process.
+        self.snapshot  = self.sim.snapshot()
+        self.started   = Period(fs=self.sim._engine.now)
+        self.testbench = testbench
+        self.value     = None
+
+    def _run(self):
+        if self.deadline is None:
+            self.sim.run()
+        else:
+            self.sim.run_until(self.started + self.deadline)
+
+    def run(self, index, parameter):
+        self.sim.restore(self.snapshot)
+        async def batch_testbench(ctx):
+            self.value = await self.testbench(ctx, self.dut, parameter)
+        self.sim.add_testbench(batch_testbench)
+
+        self.value = None
+        vcd_file = None
+        try:
+            if self.vcd_dir is not None:
+                vcd_file = os.path.join(self.vcd_dir, f"{index}.vcd")
+                with self.sim.write_vcd(vcd_file):
+                    self._run()
+            else:
+                self._run()
+        except Exception:
+            return BatchResult(parameter, failure=traceback.format_exc(), vcd_file=vcd_file)
+        return BatchResult(parameter, value=self.value, vcd_file=vcd_file)
+
+
+# The worker of the current process. When workers are forked, it is created by the parent process
+# before the pool is, and inherited by every worker.
+_worker = None
+
+
+def _init_worker(args, kwargs):
+    global _worker
+    if _worker is None:
+        _worker = _BatchWorker(*args, **kwargs)
+
+
+def _run_in_worker(item):
+    return _worker.run(*item)
+
+
+def run_batch(design, testbench, parameters, *, setup=None, processes=None, vcd_dir=None,
+              deadline=None, **engine_options):
+    """Run a testbench once for each of many parameters, in parallel.
+
+    The :py:`design` argument is a function (or a class) that is called without arguments
+    to construct the design under test, once in each worker process. The design is simulated
+    by a :class:`Simulator` that is created once in each worker process. If :py:`setup` is
+    provided, it is called with the simulator and the design before the first run, and may be
+    used to add clocks or processes, or to advance the simulation: ::
+
+        def setup(sim, dut):
+            sim.add_clock(Period(MHz=1))
+            sim.add_testbench(boot)
+            sim.run()
+
+    Before each run, the simulation is restored to a :meth:`snapshot <Simulator.snapshot>` taken
+    after the setup, so each run starts from the state it left the simulation in.
+
+    For each element of :py:`parameters`, the :py:`testbench` is called with the simulator
+    context, the design, and the parameter: ::
+
+        async def testbench(ctx, dut, seed):
+            rng = random.Random(seed)
+            ...
+            return n_transactions
+
+        results = run_batch(MyDesign, testbench, range(1000), setup=setup)
+
+    Each simulation runs until the testbench returns, or for :py:`deadline` (a :class:`Period`)
+    if specified. If :py:`vcd_dir` is specified, the waveforms of the run with the parameter at
+    index :py:`i` are written to :py:`{vcd_dir}/{i}.vcd`; this is only possible if the setup does
+    not advance the simulation time.
+
+    The runs are distributed across :py:`processes` worker processes (by default, one per CPU).
+    Where possible, worker processes are forked after the parent process constructs, compiles,
+    and sets up the design, which avoids repeating this work in each worker; otherwise, :py:`design`,
+    :py:`testbench`, and :py:`setup` must be picklable. If :py:`processes` is 1, every run
+    happens in the calling process. In all cases, the parameters and the values returned by
+    the testbench must be picklable.
+
+    Any additional keyword arguments are passed to :class:`Simulator`.
+
+    Returns
+    -------
+    :class:`list` of :class:`BatchResult`
+        The result of each run, in the same order as :py:`parameters`. Exceptions raised by
+        the simulation are recorded in the result rather than propagated.
+    """
+    parameters = list(parameters)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(parameters)))
+    if vcd_dir is not None:
+        os.makedirs(vcd_dir, exist_ok=True)
+
+    args = (design, testbench)
+    kwargs = dict(setup=setup, deadline=deadline, vcd_dir=vcd_dir, engine_options=engine_options)
+    if processes == 1:
+        worker = _BatchWorker(*args, **kwargs)
+        return [worker.run(index, parameter) for index, parameter in enumerate(parameters)]
+
+    global _worker
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        _worker = _BatchWorker(*args, **kwargs)
+    else: # :nocov:
+        context = multiprocessing.get_context()
+    try:
+        with context.Pool(processes, initializer=_init_worker, initargs=(args, kwargs)) as pool:
+            return pool.map(_run_in_worker, enumerate(parameters), chunksize=1)
+    finally:
+        _worker = None
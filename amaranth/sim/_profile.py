@@ -0,0 +1,204 @@
+import json
+import time
+
+
+__all__ = ["SimulationProfile"]
+
+
+class SimulationProfile:
+    """Profile of a simulation, collected by :meth:`Simulator.profile`.
+
+    A profile describes where the simulator spends its time: how often each part of the design,
+    each process, and each testbench runs and for how long, how many delta cycles each timestep
+    takes to converge, and which signals change most often.
+
+    The attributes of a profile are filled in when the :meth:`Simulator.profile` context manager
+    exits.
+
+    Each entry of :py:`runnables` is a :class:`dict` with the following keys:
+
+    * :py:`"kind"`: one of :py:`"rtl"` (logic compiled from the design), :py:`"clock"`
+      (a clock added with :meth:`Simulator.add_clock`), :py:`"process"`, :py:`"testbench"`, or
+      :py:`"trigger"` (an awaited trigger being sampled on behalf of a process or a testbench);
+    * :py:`"name"`: the hierarchical name of the fragment, the name of the clock signal, or
+      the qualified name of the process or testbench function;
+    * :py:`"domain"`: the clock domain of the logic, or :py:`None`;
+    * :py:`"activations"`: the number of times it ran;
+    * :py:`"time"`: the wall time, in seconds, spent running it, excluding the time spent
+      running other entries (e.g. the design logic run while a testbench sets a signal);
+    * :py:`"commits"`: the number of signal and memory updates it queued.
+
+    Attributes
+    ----------
+    elapsed : :class:`float`
+        The wall time, in seconds, during which the profile was collected.
+    timesteps : :class:`int`
+        The number of timesteps simulated.
+    delta_cycles : :class:`dict` of :class:`int` to :class:`int`
+        For each number of delta cycles, the number of timesteps that took this many delta cycles
+        to converge.
+    runnables : :class:`list` of :class:`dict`
+        Statistics for each part of the design, process, testbench, and trigger that ran,
+        in the order of decreasing time.
+    signals : :class:`dict` of :class:`str` to :class:`int`
+        For each signal or memory that was updated, the number of times it was updated, in
+        the order of decreasing count.
+    """
+    def __init__(self):
+        self.elapsed      = 0.0
+        self.timesteps    = 0
+        self.delta_cycles = {}
+        self.runnables    = []
+        self.signals      = {}
+
+    def to_json(self):
+        """Serialize the profile.
+
+        Returns
+        -------
+        :class:`str`
+            A JSON object with the keys :py:`"elapsed"`, :py:`"timesteps"`, :py:`"delta_cycles"`,
+            :py:`"runnables"`, and :py:`"signals"`, each corresponding to an attribute.
+        """
+        return json.dumps({
+            "elapsed": self.elapsed,
+            "timesteps": self.timesteps,
+            "delta_cycles": self.delta_cycles,
+            "runnables": self.runnables,
+            "signals": self.signals,
+        }, indent=2)
+
+    def format(self, top=10):
+        """Format the profile as a table.
+
+        Parameters
+        ----------
+        top : :class:`int`
+            Number of entries to include in the lists of the slowest runnables and of
+            the most frequently updated signals.
+
+        Returns
+        -------
+        :class:`str`
+            A human-readable summary of the profile.
+        """
+        total_deltas = sum(count * times for count, times in self.delta_cycles.items())
+        lines = [
+            f"elapsed {self.elapsed:.6f} s, {self.timesteps} timesteps, "
+            f"{total_deltas} delta cycles",
+            "",
+            f"{'time, s':>10} {'%':>6} {'runs':>10} {'commits':>10}  {'kind':<9}  name",
+        ]
+        for entry in self.runnables[:top]:
+            share = 100 * entry["time"] / self.elapsed if self.elapsed else 0
+            name = entry["name"]
+            if entry["domain"] is not None:
+                name = f"{name} ({entry['domain']})"
+            lines.append(f"{entry['time']:>10.6f} {share:>6.1f} {entry['activations']:>10} "
+                         f"{entry['commits']:>10}  {entry['kind']:<9}  {name}")
+        lines += ["", f"{'commits':>10}  signal"]
+        for name, count in list(self.signals.items())[:top]:
+            lines.append(f"{count:>10}  {name}")
+        lines += ["", f"{'deltas':>10} {'timesteps':>10}"]
+        for count, times in sorted(self.delta_cycles.items()):
+            lines.append(f"{count:>10} {times:>10}")
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return (f"SimulationProfile(elapsed={self.elapsed:.6f}, timesteps={self.timesteps}, "
+                f"runnables={len(self.runnables)}, signals={len(self.signals)})")
+
+
+class _ProfileEntry:
+    __slots__ = ("kind", "name", "domain", "activations", "time", "commits")
+
+    def __init__(self, kind, name, domain):
+        self.kind        = kind
+        self.name        = name
+        self.domain      = domain
+        self.activations = 0
+        self.time        = 0.0
+        self.commits     = 0
+
+
+class Profiler:
+    # Collects the statistics of a `SimulationProfile`. The engine runs processes, testbenches,
+    # and triggers through `run()` while a profiler is installed; `describe_runnable` and
+    # `describe_state` map those and the slots of signals (or memories) to names.
+    def __init__(self, *, describe_runnable, describe_state):
+        self.describe_runnable = describe_runnable
+        self.describe_state    = describe_state
+
+        self.entries = {}
+        self.updates = {}
+        self.delta_cycles = {}
+        self.timesteps = 0
+
+        self.current = None
+        self.nested  = 0.0
+        self.started = time.perf_counter()
+
+        self.profile = SimulationProfile()
+
+    def run(self, runnable, pending, *, key=None):
+        # Statistics of runnables with the same `key` (by default, the runnable itself) are
+        # combined; e.g. every trigger awaited by a process shares one entry.
+        if key is None:
+            key = runnable
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _ProfileEntry(*self.describe_runnable(runnable))
+        entry.activations += 1
+
+        outer_entry, outer_nested = self.current, self.nested
+        self.current, self.nested = entry, 0.0
+        queued = len(pending)
+        started = time.perf_counter()
+        try:
+            runnable.run()
+        finally:
+            elapsed = time.perf_counter() - started
+            # Testbenches commit the updates they queue immediately, so these are counted in
+            # `step()` instead.
+            entry.commits += max(0, len(pending) - queued)
+            entry.time += elapsed - self.nested
+            self.current, self.nested = outer_entry, outer_nested + elapsed
+
+    def step(self, pending):
+        # Updates pending at the start of a delta cycle were queued by the testbench (if any)
+        # that is currently running.
+        if self.current is not None:
+            self.current.commits += len(pending)
+
+    def commit(self, pending):
+        for index in pending:
+            self.updates[index] = self.updates.get(index, 0) + 1
+
+    def timestep(self, delta_cycles):
+        self.timesteps += 1
+        self.delta_cycles[delta_cycles] = self.delta_cycles.get(delta_cycles, 0) + 1
+
+    def stop(self):
+        profile = self.profile
+        profile.elapsed = time.perf_counter() - self.started
+        profile.timesteps = self.timesteps
+        profile.delta_cycles = dict(sorted(self.delta_cycles.items()))
+        profile.runnables = [
+            {
+                "kind": entry.kind,
+                "name": entry.name,
+                "domain": entry.domain,
+                "activations": entry.activations,
+                "time": entry.time,
+                "commits": entry.commits,
+            }
+            for entry in sorted(self.entries.values(), key=lambda entry: -entry.time)
+        ]
+        signals = {}
+        for index, count in self.updates.items():
+            name = self.describe_state(index)
+            signals[name] = signals.get(name, 0) + count
+        profile.signals = dict(sorted(signals.items(), key=lambda item: -item[1]))
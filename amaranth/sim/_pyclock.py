@@ -20,18 +20,29 @@ class PyClockProcess(BaseProcess):
         self.critical = False
 
         self.initial = True
+        # The point in time at which the clock first toggled, or `None` if it has not yet.
+        self.started = None
 
-    def run(self):
-        self.runnable = False
+    def snapshot(self):
+        return (self.runnable, self.critical, self.initial, self.started)
+
+    def restore(self, snapshot):
+        self.runnable, self.critical, self.initial, self.started = snapshot
 
-        def waker():
+    def waker(self):
+        if not self.runnable:
             self.runnable = True
+            self.state.ready.append(self)
+
+    def run(self):
+        self.runnable = False
 
         if self.initial:
             self.initial = False
-            self.state.set_delay_waker(self.phase, waker)
+            self.state.set_delay_waker(self.phase, self.waker)
 
         else:
-            clk_state = self.state.slots[self.slot]
-            clk_state.update(not clk_state.curr)
-            self.state.set_delay_waker(self.period // 2, waker)
+            if self.started is None:
+                self.started = self.state.timeline.now
+            self.state.slots[self.slot].update(1 ^ self.state.curr[self.slot])
+            self.state.set_delay_waker(self.period // 2, self.waker)
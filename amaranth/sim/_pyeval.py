@@ -3,7 +3,8 @@ from amaranth.hdl._mem import MemoryData
 from amaranth.hdl._ir import DriverConflict
 
 
-__all__ = ["eval_value", "eval_format", "eval_assign"]
+__all__ = ["eval_value", "eval_format", "eval_format_chunks", "format_chunks",
+           "eval_assign"]
 
 
 def _eval_matches(test, patterns):
@@ -122,7 +123,7 @@ def eval_value(sim, value):
         return 0
     elif isinstance(value, Signal):
         slot = sim.get_signal(value)
-        return sim.slots[slot].curr
+        return sim.curr[slot]
     elif isinstance(value, MemoryData._Row):
         slot = sim.get_memory(value._memory)
         return sim.slots[slot].read(value._index)
@@ -144,14 +145,24 @@ def value_to_string(value):
 
 
 def eval_format(sim, fmt):
-    fmt = Format("{}", fmt)
+    return eval_format_chunks(sim, Format("{}", fmt)._chunks)
+
+
+def eval_format_chunks(sim, fmt_chunks):
+    return format_chunks(fmt_chunks, [eval_value(sim, chunk[0])
+                                      for chunk in fmt_chunks if not isinstance(chunk, str)])
+
+
+def format_chunks(fmt_chunks, values):
+    """Format the chunks of a format, given the values of the chunks that are not strings."""
+    values = iter(values)
     chunks = []
-    for chunk in fmt._chunks:
+    for chunk in fmt_chunks:
         if isinstance(chunk, str):
             chunks.append(chunk)
         else:
-            value, spec = chunk
-            value = eval_value(sim, value)
+            _, spec = chunk
+            value = next(values)
             if spec.endswith("s"):
                 chunks.append(format(value_to_string(value), spec[:-1]))
             else:
@@ -171,7 +182,7 @@ def _eval_assign_inner(sim, lhs, lhs_start, rhs, rhs_len):
         slot = sim.get_signal(lhs)
         if sim.slots[slot].is_comb:
             raise DriverConflict("Combinationally driven signals cannot be overriden by testbenches")
-        value = sim.slots[slot].next
+        value = sim.next[slot]
         mask = (1 << lhs_stop) - (1 << lhs_start)
         value &= ~mask
         value |= (rhs << lhs_start) & mask
@@ -0,0 +1,217 @@
+# Support for simulating many instances ("lanes") of a design in lockstep. The code generated by
+# `_pyrtl` operates on NumPy arrays with one element per lane instead of Python integers, so one
+# evaluation of a process serves every lane.
+
+import numpy
+
+from ..hdl import *
+from ._base import BaseSignalState, BaseMemoryState
+from .pysim import _run_wakers, _PyEdgeWakers
+
+
+__all__ = ["MAX_WIDTH", "helpers", "uniform", "PyLaneEdgeWakers", "PyLaneSignalState",
+           "PyLaneMemoryState"]
+
+
+# Values are stored as `numpy.int64`, which can represent every value of a signed or unsigned
+# shape that is at most this wide.
+MAX_WIDTH = 63
+
+
+def _parity(value):
+    for shift in (32, 16, 8, 4, 2, 1):
+        value = value ^ (value >> shift)
+    return value & 1
+
+
+def helpers(lanes):
+    def broadcast(value):
+        if numpy.ndim(value) == 0:
+            return numpy.full(lanes, value, dtype=numpy.int64)
+        return value
+
+    def zdiv(lhs, rhs):
+        return numpy.where(rhs == 0, 0, lhs // numpy.where(rhs == 0, 1, rhs))
+
+    def zmod(lhs, rhs):
+        return numpy.where(rhs == 0, 0, lhs % numpy.where(rhs == 0, 1, rhs))
+
+    def active_lanes(mask):
+        return numpy.flatnonzero(numpy.broadcast_to(mask, lanes)).tolist()
+
+    return {
+        "sign": lambda value, sign: numpy.where(value & sign, value | sign, value),
+        "zdiv": zdiv,
+        "zmod": zmod,
+        "parity": _parity,
+        "where": numpy.where,
+        "broadcast": broadcast,
+        "any_lane": numpy.any,
+        "active_lanes": active_lanes,
+    }
+
+
+def uniform(value, signal):
+    # Clock edges cannot happen in only some of the lanes, since every lane runs the same processes
+    # at the same time.
+    value = numpy.asarray(value)
+    if value.ndim == 0:
+        return int(value)
+    first = value[0]
+    if (value != first).any():
+        raise ValueError(f"Signal {signal!r} is used as a clock or in an edge trigger, and must "
+                         f"have the same value in every lane")
+    return int(first)
+
+
+class PyLaneEdgeWakers(_PyEdgeWakers):
+    __slots__ = ("signal",)
+
+    def __init__(self, signal, ready):
+        super().__init__(ready)
+        self.signal = signal
+
+    def __call__(self, curr, next):
+        for (bit, polarity), (processes, wakers) in self.groups.items():
+            curr_bit = uniform((curr >> bit) & 1, self.signal)
+            next_bit = uniform((next >> bit) & 1, self.signal)
+            if curr_bit != next_bit and next_bit == polarity:
+                self._wake(processes, wakers)
+        return True
+
+
+class PyLaneSignalState(BaseSignalState):
+    # As with `_PySignalState`, the values are stored in the lists of the engine state.
+    __slots__ = ("signal", "is_comb", "wakers", "edge_wakers", "state", "index", "lanes")
+
+    def __init__(self, signal, state, index, *, lanes):
+        if len(signal) > MAX_WIDTH:
+            raise OverflowError(f"Signal {signal!r} is {len(signal)} bits wide, which is more than "
+                                f"the {MAX_WIDTH} bits supported when simulating with lanes")
+        self.signal  = signal
+        self.is_comb = False
+        self.state   = state
+        self.index   = index
+        self.wakers  = list()
+        self.edge_wakers = None
+        self.lanes   = lanes
+        self.reset()
+
+    @property
+    def curr(self):
+        return self.state.curr[self.index]
+
+    @property
+    def next(self):
+        return self.state.next[self.index]
+
+    def reset(self):
+        # The arrays are replaced rather than modified when the signal is updated.
+        self.state.curr[self.index] = self.state.next[self.index] = \
+            numpy.full(self.lanes, self.signal.init, dtype=numpy.int64)
+
+    def add_waker(self, waker):
+        assert waker not in self.wakers
+        self.wakers.append(waker)
+
+    def add_edge_waker(self, bit, polarity, *, process=None, waker=None):
+        if self.edge_wakers is None:
+            self.edge_wakers = PyLaneEdgeWakers(self.signal, self.state.ready)
+            self.add_waker(self.edge_wakers)
+        if process is not None:
+            self.edge_wakers.add_process(bit, polarity, process)
+        if waker is not None:
+            self.edge_wakers.add_waker(bit, polarity, waker)
+
+    def update(self, value, mask=~0):
+        next, index = self.state.next, self.index
+        value = (next[index] & ~mask) | (value & mask)
+        if (next[index] != value).any():
+            next[index] = value
+            self.state.mark(index)
+
+    def commit(self):
+        curr, index = self.state.curr, self.index
+        value = self.state.next[index]
+        if numpy.array_equal(curr[index], value):
+            return False
+
+        _run_wakers(self.wakers, curr[index], value)
+
+        curr[index] = value
+        return True
+
+
+class PyLaneMemoryState(BaseMemoryState):
+    __slots__ = ("memory", "shape", "data", "write_queue", "wakers", "state", "index", "lanes")
+
+    def __init__(self, memory, state, index, *, lanes):
+        self.memory  = memory
+        self.shape   = Shape.cast(memory.shape)
+        if self.shape.width > MAX_WIDTH:
+            raise OverflowError(f"Memory {memory!r} is {self.shape.width} bits wide, which is more "
+                                f"than the {MAX_WIDTH} bits supported when simulating with lanes")
+        self.state   = state
+        self.index   = index
+        self.wakers  = list()
+        self.lanes   = lanes
+        self.reset()
+
+    def reset(self):
+        # The rows are the first axis, so that reading a row for every lane is a contiguous copy.
+        init = numpy.array(self.memory._init._raw, dtype=numpy.int64).reshape(-1, 1)
+        self.data = numpy.repeat(init, self.lanes, axis=1)
+        # Writes are queued as `(addr, value, mask)` and applied in order when committed.
+        self.write_queue = []
+
+    def snapshot(self):
+        return (self.data.copy(), self.write_queue.copy())
+
+    def restore(self, snapshot):
+        data, write_queue = snapshot
+        self.data = data.copy()
+        self.write_queue = write_queue.copy()
+
+    def add_waker(self, waker):
+        assert waker not in self.wakers
+        self.wakers.append(waker)
+
+    def read(self, addr):
+        if numpy.ndim(addr) == 0:
+            if addr in range(self.memory.depth):
+                return self.data[addr].copy()
+            return numpy.zeros(self.lanes, dtype=numpy.int64)
+        in_range = addr < self.memory.depth
+        value = self.data[numpy.where(in_range, addr, 0), numpy.arange(self.lanes)]
+        return numpy.where(in_range, value, 0)
+
+    def write(self, addr, value, mask=None):
+        self.write_queue.append((addr, value, mask))
+        self.state.mark(self.index)
+
+    def commit(self):
+        assert self.write_queue # `commit()` is only called if `self` is pending
+
+        _run_wakers(self.wakers)
+
+        changed = False
+        lanes = numpy.arange(self.lanes)
+        for addr, value, mask in self.write_queue:
+            addr  = numpy.broadcast_to(addr, self.lanes)
+            value = numpy.broadcast_to(value, self.lanes)
+            in_range = addr < self.memory.depth
+            addr, value, index = addr[in_range], value[in_range], lanes[in_range]
+            prev_value = self.data[addr, index]
+            if mask is not None:
+                mask  = numpy.broadcast_to(mask, self.lanes)[in_range]
+                value = (value & mask) | (prev_value & ~mask)
+            if self.shape.signed:
+                sign  = 1 << (self.shape.width - 1)
+                value = numpy.where(value & sign, value | -sign, value & (sign - 1))
+            else:
+                value = value & ((1 << self.shape.width) - 1)
+            if (prev_value != value).any():
+                self.data[addr, index] = value
+                changed = True
+        self.write_queue.clear()
+        return changed
@@ -0,0 +1,201 @@
+# Storage for the contents of memories simulated by the Python simulator.
+#
+# Memories are stored in an `array.array` with the smallest element type that fits every row, or in
+# a `list` if there is no such element type. Memories with at least `SPARSE_DEPTH` rows are stored
+# in a `SparseStorage` instead, which only allocates the pages of the memory that are written to.
+#
+# Every kind of storage supports indexing and `copy.copy()`, as well as loading and dumping ranges
+# of rows using `load_rows()` and `dump_rows()`. Copying an `array.array` or a `list` copies every
+# row, which is why `_PyMemoryState` only copies the storage the first time it is written to after
+# a reset or a restore; since dense storage is only used for memories with fewer than
+# `SPARSE_DEPTH` rows, such a copy is bounded to a few hundred kilobytes.
+
+import sys
+from array import array
+
+from ..hdl import Shape
+
+
+__all__ = ["SparseStorage", "memory_storage", "rows_from_buffer", "load_rows", "dump_rows"]
+
+
+SPARSE_DEPTH = 1 << 16
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+
+def _typecode(shape):
+    for typecode in ("bhiq" if shape.signed else "BHIQ"):
+        if array(typecode).itemsize * 8 >= shape.width:
+            return typecode
+    return None
+
+
+class SparseStorage:
+    # Rows of a page that was never written to all have the same initial value, `init[page_index]`;
+    # pages whose rows have different initial values (usually, only the first few pages) are
+    # allocated in `pages` when the storage is created. A page is also allocated when it is first
+    # written to. Copies of the storage share pages until a page is written to by either of them.
+    def __init__(self, depth, init, pages, typecode):
+        self.depth    = depth
+        self.init     = init
+        self.typecode = typecode
+        self.pages    = pages
+        self.owned    = set()
+
+    @classmethod
+    def from_rows(cls, rows, typecode):
+        init  = []
+        pages = {}
+        for page_index, start in enumerate(range(0, len(rows), PAGE_SIZE)):
+            page = rows[start:start + PAGE_SIZE]
+            if page.count(page[0]) == len(page):
+                init.append(page[0])
+            else:
+                init.append(None)
+                pages[page_index] = page if typecode is None else array(typecode, page)
+        return cls(len(rows), init, pages, typecode)
+
+    def __len__(self):
+        return self.depth
+
+    def __getitem__(self, addr):
+        page = self.pages.get(addr >> PAGE_BITS)
+        if page is None:
+            return self.init[addr >> PAGE_BITS]
+        return page[addr & PAGE_MASK]
+
+    def __setitem__(self, addr, value):
+        page_index = addr >> PAGE_BITS
+        if page_index in self.owned:
+            page = self.pages[page_index]
+        else:
+            page = self.pages.get(page_index)
+            if page is None:
+                count = min(PAGE_SIZE, self.depth - (page_index << PAGE_BITS))
+                page = [self.init[page_index]] * count
+                if self.typecode is not None:
+                    page = array(self.typecode, page)
+            else:
+                page = page[:]
+            self.pages[page_index] = page
+            self.owned.add(page_index)
+        page[addr & PAGE_MASK] = value
+
+    def _owned_page(self, page_index):
+        if page_index not in self.owned:
+            # Writing the first row of the page copies (or allocates) it.
+            self[page_index << PAGE_BITS] = self[page_index << PAGE_BITS]
+        return self.pages[page_index]
+
+    def load(self, start, rows):
+        pos = 0
+        while pos < len(rows):
+            addr = start + pos
+            page = self._owned_page(addr >> PAGE_BITS)
+            count = min(PAGE_SIZE - (addr & PAGE_MASK), len(rows) - pos)
+            page[addr & PAGE_MASK:(addr & PAGE_MASK) + count] = rows[pos:pos + count]
+            pos += count
+
+    def dump(self, start, stop):
+        rows = [] if self.typecode is None else array(self.typecode)
+        addr = start
+        while addr < stop:
+            page_index = addr >> PAGE_BITS
+            count = min(PAGE_SIZE - (addr & PAGE_MASK), stop - addr)
+            page = self.pages.get(page_index)
+            if page is None:
+                rows.extend([self.init[page_index]] * count)
+            else:
+                rows.extend(page[addr & PAGE_MASK:(addr & PAGE_MASK) + count])
+            addr += count
+        return rows
+
+    def __copy__(self):
+        other = SparseStorage(self.depth, self.init, self.pages.copy(), self.typecode)
+        # The pages are now shared, and must be copied by this storage too before writing to them.
+        self.owned.clear()
+        return other
+
+
+def memory_storage(memory):
+    """Create the storage for the initial contents of :py:`memory`, a :class:`MemoryData`."""
+    init = memory._init._raw
+    typecode = _typecode(Shape.cast(memory.shape))
+    if memory.depth >= SPARSE_DEPTH:
+        return SparseStorage.from_rows(init, typecode)
+    elif typecode is None:
+        return list(init)
+    else:
+        return array(typecode, init)
+
+
+def rows_from_buffer(shape, buffer):
+    """Convert :py:`buffer` to a sequence of rows of a memory with the given :py:`shape`.
+
+    A :class:`bytes`, :class:`bytearray`, or a :class:`memoryview` of bytes contains rows packed
+    in little endian order, each one occupying the smallest whole number of bytes. Any other
+    buffer (e.g. an :class:`array.array` or a NumPy array) or iterable contains an integer for each
+    row. Row values are truncated to the width of the memory, the same as with :py:`ctx.set()`.
+    """
+    typecode = _typecode(shape)
+    width = shape.width
+    if isinstance(buffer, (bytes, bytearray)) or \
+            (isinstance(buffer, memoryview) and buffer.itemsize == 1 and buffer.format in "Bbc"):
+        buffer = memoryview(buffer).cast("B")
+        row_bytes = (width + 7) // 8
+        if row_bytes == 0:
+            raise ValueError("Cannot load bytes into a memory with zero-width rows")
+        if len(buffer) % row_bytes != 0:
+            raise ValueError(f"Buffer length {len(buffer)} is not a multiple of the row size "
+                             f"({row_bytes} bytes)")
+        if typecode is not None and width == array(typecode).itemsize * 8:
+            rows = array(typecode)
+            rows.frombytes(buffer)
+            if sys.byteorder == "big": # :nocov:
+                rows.byteswap()
+            return rows
+        rows = [int.from_bytes(buffer[offset:offset + row_bytes], "little")
+                for offset in range(0, len(buffer), row_bytes)]
+    else:
+        try:
+            view = memoryview(buffer)
+        except TypeError:
+            view = None
+        if (view is not None and typecode is not None and view.ndim == 1 and
+                view.c_contiguous and view.format.lstrip("@") in "bhilqBHILQ" and
+                view.format[-1].islower() == shape.signed and
+                width == view.itemsize * 8 == array(typecode).itemsize * 8):
+            # Same element type and width as the storage; copy the memory contents as-is.
+            rows = array(typecode)
+            rows.frombytes(view.cast("B"))
+            return rows
+        if hasattr(buffer, "tolist"):
+            buffer = buffer.tolist()
+        rows = list(buffer)
+    mask = (1 << width) - 1
+    if shape.signed:
+        sign = 1 << (width - 1)
+        rows = [((row & mask) ^ sign) - sign for row in rows]
+    else:
+        rows = [row & mask for row in rows]
+    if typecode is not None:
+        rows = array(typecode, rows)
+    return rows
+
+
+def load_rows(storage, start, rows):
+    """Write :py:`rows`, converted by :func:`rows_from_buffer`, to :py:`storage` at :py:`start`."""
+    if isinstance(storage, SparseStorage):
+        storage.load(start, rows)
+    else:
+        storage[start:start + len(rows)] = rows
+
+
+def dump_rows(storage, start, stop):
+    """Read rows :py:`start` to :py:`stop` (exclusive) from :py:`storage`."""
+    if isinstance(storage, SparseStorage):
+        return storage.dump(start, stop)
+    return storage[start:stop]
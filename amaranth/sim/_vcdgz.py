@@ -0,0 +1,164 @@
+# Indexed, compressed VCD files.
+#
+# An indexed VCD file is a sequence of gzip members, and decompresses (e.g. with `zcat`) to a valid
+# VCD file. The members are:
+#
+# 1. The header, with the `$dumpvars` section and the value changes that follow it;
+# 2. Any number of blocks, each starting with a timestamp and a `$dumpall` section with the value of
+#    every variable at that time, so that a block can be read without reading the ones before it;
+# 3. The index, a `$comment` section listing the timestamp and file offset at which each block
+#    starts, as lines of `amaranth-index <timestamp> <offset>`;
+# 4. The footer, an empty member whose extra field `Am` holds the file offset of the index as
+#    a 64-bit little-endian integer. The footer is always the last `FOOTER_SIZE` bytes of the file.
+
+import struct
+import zlib
+
+from ..hdl import Period
+
+
+__all__ = ["IndexedGzipFile", "read_index", "read_vcd", "read_vcd_gz"]
+
+
+# Header with the FEXTRA flag, no timestamp, and an unknown OS, followed by an extra field with one
+# subfield; an empty deflate stream; CRC32 and size of the empty payload.
+_FOOTER_FORMAT = "<2sBBIBBH2sHQ2sII"
+FOOTER_SIZE = struct.calcsize(_FOOTER_FORMAT)
+
+
+def _footer(index_offset):
+    return struct.pack(_FOOTER_FORMAT, b"\x1f\x8b", 8, 0x04, 0, 0, 255, 12,
+                       b"Am", 8, index_offset, b"\x03\x00", 0, 0)
+
+
+class IndexedGzipFile:
+    def __init__(self, file):
+        self.name = getattr(file, "name", None)
+        self.file = file
+        self.index = []
+        self._compressor = None
+
+    def _begin_member(self):
+        self._compressor = zlib.compressobj(wbits=31)
+
+    def _end_member(self):
+        if self._compressor is not None:
+            self.file.write(self._compressor.flush())
+            self._compressor = None
+
+    def write(self, text):
+        if self._compressor is None:
+            self._begin_member()
+        self.file.write(self._compressor.compress(text.encode()))
+
+    def begin_block(self, timestamp):
+        self._end_member()
+        self.index.append((timestamp, self.file.tell()))
+        self._begin_member()
+
+    def flush(self):
+        self.file.flush()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self._end_member()
+        index_offset = self.file.tell()
+        self._begin_member()
+        self.write("$comment\n")
+        for timestamp, offset in self.index:
+            self.write(f"amaranth-index {timestamp} {offset}\n")
+        self.write("$end\n")
+        self._end_member()
+        self.file.write(_footer(index_offset))
+        self.file.close()
+
+
+def _read_member(file, offset):
+    # Returns the decompressed text of the member at `offset`, and the offset of the next member.
+    file.seek(offset)
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = []
+    while not decompressor.eof:
+        data = file.read(65536)
+        if not data:
+            raise ValueError("Indexed VCD file is truncated")
+        chunks.append(decompressor.decompress(data))
+    return b"".join(chunks).decode(), file.tell() - len(decompressor.unused_data)
+
+
+def _read_index_offset(file):
+    file.seek(-FOOTER_SIZE, 2)
+    footer = struct.unpack(_FOOTER_FORMAT, file.read(FOOTER_SIZE))
+    if footer[0] != b"\x1f\x8b" or footer[7] != b"Am":
+        raise ValueError("File is not an indexed VCD file")
+    return footer[9]
+
+
+def read_index(file):
+    """Read the index of an indexed VCD file opened in binary mode.
+
+    Returns a list of :py:`(timestamp, offset)` pairs, one for each block.
+    """
+    index_text, _ = _read_member(file, _read_index_offset(file))
+    index = []
+    for line in index_text.splitlines():
+        if line.startswith("amaranth-index "):
+            _, timestamp, offset = line.split()
+            index.append((int(timestamp), int(offset)))
+    return index
+
+
+def read_vcd(file, start=0):
+    """Read an indexed VCD file opened in binary mode, starting at time :py:`start`.
+
+    Returns the text of a VCD file with the header of the file, followed by the value changes
+    starting at the last block that begins at or before :py:`start`. Only that block and the ones
+    following it are decompressed.
+    """
+    index_offset = _read_index_offset(file)
+    text, offset = _read_member(file, 0)
+    block_offset = None
+    for block_timestamp, offset_of_block in read_index(file):
+        if block_timestamp > start:
+            break
+        block_offset = offset_of_block
+    if block_offset is not None:
+        text = text[:text.index("$enddefinitions $end\n")] + "$enddefinitions $end\n"
+        offset = block_offset
+    chunks = [text]
+    while offset < index_offset:
+        text, offset = _read_member(file, offset)
+        chunks.append(text)
+    return "".join(chunks)
+
+
+def read_vcd_gz(file, *, start=None):
+    """Read waveforms that were written to a file with a name ending in ``.gz``.
+
+    The :py:`file` argument accepts either a filename or a :term:`python:file object` opened in
+    binary mode, containing waveforms written by :meth:`Simulator.write_vcd`. Returns the text of
+    an ordinary VCD file.
+
+    If :py:`start` (a :class:`~amaranth.hdl.Period`) is specified, the returned VCD file contains
+    the header of the waveforms, followed by the value changes starting at the beginning of
+    the last block that begins at or before :py:`start` (which includes the value of every signal
+    at that time). Only that block and the ones after it are decompressed, so reading the end of
+    long waveforms is fast.
+
+    Raises
+    ------
+    :exc:`TypeError`
+        If :py:`start` is not a :class:`~amaranth.hdl.Period`.
+    :exc:`ValueError`
+        If :py:`file` does not contain indexed waveforms, or is truncated.
+    """
+    if start is None:
+        start = Period()
+    if not isinstance(start, Period):
+        raise TypeError(f"Start time must be a Period, not {start!r}")
+    if isinstance(file, str):
+        with open(file, "rb") as file:
+            return read_vcd(file, start.femtoseconds)
+    return read_vcd(file, start.femtoseconds)
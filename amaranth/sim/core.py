@@ -1,6 +1,8 @@
 from contextlib import contextmanager
+import asyncio
 import inspect
 import sys
+import time
 import warnings
 
 from .._utils import deprecated
@@ -19,6 +21,13 @@ __all__ = [
 ]
 
 
+class _SimulatorSnapshot:
+    def __init__(self, simulator, engine_snapshot, clocked):
+        self.simulator = simulator
+        self.engine_snapshot = engine_snapshot
+        self.clocked = clocked
+
+
 class Simulator:
     # Simulator engines aren't yet a part of the public API.
     """Simulator(toplevel)
@@ -63,18 +72,23 @@ class Simulator:
     toplevel : :class:`~amaranth.hdl.Elaboratable`
         Simulated design.
     """
-    def __init__(self, toplevel, *, engine="pysim"):
+    def __init__(self, toplevel, *, engine="pysim", **engine_options):
+        # Any additional keyword arguments are passed to the simulation engine; see
+        # the constructor of the engine class for the list of options it accepts.
         if isinstance(engine, type) and issubclass(engine, BaseEngine):
             pass
         elif engine == "pysim":
             from .pysim import PySimEngine
             engine = PySimEngine
+        elif engine == "cxxsim":
+            from .cxxsim import CxxSimEngine
+            engine = CxxSimEngine
         else:
             raise TypeError(
                 f"Value {engine!r} is not a simulation engine class or a simulation engine name")
 
         self._design  = Fragment.get(toplevel, platform=None).prepare()
-        self._engine  = engine(self._design)
+        self._engine  = engine(self._design, **engine_options)
         self._clocked = set()
         self._running = False
 
@@ -100,7 +114,8 @@ class Simulator:
         :exc:`~amaranth.hdl.DriverConflict`
             If :py:`domain` already has a clock driving it.
         :exc:`RuntimeError`
-            If the simulation has been advanced since its creation or last reset.
+            If the simulation has been advanced since its creation, last reset, or last
+            restore of a snapshot.
         """
         if self._running:
             raise RuntimeError(r"Cannot add a clock to a running simulation")
@@ -203,7 +218,8 @@ class Simulator:
         Raises
         ------
         :exc:`RuntimeError`
-            If the simulation has been advanced since its creation or last reset.
+            If the simulation has been advanced since its creation, last reset, or last
+            restore of a snapshot.
         """
         if self._running:
             raise RuntimeError(r"Cannot add a testbench to a running simulation")
@@ -269,7 +285,8 @@ class Simulator:
         Raises
         ------
         :exc:`RuntimeError`
-            If the simulation has been advanced since its creation or last reset.
+            If the simulation has been advanced since its creation, last reset, or last
+            restore of a snapshot.
         """
         if self._running:
             raise RuntimeError(r"Cannot add a process to a running simulation")
@@ -331,6 +348,46 @@ class Simulator:
         while self.advance():
             pass
 
+    async def run_async(self):
+        """Run the simulation indefinitely as a part of an :mod:`asyncio` event loop.
+
+        This method advances the simulation while any critical testbenches or processes continue
+        executing, like :meth:`run`, but periodically yields to the event loop running it between
+        time steps (at least once per millisecond of wall-clock time), so that other tasks (for
+        example, ones communicating with a network server or another simulator) keep running
+        concurrently with the simulation.
+
+        Testbenches may wait for awaitables of the event loop using
+        :meth:`ctx.external() <SimulatorContext.external>`. While any testbench is waiting,
+        the simulation time does not advance, and this method suspends itself until one of
+        the awaitables completes. If the simulation finishes while testbenches are still waiting,
+        the tasks that were created to await coroutines for them are cancelled.
+        """
+        tasks = {}
+        yielded_at = time.monotonic()
+        try:
+            while self._advance(external=True):
+                for wait in self._engine.external_waits:
+                    if wait not in tasks:
+                        tasks[wait] = asyncio.ensure_future(wait.awaitable)
+                if tasks:
+                    done, _pending = await asyncio.wait(tasks.values(),
+                        return_when=asyncio.FIRST_COMPLETED)
+                    # Resume the testbenches in the same order as the awaitables were awaited.
+                    for wait, task in list(tasks.items()):
+                        if task in done:
+                            del tasks[wait]
+                            wait.resume(task)
+                    yielded_at = time.monotonic()
+                elif time.monotonic() - yielded_at >= 0.001:
+                    # Yielding on every time step would slow down small designs considerably.
+                    await asyncio.sleep(0)
+                    yielded_at = time.monotonic()
+        finally:
+            for wait, task in tasks.items():
+                if task is not wait.awaitable:
+                    task.cancel()
+
     def run_until(self, deadline, *, run_passive=None):
         """run_until(deadline)
 
@@ -359,7 +416,7 @@ class Simulator:
 
         assert self._engine.now <= deadline.femtoseconds
         while self._engine.now < deadline.femtoseconds:
-            self.advance()
+            self._advance(deadline=deadline.femtoseconds)
 
     @contextmanager
     def _replace_asyncgen_hooks(self):
@@ -399,18 +456,32 @@ class Simulator:
         The non-waiting testbenches are executed in the order they were added, and the processes
         are executed as necessary.
 
+        If only clocks are active (e.g. every testbench is waiting for a delay to elapse) and
+        the design does not change when they toggle, the clock cycles until the next scheduled event
+        that is not a clock edge may be skipped, since simulating them would have no effect.
+
         Returns :py:`True` if the simulation contains any critical testbenches or processes, and
         :py:`False` otherwise.
         """
+        return self._advance()
+
+    def _advance(self, *, deadline=None, external=False):
+        # If the design is idle, the engine may skip clock cycles, but never past `deadline`.
         self._running = True
         with self._replace_asyncgen_hooks():
-            return self._engine.advance()
-
-    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=(), fs_per_delta=0):
+            critical = self._engine.advance(deadline=deadline)
+        # Awaitables passed to `ctx.external()` can only be awaited by `run_async()`.
+        if self._engine.external_waits and not external:
+            raise RuntimeError("Testbenches may only await `ctx.external()` when the simulation "
+                               "is run using `Simulator.run_async()`")
+        return critical
+
+    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=(), fs_per_delta=0,
+                  window=None, trigger=None):
         # `fs_per_delta`` is not currently documented; it is not clear if we want to expose
         # the concept of "delta cycles" in the surface API. Something like `fs_per_step` might be
         # more appropriate.
-        """write_vcd(vcd_file, gtkw_file=None, *, traces=())
+        """write_vcd(vcd_file, gtkw_file=None, *, traces=(), window=None, trigger=None)
 
         Capture waveforms to a file.
 
@@ -428,6 +499,25 @@ class Simulator:
         or a filename. If a file object is provided, it is closed when exiting the context manager
         (once the simulation completes or encounters an error).
 
+        If :py:`vcd_file` is a filename ending in ``.gz``, the waveforms are written compressed,
+        as a sequence of blocks that each start with the value of every signal at the beginning of
+        the block, followed by an index of the blocks. Such a file can be decompressed into
+        an ordinary VCD file by any tool that reads gzip files, and the index makes it possible to
+        read the waveforms starting at any point in time without decompressing the blocks before it
+        using :func:`read_vcd_gz`. A filename ending in ``.gz`` always selects this format.
+
+        If :py:`window` (a :class:`~amaranth.hdl.Period`) is specified, the waveforms are captured
+        like with a logic analyzer: only the last :py:`window` of them is kept in memory, and
+        nothing is written until the capture is triggered, either by :py:`trigger` (a value, if
+        specified) becoming non-zero, or by an exception (such as a failed assertion) raised by
+        the simulation. Once triggered, the kept waveforms are written to :py:`vcd_file` along with
+        all of the waveforms after them. If the capture is never triggered, the files are not
+        created or written to. This avoids the cost of writing waveforms of a long simulation while
+        still providing them in case of a failure: ::
+
+            with sim.write_vcd("failure.vcd", window=Period(us=10)):
+                sim.run()
+
         The :py:`traces` argument accepts a *trace specification*, which can be one of:
 
         * A :class:`~amaranth.hdl.ValueLike` object, such as a :class:`~amaranth.hdl.Signal`;
@@ -440,6 +530,10 @@ class Simulator:
         ------
         :exc:`TypeError`
             If a trace specification refers to a signal with a private name.
+        :exc:`TypeError`
+            If :py:`window` is not a :class:`~amaranth.hdl.Period` or :py:`None`.
+        :exc:`ValueError`
+            If :py:`trigger` is specified without :py:`window`.
         """
         if self._engine.now != 0:
             for file in (vcd_file, gtkw_file):
@@ -470,8 +564,40 @@ class Simulator:
 
         traverse_traces(traces)
 
+        if window is not None:
+            if not isinstance(window, Period):
+                raise TypeError(f"Capture window must be a Period, not {window!r}")
+            window = window.femtoseconds
+        if trigger is not None:
+            if window is None:
+                raise ValueError("Capture trigger can only be used together with a capture window")
+            trigger = Value.cast(trigger)
+
         return self._engine.write_vcd(
-            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces, fs_per_delta=fs_per_delta)
+            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces, fs_per_delta=fs_per_delta,
+            window=window, trigger=trigger)
+
+    def profile(self):
+        """Profile the simulation.
+
+        This method returns a context manager that collects statistics about the simulation while
+        it is active, and yields a :class:`SimulationProfile` that is filled in when it exits: ::
+
+            with sim.profile() as profile:
+                sim.run()
+            print(profile.format(top=20))
+
+        Profiling shows which parts of the design, processes, and testbenches take the most time to
+        simulate, how many delta cycles are necessary for the design to converge, and which signals
+        change most often, which helps find the cause of a slow simulation. Collecting a profile
+        makes the simulation somewhat slower.
+
+        Raises
+        ------
+        :exc:`ValueError`
+            If the simulation is already being profiled.
+        """
+        return self._engine.profile()
 
     def reset(self):
         """Reset the simulation.
@@ -484,3 +610,57 @@ class Simulator:
         """
         self._engine.reset()
         self._running = False
+
+    def snapshot(self):
+        """Capture the state of the simulation.
+
+        Returns an object that can be passed to :meth:`restore` to return the simulation to
+        its current state, any number of times. This makes it possible to run an expensive
+        initialization (e.g. booting a simulated system) once, and then run many scenarios
+        starting from its end: ::
+
+            sim.add_testbench(boot)
+            sim.run()
+            booted = sim.snapshot()
+
+            for scenario in scenarios:
+                sim.restore(booted)
+                sim.add_testbench(scenario)
+                sim.run()
+
+        A snapshot includes the current point in time, the value of each signal, the contents of
+        each memory, and the state of each clock; it does not include the state of testbenches and
+        processes added with :meth:`add_testbench` or :meth:`add_process`, which cannot be captured.
+        A snapshot can only be restored into the simulation it was taken from. To run scenarios
+        in parallel starting from a snapshot, take it within the :py:`setup` function of
+        :func:`run_batch`.
+        """
+        return _SimulatorSnapshot(self, self._engine.snapshot(), self._clocked.copy())
+
+    def restore(self, snapshot):
+        """Restore the state of the simulation from a snapshot.
+
+        This method reverts the simulation to the state captured by :meth:`snapshot`:
+
+        * The current point in time, the value of each signal, and the contents of each memory are
+          changed to the ones captured in the snapshot;
+        * Each clock is restored to the state captured in the snapshot;
+        * Each clock, testbench, and process added after the snapshot was taken is removed;
+        * Each testbench and process that had finished when the snapshot was taken is finished,
+          and every other one is restarted.
+
+        After the snapshot is restored, clocks, testbenches, and processes can be added to
+        the simulation.
+
+        Raises
+        ------
+        :exc:`TypeError`
+            If :py:`snapshot` was not taken from this simulation.
+        :exc:`ValueError`
+            If waveforms are being written.
+        """
+        if not isinstance(snapshot, _SimulatorSnapshot) or snapshot.simulator is not self:
+            raise TypeError(f"Object {snapshot!r} is not a snapshot of this simulation")
+        self._engine.restore(snapshot.engine_snapshot)
+        self._clocked = snapshot.clocked.copy()
+        self._running = False
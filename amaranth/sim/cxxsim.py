@@ -0,0 +1,751 @@
+import os
+import sys
+import ctypes
+import hashlib
+import shlex
+import subprocess
+import tempfile
+import weakref
+from contextlib import contextmanager
+
+from .._toolchain import require_tool
+from .._toolchain.yosys import find_yosys
+from ..back import rtlil
+from ..hdl import *
+from ..hdl import _ir
+from ..hdl._ast import SignalDict, SignalSet
+from ..hdl._mem import MemoryInstance
+from ._base import BaseProcess
+from ._pyrtl import pin_blame, _evict_cached, _default_cache_dir, _is_private
+from .pysim import (PySimEngine, _PyEngineState, _PySignalState, _PyMemoryState,
+                    _PyMemoryChange)
+
+
+__all__ = ["CxxSimEngine"]
+
+
+# The model of the design is compiled together with this code, which gives the Python side a way to
+# step the model while collecting the output of `Print` and `Assert` statements (which CXXRTL would
+# otherwise write to `std::cout` or abort on), and to find out which of the objects it mirrors have
+# changed without reading every one of them through `ctypes`.
+_GLUE_SOURCE = r"""
+#include <algorithm>
+#include <cstring>
+#include <functional>
+#include <string>
+#include <vector>
+
+namespace {
+
+struct amaranth_performer : public cxxrtl::performer {
+	std::string events;
+
+	void add_event(char kind, const cxxrtl::metadata_map &attributes, const std::string &text) {
+		events += kind;
+		auto src = attributes.find("src");
+		if (src != attributes.end() && src->second.value_type == cxxrtl::metadata::STRING)
+			events += src->second.string_value;
+		events += '\0';
+		events += text;
+		events += '\0';
+	}
+
+	void on_print(const cxxrtl::lazy_fmt &formatter,
+	              const cxxrtl::metadata_map &attributes) override {
+		add_event('p', attributes, formatter());
+	}
+
+	void on_check(cxxrtl::flavor type, bool condition, const cxxrtl::lazy_fmt &formatter,
+	              const cxxrtl::metadata_map &attributes) override {
+		if (type == cxxrtl::flavor::ASSERT && !condition)
+			add_event('a', attributes, formatter());
+		else if (type == cxxrtl::flavor::ASSUME && !condition)
+			add_event('u', attributes, formatter());
+		else if (type == cxxrtl::flavor::COVER && condition)
+			add_event('c', attributes, formatter());
+	}
+};
+
+size_t object_chunks(const cxxrtl_object *object) {
+	return (object->width + 31) / 32;
+}
+
+}
+
+struct amaranth_cxxsim {
+	cxxrtl_handle handle;
+	amaranth_performer performer;
+	// Objects accessed from Python. For each object whose changes are tracked, its contents as
+	// last seen from Python; for the others, an empty vector.
+	std::vector<cxxrtl_object *> objects;
+	std::vector<std::vector<uint32_t>> shadows;
+	std::vector<cxxrtl_outline> outlines;
+	// Pairs of (object index, row) that have changed during the last step.
+	std::vector<size_t> changes;
+};
+
+extern "C" {
+
+amaranth_cxxsim *amaranth_cxxsim_create() {
+	amaranth_cxxsim *sim = new amaranth_cxxsim;
+	sim->handle = cxxrtl_create(cxxrtl_design_create());
+	return sim;
+}
+
+void amaranth_cxxsim_destroy(amaranth_cxxsim *sim) {
+	cxxrtl_destroy(sim->handle);
+	delete sim;
+}
+
+static void amaranth_cxxsim_refresh(amaranth_cxxsim *sim) {
+	for (auto outline : sim->outlines)
+		cxxrtl_outline_eval(outline);
+	for (size_t index = 0; index < sim->objects.size(); index++) {
+		cxxrtl_object *object = sim->objects[index];
+		std::vector<uint32_t> &shadow = sim->shadows[index];
+		if (!shadow.empty())
+			std::copy(object->curr, object->curr + shadow.size(), shadow.begin());
+	}
+}
+
+cxxrtl_object *amaranth_cxxsim_access(amaranth_cxxsim *sim, const char *name, size_t *index) {
+	size_t parts = 0;
+	cxxrtl_object *object = cxxrtl_get_parts(sim->handle, name, &parts);
+	if (object == nullptr || parts != 1)
+		return nullptr;
+	if (object->type == CXXRTL_OUTLINE) {
+		cxxrtl_outline_eval(object->outline);
+		if (std::find(sim->outlines.begin(), sim->outlines.end(), object->outline) ==
+				sim->outlines.end())
+			sim->outlines.push_back(object->outline);
+	}
+	*index = sim->objects.size();
+	sim->objects.push_back(object);
+	sim->shadows.emplace_back();
+	return object;
+}
+
+void amaranth_cxxsim_track(amaranth_cxxsim *sim, size_t index) {
+	cxxrtl_object *object = sim->objects[index];
+	if (object->type == CXXRTL_OUTLINE)
+		cxxrtl_outline_eval(object->outline);
+	sim->shadows[index].assign(object->curr,
+	                           object->curr + object_chunks(object) * object->depth);
+}
+
+void amaranth_cxxsim_untrack(amaranth_cxxsim *sim, size_t index) {
+	std::vector<uint32_t>().swap(sim->shadows[index]);
+}
+
+void amaranth_cxxsim_write(amaranth_cxxsim *sim, size_t index, size_t row, size_t count,
+                           const uint32_t *data, bool observed) {
+	cxxrtl_object *object = sim->objects[index];
+	size_t offset = object_chunks(object) * row;
+	size_t chunks = object_chunks(object) * count;
+	if (object->type == CXXRTL_MEMORY) {
+		std::copy(data, data + chunks, object->curr + offset);
+	} else if (object->next != nullptr) {
+		// Values are updated in place. Wires are updated the same way as if the design drove them,
+		// so that the edge detectors of the design observe a change of `next` relative to `curr`.
+		std::copy(data, data + chunks, object->next);
+	}
+	// Unless the new contents are already known on the Python side, they are reported as changes.
+	std::vector<uint32_t> &shadow = sim->shadows[index];
+	if (observed && !shadow.empty())
+		std::copy(data, data + chunks, shadow.begin() + offset);
+}
+
+void amaranth_cxxsim_read(amaranth_cxxsim *sim, size_t index, size_t row, size_t count,
+                          uint32_t *data) {
+	cxxrtl_object *object = sim->objects[index];
+	if (object->type == CXXRTL_OUTLINE)
+		cxxrtl_outline_eval(object->outline);
+	size_t offset = object_chunks(object) * row;
+	std::copy(object->curr + offset, object->curr + offset + object_chunks(object) * count, data);
+}
+
+void amaranth_cxxsim_reset(amaranth_cxxsim *sim) {
+	cxxrtl_reset(sim->handle);
+	amaranth_cxxsim_refresh(sim);
+}
+
+void amaranth_cxxsim_commit(amaranth_cxxsim *sim) {
+	cxxrtl_commit(sim->handle);
+}
+
+size_t amaranth_cxxsim_step(amaranth_cxxsim *sim) {
+	sim->performer.events.clear();
+	sim->changes.clear();
+	// Unlike `module::step()`, keep evaluating while the committed state changes, even if `eval()`
+	// reports convergence, since it does not account for memory writes that are committed
+	// together with the registers and must be visible to the asynchronous read ports.
+	cxxrtl::module &module = *sim->handle->module;
+	do {
+		module.eval(&sim->performer);
+	} while (module.commit());
+	for (auto outline : sim->outlines)
+		cxxrtl_outline_eval(outline);
+	for (size_t index = 0; index < sim->objects.size(); index++) {
+		cxxrtl_object *object = sim->objects[index];
+		std::vector<uint32_t> &shadow = sim->shadows[index];
+		if (shadow.empty())
+			continue;
+		size_t chunks = object_chunks(object);
+		if (std::equal(shadow.begin(), shadow.end(), object->curr))
+			continue;
+		for (size_t row = 0; row < object->depth; row++) {
+			uint32_t *curr = object->curr + row * chunks;
+			uint32_t *last = &shadow[row * chunks];
+			if (!std::equal(last, last + chunks, curr)) {
+				std::copy(curr, curr + chunks, last);
+				sim->changes.push_back(index);
+				sim->changes.push_back(row);
+			}
+		}
+	}
+	return sim->changes.size() / 2;
+}
+
+const size_t *amaranth_cxxsim_changes(amaranth_cxxsim *sim) {
+	return sim->changes.data();
+}
+
+const char *amaranth_cxxsim_events(amaranth_cxxsim *sim, size_t *size) {
+	*size = sim->performer.events.size();
+	return sim->performer.events.data();
+}
+
+// The state of the design consists of the contents of every object that can be modified. Edge
+// detectors are not included, and are updated by committing the restored state.
+static void amaranth_cxxsim_for_each_state(amaranth_cxxsim *sim,
+                                           std::function<void(uint32_t *, size_t)> action) {
+	for (auto &item : sim->handle->objects.table) {
+		for (auto &part : item.second) {
+			size_t chunks = object_chunks(&part) * part.depth;
+			if (part.type == CXXRTL_MEMORY) {
+				action(part.curr, chunks);
+			} else if ((part.type == CXXRTL_VALUE || part.type == CXXRTL_WIRE) &&
+					part.next != nullptr) {
+				action(part.curr, chunks);
+				if (part.next != part.curr)
+					action(part.next, chunks);
+			}
+		}
+	}
+}
+
+size_t amaranth_cxxsim_snapshot(amaranth_cxxsim *sim, uint32_t *data) {
+	size_t size = 0;
+	amaranth_cxxsim_for_each_state(sim, [&](uint32_t *chunks, size_t count) {
+		if (data != nullptr)
+			std::copy(chunks, chunks + count, data + size);
+		size += count;
+	});
+	return size;
+}
+
+void amaranth_cxxsim_restore(amaranth_cxxsim *sim, const uint32_t *data) {
+	size_t size = 0;
+	amaranth_cxxsim_for_each_state(sim, [&](uint32_t *chunks, size_t count) {
+		std::copy(data + size, data + size + count, chunks);
+		size += count;
+	});
+	cxxrtl_commit(sim->handle);
+	amaranth_cxxsim_refresh(sim);
+}
+
+}
+"""
+
+
+
+
+class _CxxObject(ctypes.Structure):
+    _fields_ = [
+        ("type",    ctypes.c_uint32),
+        ("flags",   ctypes.c_uint32),
+        ("width",   ctypes.c_size_t),
+        ("lsb_at",  ctypes.c_size_t),
+        ("depth",   ctypes.c_size_t),
+        ("zero_at", ctypes.c_size_t),
+        ("curr",    ctypes.POINTER(ctypes.c_uint32)),
+        ("next",    ctypes.POINTER(ctypes.c_uint32)),
+        ("outline", ctypes.c_void_p),
+        ("attrs",   ctypes.c_void_p),
+    ]
+
+
+class _CxxModel:
+    # A loaded instance of the compiled model. Objects are referred to by the index returned by
+    # `access()`, and their values are unsigned integers.
+    def __init__(self, library_path):
+        library = ctypes.CDLL(library_path)
+        handle_type = ctypes.c_void_p
+        size_type   = ctypes.c_size_t
+        for name, restype, argtypes in (
+            ("create",   handle_type, []),
+            ("destroy",  None,        [handle_type]),
+            ("access",   ctypes.POINTER(_CxxObject),
+                                      [handle_type, ctypes.c_char_p, ctypes.POINTER(size_type)]),
+            ("track",    None,        [handle_type, size_type]),
+            ("untrack",  None,        [handle_type, size_type]),
+            ("write",    None,        [handle_type, size_type, size_type, size_type,
+                                       ctypes.c_char_p, ctypes.c_bool]),
+            ("read",     None,        [handle_type, size_type, size_type, size_type,
+                                       ctypes.c_char_p]),
+            ("reset",    None,        [handle_type]),
+            ("commit",   None,        [handle_type]),
+            ("step",     size_type,   [handle_type]),
+            ("changes",  ctypes.POINTER(size_type), [handle_type]),
+            ("events",   ctypes.c_void_p, [handle_type, ctypes.POINTER(size_type)]),
+            ("snapshot", size_type,   [handle_type, ctypes.c_char_p]),
+            ("restore",  None,        [handle_type, ctypes.c_char_p]),
+        ):
+            function = getattr(library, f"amaranth_cxxsim_{name}")
+            function.restype  = restype
+            function.argtypes = argtypes
+            setattr(self, f"_{name}", function)
+
+        self._library = library
+        self._handle  = self._create()
+        self._finalizer = weakref.finalize(self, self._destroy, self._handle)
+        self._row_bytes = []
+
+    def access(self, name, *, track):
+        """Look up the object with the given hierarchical name.
+
+        Returns the index of the object, or ``None`` if there is no such object. If ``track`` is
+        true, changes to the object are returned by :meth:`step`."""
+        index = ctypes.c_size_t()
+        object = self._access(self._handle, name.encode("utf-8"), ctypes.byref(index))
+        if not object:
+            return None
+        object = object.contents
+        self._row_bytes.append((object.width + 31) // 32 * 4)
+        if track:
+            self._track(self._handle, index.value)
+        return index.value
+
+    def track(self, index):
+        self._track(self._handle, index)
+
+    def untrack(self, index):
+        self._untrack(self._handle, index)
+
+    def write(self, index, row, value, *, observed=True):
+        self._write(self._handle, index, row, 1, value.to_bytes(self._row_bytes[index], "little"),
+                    observed)
+
+    def write_rows(self, index, row, values):
+        row_bytes = self._row_bytes[index]
+        data = b"".join(value.to_bytes(row_bytes, "little") for value in values)
+        self._write(self._handle, index, row, len(values), data, True)
+
+    def read(self, index, row):
+        data = ctypes.create_string_buffer(self._row_bytes[index])
+        self._read(self._handle, index, row, 1, data)
+        return int.from_bytes(data.raw, "little")
+
+    def read_rows(self, index, row, count):
+        row_bytes = self._row_bytes[index]
+        data = ctypes.create_string_buffer(row_bytes * count)
+        self._read(self._handle, index, row, count, data)
+        data = data.raw
+        return [int.from_bytes(data[offset:offset + row_bytes], "little")
+                for offset in range(0, len(data), row_bytes)]
+
+    def reset(self):
+        self._reset(self._handle)
+
+    def commit(self):
+        self._commit(self._handle)
+
+    def step(self):
+        """Run the model until it converges.
+
+        Returns the list of changes to tracked objects as ``(index, row)`` pairs, and the list
+        of events as ``(kind, src, text)`` tuples."""
+        count = self._step(self._handle)
+        changes = self._changes(self._handle)[:count * 2] if count else []
+        size = ctypes.c_size_t()
+        address = self._events(self._handle, ctypes.byref(size))
+        events = []
+        if size.value:
+            fields = ctypes.string_at(address, size.value).decode("utf-8", "replace").split("\0")
+            for kind_src, text in zip(fields[0:-1:2], fields[1::2]):
+                events.append((kind_src[0], kind_src[1:], text))
+        return list(zip(changes[0::2], changes[1::2])), events
+
+    def snapshot(self):
+        size = self._snapshot(self._handle, None)
+        data = ctypes.create_string_buffer(size * 4)
+        self._snapshot(self._handle, data)
+        return data.raw
+
+    def restore(self, snapshot):
+        self._restore(self._handle, snapshot)
+
+
+# Models built from the same RTLIL with the same toolchain are reused across runs. They are stored
+# in `AMARANTH_cxxsim_cache` (by default, a per-user directory in the temporary directory), whose
+# size (in bytes) is bounded by `AMARANTH_cxxsim_cache_size`; least recently used entries are
+# evicted.
+#
+# Since a cached model is loaded into the process, the cache directory and the models must not be
+# writable by other users; otherwise, they could place a library there that runs arbitrary code.
+_MODEL_CACHE_SIZE = 1 << 30
+
+
+def _build_model(rtlil_text):
+    yosys = find_yosys(lambda ver: ver >= (0, 40))
+    include_dir = os.fspath(yosys.data_dir() / "include" / "backends" / "cxxrtl" / "runtime")
+    command = [require_tool("c++"), *shlex.split(os.getenv("CXXFLAGS", "-O2")),
+               "-std=c++14", "-shared", "-fPIC", "-DCXXRTL_INCLUDE_CAPI_IMPL", "-I", include_dir]
+
+    script = "\n".join([
+        f"read_rtlil <<rtlil\n{rtlil_text}\nrtlil",
+        "write_cxxrtl",
+    ])
+
+    digest = hashlib.sha256()
+    for part in (script, _GLUE_SOURCE, ".".join(map(str, yosys.version())), *command):
+        part = part.encode()
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    cache_dir = os.getenv("AMARANTH_cxxsim_cache") or _default_cache_dir("cxxsim")
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    if not _is_private(cache_dir):
+        raise RuntimeError(f"Cannot use {cache_dir!r} as the CXXRTL model cache, since it is "
+                           f"not owned by the current user or is writable by other users")
+    suffix = ".dll" if sys.platform == "win32" else ".so"
+    path = os.path.join(cache_dir, f"{digest.hexdigest()}{suffix}")
+    # A model that is not private is rebuilt and replaced instead of being loaded.
+    if os.path.exists(path) and _is_private(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    cxx_text = yosys.run(["-q", "-"], script)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as build_dir:
+        source_path  = os.path.join(build_dir, "model.cc")
+        library_path = os.path.join(build_dir, f"model{suffix}")
+        with open(source_path, "w") as file:
+            file.write(cxx_text)
+            file.write(_GLUE_SOURCE)
+        result = subprocess.run([*command, "-o", library_path, source_path],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8")
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to compile the CXXRTL model of the design:\n"
+                               f"{result.stdout}")
+        os.chmod(library_path, 0o700)
+        os.replace(library_path, path)
+    try:
+        _evict_cached(cache_dir, suffix=suffix, keep=path,
+            max_size=int(os.getenv("AMARANTH_cxxsim_cache_size", _MODEL_CACHE_SIZE)))
+    except OSError:
+        pass # the cache is best effort
+    return path
+
+
+def _to_signed(value, shape):
+    if shape.signed and value & (1 << (shape.width - 1)):
+        value -= 1 << shape.width
+    return value
+
+
+class _CxxMemoryRows:
+    # Contents of a memory stored in the model, indexable like the storage of `_PyMemoryState`.
+    def __init__(self, model, index, shape, depth):
+        self.model = model
+        self.index = index
+        self.shape = shape
+        self.depth = depth
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            start, stop, _step = addr.indices(self.depth)
+            return [_to_signed(value, self.shape)
+                    for value in self.model.read_rows(self.index, start, stop - start)]
+        return _to_signed(self.model.read(self.index, addr), self.shape)
+
+    def __setitem__(self, addr, value):
+        mask = (1 << self.shape.width) - 1
+        if isinstance(addr, slice):
+            start, _stop, _step = addr.indices(self.depth)
+            self.model.write_rows(self.index, start, [int(row) & mask for row in value])
+        else:
+            self.model.write(self.index, addr, value & mask)
+
+
+class _CxxMemoryState(_PyMemoryState):
+    # A memory whose contents are stored only in the model. Writes from testbenches and processes
+    # are queued and committed as usual, and wake up the model.
+    __slots__ = ()
+
+    def __init__(self, memory, state, index, *, model, model_index):
+        self.memory  = memory
+        self.shape   = Shape.cast(memory.shape)
+        self.init    = None
+        self.data    = _CxxMemoryRows(model, model_index, self.shape, memory.depth)
+        self.shared  = False
+        self.state   = state
+        self.index   = index
+        self.wakers  = list()
+        self.write_queue = {}
+
+    def reset(self):
+        # The contents are reset together with the model.
+        self.write_queue = {}
+
+    def snapshot(self):
+        # The contents are captured together with the model.
+        return self.write_queue.copy()
+
+    def restore(self, snapshot):
+        self.write_queue = snapshot.copy()
+
+
+class _CxxEngineState(_PyEngineState):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.model_process = None
+        # Maps the slot of each signal that mirrors an object of the model to the index of
+        # the object.
+        self.model_signals = {}
+        # Maps each memory of the design to the index of its object in the model.
+        self.model_memories = {}
+        # Rows of memories changed by the model, as `_PyMemoryChange`, for waveforms.
+        self.memory_changes = []
+
+    def get_memory(self, memory):
+        try:
+            return self.memories[memory]
+        except KeyError:
+            if memory not in self.model_memories:
+                return super().get_memory(memory)
+            index = self._add_slot()
+            memory_state = _CxxMemoryState(memory, self, index,
+                model=self.model, model_index=self.model_memories[memory])
+            memory_state.add_waker(self.model_process.waker)
+            self.slots.append(memory_state)
+            self.memories[memory] = index
+            return index
+
+    def commit(self, changed=None):
+        # Changes to mirrored signals that were not made by the model itself (but by testbenches,
+        # processes, or clocks) must be written to the model before it runs again.
+        process = self.model_process
+        for slot in self.pending:
+            index = self.model_signals.get(slot)
+            if index is not None and self.next[slot] != process.values[index]:
+                process.dirty[index] = self.slots[slot]
+                process.waker()
+        if changed is not None:
+            changed.update(self.memory_changes)
+        self.memory_changes.clear()
+        return super().commit(changed)
+
+
+class _CxxRTLProcess(BaseProcess):
+    # Runs the model of the whole design whenever a signal or memory it mirrors is changed outside
+    # of it, and propagates the changes of its objects back to their states.
+    def __init__(self, state):
+        self.state = state
+        self.model = state.model
+        # For each object of the model, its signal or memory state, and for signals, the value of
+        # the object as last seen from Python.
+        self.objects = []
+        self.values  = []
+        self.aliases = {}
+        self.dirty   = {}
+
+        self.reset()
+
+    def add_object(self, state, index):
+        assert index == len(self.objects)
+        self.objects.append(state)
+        self.values.append(state.signal.init if type(state) is _PySignalState else None)
+
+    def waker(self, *args):
+        if not self.runnable:
+            self.runnable = True
+            self.state.ready.append(self)
+        return True
+
+    def reset(self):
+        self.runnable = True
+        self.critical = False
+
+        self.initial = True
+        for index, state in enumerate(self.objects):
+            if type(state) is _PySignalState:
+                self.values[index] = state.signal.init
+        self.dirty.clear()
+        self.model.reset()
+
+    def snapshot(self):
+        return (self.runnable, self.initial, self.values.copy(), self.dirty.copy(),
+                self.model.snapshot())
+
+    def restore(self, snapshot):
+        self.runnable, self.initial, values, dirty, model_snapshot = snapshot
+        self.values[:] = values
+        self.dirty = dirty.copy()
+        self.model.restore(model_snapshot)
+
+    def run(self):
+        self.runnable = False
+
+        model = self.model
+        for index, state in self.dirty.items():
+            value = state.curr & ((1 << len(state.signal)) - 1)
+            self.values[index] = state.curr
+            model.write(index, 0, value)
+            for alias in self.aliases[index]:
+                model.write(alias, 0, value, observed=False)
+        self.dirty.clear()
+        initial, self.initial = self.initial, False
+        if initial:
+            # The initial values of signals (e.g. of a clock that starts high) are not edges.
+            model.commit()
+
+        changes, events = model.step()
+        if initial:
+            # Signals driven by combinational logic may already differ from their initial values
+            # after the model is reset, and these differences are not reported as changes.
+            changes = [(index, 0) for index, state in enumerate(self.objects)
+                       if type(state) is _PySignalState]
+        for index, row in changes:
+            state = self.objects[index]
+            if type(state) is _PySignalState:
+                value = _to_signed(model.read(index, 0), state.signal.shape())
+                if self.values[index] != value:
+                    self.values[index] = value
+                    state.update(value)
+            else:
+                self.state.memory_changes.append(_PyMemoryChange(state, row))
+
+        for kind, src, text in events:
+            if kind == "p":
+                print(text, end="")
+            elif kind == "c":
+                if text:
+                    print(f"Coverage hit at {src}:", text)
+            else:
+                kind = "Assertion" if kind == "a" else "Assumption"
+                filename, _, line = src.rpartition(":")
+                src_loc = (filename, int(line)) if line.isdigit() else None
+                if text:
+                    pin_blame(src_loc, AssertionError(f"{kind} violated: {text}"))
+                else:
+                    pin_blame(src_loc, AssertionError(f"{kind} violated"))
+
+
+class CxxSimEngine(PySimEngine):
+    # Simulates the design using a model compiled with CXXRTL, while running testbenches, processes
+    # and clocks the same way as `PySimEngine`. The values of all named signals of the design are
+    # mirrored in Python, so that triggers and waveforms work as usual.
+    #
+    # Requires Yosys 0.40 or later (the builtin one is used if installed) and a C++ compiler (`c++`,
+    # or the one named by the `CXX` environment variable); compiler options are taken from
+    # `CXXFLAGS` (by default, `-O2`). Designs with combinational cycles cannot be simulated.
+    #
+    # The options of `PySimEngine` are accepted, but none of them are supported, since they change
+    # how the design is compiled to Python code.
+    def __init__(self, design, *, levelize=False, flatten=False, lanes=None, cycle_based=False,
+                 prune=False, keep=()):
+        for name, used in (("levelize", levelize), ("flatten", flatten),
+                           ("lanes", lanes is not None), ("cycle_based", cycle_based),
+                           ("prune", prune), ("keep", keep)):
+            if used:
+                raise ValueError(f"The cxxsim engine does not support `{name}`")
+
+        self._design = design
+
+        netlist = _ir.build_netlist(design, all_undef_to_ff=True)
+        rtlil_text, name_map = rtlil._convert_netlist(netlist)
+        # Signals that are named only in fragments which are not emitted (e.g. the read data of
+        # an unused memory port) do not appear in the netlist; make them outputs of the design,
+        # so that they can be read by testbenches.
+        unnamed = SignalDict()
+        for fragment_info in design.fragments.values():
+            for signal in fragment_info.signal_names:
+                if signal not in name_map:
+                    unnamed[signal] = None
+        if unnamed:
+            design = _ir.Design(design.fragment, [
+                *design.ports,
+                *((None, signal, _ir.PortDirection.Output) for signal in unnamed),
+            ], hierarchy=design.hierarchy)
+            netlist = _ir.build_netlist(design, all_undef_to_ff=True)
+            rtlil_text, name_map = rtlil._convert_netlist(netlist)
+        model = _CxxModel(_build_model(rtlil_text))
+        self._state = state = _CxxEngineState(model)
+        self._model_process = process = _CxxRTLProcess(state)
+        state.model_process = process
+
+        # As in `PySimEngine`, signals driven by combinational logic cannot be set by testbenches.
+        comb_signals = SignalSet()
+        for fragment in self._design.fragments:
+            if isinstance(fragment, MemoryInstance):
+                for port in fragment._read_ports:
+                    if port._domain == "comb":
+                        comb_signals |= port._data._rhs_signals()
+            elif "comb" in fragment.statements:
+                comb_signals |= fragment.statements["comb"]._lhs_signals()
+
+        # Signals connected to the same nets are separate objects in the model, of which only
+        # one holds the value; a signal set from Python is written to every one of them.
+        aliases = {}
+        for signal, name in name_map.items():
+            index = model.access(" ".join(name[1:]), track=True)
+            if index is None:
+                continue
+            slot = state.get_signal(signal)
+            signal_state = state.slots[slot]
+            signal_state.is_comb = signal in comb_signals
+            process.add_object(signal_state, index)
+            state.model_signals[slot] = index
+            aliases.setdefault(netlist.signals[signal], []).append(index)
+        for indexes in aliases.values():
+            for index in indexes:
+                process.aliases[index] = [alias for alias in indexes if alias != index]
+        for fragment, fragment_info in self._design.fragments.items():
+            if isinstance(fragment, MemoryInstance):
+                index = model.access(" ".join(fragment_info.name[1:]), track=False)
+                if index is None:
+                    continue
+                state.model_memories[fragment._data] = index
+                memory_state = state.slots[state.get_memory(fragment._data)]
+                process.add_object(memory_state, index)
+
+        # The model may print or check properties on any clock edge, so idle clock cycles are
+        # never skipped.
+        self._init_runtime_state({process})
+        # The number of nested `write_vcd()` calls, while which memories are tracked.
+        self._memory_tracking = 0
+
+    def _describe_runnable(self, runnable):
+        if runnable is self._model_process:
+            return ("rtl", "(cxxrtl)", None)
+        return super()._describe_runnable(runnable)
+
+    @contextmanager
+    def write_vcd(self, **kwargs):
+        # Changes to the contents of memories are only tracked while writing waveforms, since
+        # comparing every row after each step of the model is expensive for large memories.
+        if self._memory_tracking == 0:
+            for index in self._state.model_memories.values():
+                self._state.model.track(index)
+        self._memory_tracking += 1
+        try:
+            with super().write_vcd(**kwargs):
+                yield
+        finally:
+            self._memory_tracking -= 1
+            if self._memory_tracking == 0:
+                for index in self._state.model_memories.values():
+                    self._state.model.untrack(index)
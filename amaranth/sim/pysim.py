@@ -1,46 +1,101 @@
 from contextlib import contextmanager
+from collections import deque
+import copy
+import io
 import itertools
+import heapq
+import math
 import re
 import enum as py_enum
 
 from ..hdl import *
 from ..hdl._mem import MemoryInstance
-from ..hdl._ast import SignalDict
-from ..lib import data, wiring
+from ..hdl._ast import SignalDict, SignalSet
+from ..lib import data, enum, wiring
 from ._base import *
 from ._async import *
-from ._pyeval import eval_format, eval_value, eval_assign
-from ._pyrtl import _FragmentCompiler
+from ._async import _ExternalWait
+from ._pyeval import eval_format, format_chunks, eval_value, eval_assign
+from ._pyrtl import (_FragmentCompiler, _has_side_effects, rank_comb_processes, prune_statements,
+                     compile_getter, compile_getters, compile_sampler, compile_setter)
 from ._pyclock import PyClockProcess
+from ._profile import Profiler
+from ._pymem import memory_storage, rows_from_buffer, load_rows, dump_rows
+from ._vcdgz import IndexedGzipFile
 
 
 __all__ = ["PySimEngine"]
 
 
+# Escapes used by pyvcd for values of string variables.
+_VCD_STRING_ESCAPES = {9: "\\t", 10: "\\n", 13: "\\r", 32: "\\x20", 92: "\\\\"}
+
+
+def _vcd_formatter(vcd_var, var_type):
+    ident = vcd_var.ident
+    if var_type == "string":
+        return lambda value: f"s{value.translate(_VCD_STRING_ESCAPES)} {ident}\n"
+    elif vcd_var.size == 1:
+        return lambda value: f"{value & 1}{ident}\n"
+    else:
+        mask = (1 << vcd_var.size) - 1
+        return lambda value: f"b{value & mask:b} {ident}\n"
+
+
 class _VCDWriter:
+    # Value changes are formatted by the writer itself and written to the file in chunks of about
+    # this many changes; pyvcd is only used to register variables and write the header.
+    BUFFER_SIZE = 8192
+    # When writing an indexed VCD file, a new block is started once the current one has at least
+    # this many value changes.
+    BLOCK_SIZE = 1 << 18
+    # At most this many formatted strings are cached for each string variable.
+    CACHE_SIZE = 1024
+
+    # Whether value changes are being written to the file.
+    triggered = True
+
     @staticmethod
     def decode_to_vcd(format, value):
         return format.format(value).expandtabs().replace(" ", "_")
 
-    def __init__(self, state, design, *, vcd_file, gtkw_file=None, traces=(), fs_per_delta=0):
+    @staticmethod
+    def open_vcd_file(vcd_file):
+        if isinstance(vcd_file, str):
+            if vcd_file.endswith(".gz"):
+                return IndexedGzipFile(open(vcd_file, "wb")), True
+            return open(vcd_file, "w"), True
+        return vcd_file, False
+
+    @staticmethod
+    def open_gtkw_file(gtkw_file):
+        if isinstance(gtkw_file, str):
+            return open(gtkw_file, "w"), True
+        return gtkw_file, False
+
+    def __init__(self, state, design, *, vcd_file, gtkw_file=None, traces=(), fs_per_delta=0,
+                 pruned=SignalSet()):
         self.state = state
         self.fs_per_delta = fs_per_delta
 
+        self.buffer = []
+        self.block_size = 0
+        self.timestamp = 0
+        self.timestamp_written = False
+        self.header_written = False
+
         # Although pyvcd is a mandatory dependency, be resilient and import it as needed, so that
         # the simulator is still usable if it's not installed for some reason.
         import vcd, vcd.gtkw
 
-        self.close_vcd = False
-        self.close_gtkw = False
-        if isinstance(vcd_file, str):
-            vcd_file = open(vcd_file, "w")
-            self.close_vcd = True
-        if isinstance(gtkw_file, str):
-            gtkw_file = open(gtkw_file, "w")
-            self.close_gtkw = True
+        vcd_file, self.close_vcd = self.open_vcd_file(vcd_file)
+        gtkw_file, self.close_gtkw = self.open_gtkw_file(gtkw_file)
 
-        self.vcd_signal_vars = SignalDict()
+        # Map signal and memory states to lists of `(vcd_var, get_value, format_change)`.
+        self.vcd_signal_vars = {}
         self.vcd_memory_vars = {}
+        # All variables (without aliases) as `(vcd_var, format_change)`.
+        self.vcd_vars = []
         self.vcd_file = vcd_file
         self.vcd_writer = vcd_file and vcd.VCDWriter(self.vcd_file,
             timescale="1 fs", comment="Generated by Amaranth")
@@ -57,6 +112,8 @@ class _VCDWriter:
         for fragment, fragment_info in design.fragments.items():
             fragment_name = ("bench", *fragment_info.name)
             for signal, signal_name in fragment_info.signal_names.items():
+                if signal in pruned:
+                    continue
                 if signal not in signal_names:
                     signal_names[signal] = set()
                 signal_names[signal].add((*fragment_name, signal_name))
@@ -80,6 +137,10 @@ class _VCDWriter:
                         assigned_names.add(name)
                 else:
                     for trace_signal in trace._rhs_signals():
+                        if trace_signal in pruned:
+                            raise ValueError(f"Signal {trace_signal!r} is not simulated, since it "
+                                             f"does not affect any observed signal; add it to "
+                                             f"`keep` to trace it")
                         if trace_signal not in signal_names:
                             if trace_signal.name not in assigned_names:
                                 name = trace_signal.name
@@ -114,7 +175,8 @@ class _VCDWriter:
             return
 
         for signal, names in itertools.chain(signal_names.items(), trace_names.items()):
-            self.vcd_signal_vars[signal] = []
+            signal_state = self.state.slots[self.state.get_signal(signal)]
+            self.vcd_signal_vars[signal_state] = signal_vcd_vars = []
             self.gtkw_signal_names[signal] = []
 
             def add_var(path, var_type, var_size, var_init, value):
@@ -148,7 +210,12 @@ class _VCDWriter:
                             scope=var_scope, name=field_name,
                             var=vcd_var)
 
-                self.vcd_signal_vars[signal].append((vcd_var, value))
+                if not isinstance(value, (Value, Format, Format.Enum)):
+                    value = self.cached(lambda curr=self.state.curr, index=signal_state.index:
+                                        curr[index], value)
+                format_change = _vcd_formatter(vcd_var, var_type)
+                signal_vcd_vars.append((vcd_var, value, format_change))
+                self.vcd_vars.append((vcd_var, format_change))
 
             def add_wire_var(path, value):
                 add_var(path, "wire", len(value), eval_value(self.state, value), value)
@@ -179,7 +246,8 @@ class _VCDWriter:
                 add_format((), signal._format)
 
         for memory, memory_name in memories.items():
-            self.vcd_memory_vars[memory] = vcd_vars = []
+            memory_state = self.state.slots[self.state.get_memory(memory)]
+            self.vcd_memory_vars[memory_state] = vcd_vars = []
             self.gtkw_memory_names[memory] = gtkw_names = []
 
             for idx, row in enumerate(memory):
@@ -194,10 +262,12 @@ class _VCDWriter:
                             field_name += f"[{item}]"
                         else:
                             field_name += f".{item}"
-                    row_vcd_vars.append((self.vcd_writer.register_var(
+                    vcd_var = self.vcd_writer.register_var(
                         scope=var_scope, name=field_name, var_type=var_type,
-                        size=var_size, init=var_init
-                    ), value))
+                        size=var_size, init=var_init)
+                    format_change = _vcd_formatter(vcd_var, var_type)
+                    row_vcd_vars.append((vcd_var, value, format_change))
+                    self.vcd_vars.append((vcd_var, format_change))
                     if var_size > 1:
                         suffix = f"[{var_size - 1}:0]"
                     else:
@@ -236,30 +306,147 @@ class _VCDWriter:
                 vcd_vars.append(row_vcd_vars)
                 gtkw_names.append(row_gtkw_names)
 
-    def update_signal(self, timestamp, signal):
-        for (vcd_var, repr) in self.vcd_signal_vars.get(signal, ()):
-            if isinstance(repr, Value):
-                var_value = eval_value(self.state, repr)
-            elif isinstance(repr, (Format, Format.Enum)):
-                var_value = eval_format(self.state, repr)
+        # Up to this point, each variable has a value or a format rather than a getter, so that
+        # the getters of all variables can be compiled at once.
+        compiled = []
+        for vcd_vars in itertools.chain(self.vcd_signal_vars.values(),
+                                        *self.vcd_memory_vars.values()):
+            for index, (_, value, _) in enumerate(vcd_vars):
+                if isinstance(value, (Value, Format, Format.Enum)):
+                    compiled.append((vcd_vars, index, value))
+        getters = self.compile_getters([value for _, _, value in compiled])
+        for (vcd_vars, index, _), get_value in zip(compiled, getters):
+            vcd_var, _, format_change = vcd_vars[index]
+            vcd_vars[index] = (vcd_var, get_value, format_change)
+
+    def compile_getter(self, value):
+        return self.compile_getters([value])[0]
+
+    def compile_getters(self, values):
+        # Values of signals and memory rows are read from their state directly. Other values, and
+        # the values used by formats, are compiled to Python code, all at once. Formatted strings
+        # are cached by the values they are formatted from, since formats (enumerations, most of
+        # all) usually have few distinct values.
+        formats = []
+        compiled = []
+        for value in values:
+            if isinstance(value, (Signal, MemoryData._Row)):
+                pass
+            elif isinstance(value, Value):
+                compiled.append(value)
             else:
-                # decoder
-                var_value = repr(eval_value(self.state, signal))
-            self.vcd_writer.change(vcd_var, timestamp, var_value)
-
-    def update_memory(self, timestamp, memory, addr):
-        if memory not in self.vcd_memory_vars:
-            return
-        for vcd_var, repr in self.vcd_memory_vars[memory][addr]:
-            if isinstance(repr, Value):
-                var_value = eval_value(self.state, repr)
+                chunks = Format("{}", value)._chunks
+                formats.append(chunks)
+                compiled.extend(chunk[0] for chunk in chunks if not isinstance(chunk, str))
+        compiled = iter(compile_getters(self.state, compiled))
+        formats = iter(formats)
+
+        getters = []
+        for value in values:
+            if isinstance(value, Signal):
+                getters.append(lambda curr=self.state.curr, index=self.state.get_signal(value):
+                               curr[index])
+            elif isinstance(value, MemoryData._Row):
+                memory_state = self.state.slots[self.state.get_memory(value._memory)]
+                getters.append(lambda memory_state=memory_state, index=value._index:
+                               memory_state.data[index])
+            elif isinstance(value, Value):
+                getters.append(next(compiled))
             else:
-                var_value = eval_format(self.state, repr)
-            self.vcd_writer.change(vcd_var, timestamp, var_value)
+                chunks = next(formats)
+                chunk_getters = [next(compiled) for chunk in chunks if not isinstance(chunk, str)]
+                if len(chunk_getters) == 1:
+                    getters.append(self.cached(chunk_getters[0],
+                        lambda key, chunks=chunks: format_chunks(chunks, (key,))))
+                else:
+                    getters.append(self.cached(
+                        lambda chunk_getters=chunk_getters:
+                            tuple(getter() for getter in chunk_getters),
+                        lambda key, chunks=chunks: format_chunks(chunks, key)))
+        return getters
+
+    def cached(self, get_key, compute):
+        cache = {}
+        cache_size = self.CACHE_SIZE
+        def get_value():
+            key = get_key()
+            try:
+                return cache[key]
+            except KeyError:
+                if len(cache) >= cache_size:
+                    cache.clear()
+                value = cache[key] = compute(key)
+                return value
+        return get_value
+
+    def set_timestamp(self, timestamp):
+        if timestamp != self.timestamp:
+            assert timestamp > self.timestamp
+            if not self.header_written:
+                # Changes at the initial timestamp are included in the `$dumpvars` section.
+                self.vcd_writer.flush()
+                self.header_written = True
+            self.timestamp = timestamp
+            self.timestamp_written = False
+            if (isinstance(self.vcd_file, IndexedGzipFile) and
+                    self.block_size + len(self.buffer) >= self.BLOCK_SIZE):
+                self.begin_block()
+
+    def begin_block(self):
+        self.flush()
+        self.vcd_file.begin_block(self.timestamp)
+        self.block_size = 0
+        self.buffer.append(f"#{self.timestamp}\n$dumpall\n")
+        for vcd_var, format_change in self.vcd_vars:
+            self.buffer.append(format_change(vcd_var.value))
+        self.buffer.append("$end\n")
+        self.timestamp_written = True
+
+    def write_changes(self, vcd_vars):
+        buffer = self.buffer
+        for vcd_var, get_value, format_change in vcd_vars:
+            value = get_value()
+            if value == vcd_var.value:
+                continue
+            vcd_var.value = value
+            if self.header_written:
+                if not self.timestamp_written:
+                    buffer.append(f"#{self.timestamp}\n")
+                    self.timestamp_written = True
+                buffer.append(format_change(value))
+        if len(buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def update_signal(self, timestamp, signal_state):
+        vcd_vars = self.vcd_signal_vars.get(signal_state)
+        if vcd_vars is not None:
+            self.set_timestamp(timestamp)
+            self.write_changes(vcd_vars)
+
+    def update_memory(self, timestamp, memory_state, addr):
+        vcd_vars = self.vcd_memory_vars.get(memory_state)
+        if vcd_vars is not None:
+            self.set_timestamp(timestamp)
+            self.write_changes(vcd_vars[addr])
+
+    def check_trigger(self):
+        pass
+
+    def flush(self):
+        self.vcd_file.write("".join(self.buffer))
+        self.block_size += len(self.buffer)
+        self.buffer.clear()
 
     def close(self, timestamp):
         if self.vcd_writer is not None:
-            self.vcd_writer.close(timestamp)
+            self.set_timestamp(timestamp)
+            if self.header_written:
+                if not self.timestamp_written:
+                    self.buffer.append(f"#{timestamp}\n")
+                self.flush()
+                self.vcd_writer.close()
+            else:
+                self.vcd_writer.close(timestamp)
 
         if self.gtkw_save is not None:
             self.gtkw_save.dumpfile(self.vcd_file.name)
@@ -308,37 +495,153 @@ class _VCDWriter:
 class _PyTimeline:
     def __init__(self):
         self.now = 0
+        # Each waker maps to its heap entry `[deadline, order, waker]`. Heap entries are never
+        # removed eagerly; a cancelled or rescheduled entry has its waker replaced with `None`, and
+        # is discarded once it reaches the top of the heap. The `order` field is unique and
+        # increasing, so wakers with the same deadline are called in the order they were set.
         self.wakers = {}
+        self.deadlines = []
+        self._order = itertools.count()
 
     def reset(self):
         self.now = 0
         self.wakers.clear()
+        self.deadlines.clear()
+
+    def snapshot(self):
+        return (self.now, [entry.copy() for entry in self.wakers.values()])
+
+    def restore(self, snapshot):
+        self.now, entries = snapshot
+        self.wakers = {entry[2]: entry for entry in (entry.copy() for entry in entries)}
+        self.deadlines = list(self.wakers.values())
+        heapq.heapify(self.deadlines)
 
     def set_waker(self, interval, waker):
-        self.wakers[waker] = self.now + interval
+        self.cancel_waker(waker)
+        entry = [self.now + interval, next(self._order), waker]
+        self.wakers[waker] = entry
+        heapq.heappush(self.deadlines, entry)
+
+    def cancel_waker(self, waker):
+        entry = self.wakers.pop(waker, None)
+        if entry is not None:
+            entry[2] = None
+            # Avoid unbounded growth of the heap if wakers are repeatedly cancelled.
+            if len(self.deadlines) > 2 * len(self.wakers) + 64:
+                self.deadlines = list(self.wakers.values())
+                heapq.heapify(self.deadlines)
 
     def advance(self):
-        nearest_wakers = set()
-        nearest_deadline = None
-        for waker, deadline in self.wakers.items():
-            if nearest_deadline is None or deadline <= nearest_deadline:
-                assert deadline >= self.now
-                if nearest_deadline is not None and deadline < nearest_deadline:
-                    nearest_wakers.clear()
-                nearest_wakers.add(waker)
-                nearest_deadline = deadline
-
-        if not nearest_wakers:
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][2] is None:
+            heapq.heappop(deadlines)
+        if not deadlines:
             return False
 
-        for waker in nearest_wakers:
-            waker()
-            del self.wakers[waker]
+        nearest_deadline = deadlines[0][0]
+        assert nearest_deadline >= self.now
+        nearest_wakers = []
+        while deadlines and deadlines[0][0] == nearest_deadline:
+            _deadline, _order, waker = heapq.heappop(deadlines)
+            if waker is not None:
+                del self.wakers[waker]
+                nearest_wakers.append(waker)
 
         self.now = nearest_deadline
+        for waker in nearest_wakers:
+            waker()
         return True
 
 
+class _VCDCaptureWriter(_VCDWriter):
+    # Keeps the value changes of the last `window` femtoseconds in memory, like a logic analyzer,
+    # and only opens the files once triggered (when `trigger` becomes non-zero, or the simulation
+    # raises an exception). From then on, every value change is written as usual.
+    triggered = False
+
+    def __init__(self, state, design, *, vcd_file, gtkw_file=None, traces=(), fs_per_delta=0,
+                 window, trigger=None, pruned=SignalSet()):
+        self.capture_vcd_file  = vcd_file
+        self.capture_gtkw_file = gtkw_file
+        # The header is written by pyvcd to memory, and copied to the file once triggered.
+        super().__init__(state, design, vcd_file=io.StringIO(), traces=traces,
+                         fs_per_delta=fs_per_delta, pruned=pruned)
+
+        self.window = window
+        if trigger is not None:
+            self.get_trigger = self.compile_getter(Value.cast(trigger))
+        else:
+            self.get_trigger = None
+        # The values of every variable at `ring_start`, and the changes after it, as entries of
+        # `[timestamp, [(vcd_var, format_change, value), ...]]`.
+        self.ring_start  = 0
+        self.ring_values = {vcd_var: (format_change, vcd_var.value)
+                            for vcd_var, format_change in self.vcd_vars}
+        self.ring = deque()
+
+    def set_timestamp(self, timestamp):
+        if self.triggered:
+            return super().set_timestamp(timestamp)
+        self.timestamp = timestamp
+        ring, ring_values = self.ring, self.ring_values
+        while ring and ring[0][0] < timestamp - self.window:
+            self.ring_start, changes = ring.popleft()
+            for vcd_var, format_change, value in changes:
+                ring_values[vcd_var] = (format_change, value)
+
+    def write_changes(self, vcd_vars):
+        if self.triggered:
+            return super().write_changes(vcd_vars)
+        if not self.ring or self.ring[-1][0] != self.timestamp:
+            self.ring.append([self.timestamp, []])
+        changes = self.ring[-1][1]
+        for vcd_var, get_value, format_change in vcd_vars:
+            value = get_value()
+            if value != vcd_var.value:
+                vcd_var.value = value
+                changes.append((vcd_var, format_change, value))
+
+    def check_trigger(self):
+        if self.get_trigger is not None and self.get_trigger():
+            self.capture()
+
+    def capture(self):
+        self.vcd_writer.flush()
+        header = self.vcd_file.getvalue()
+        header = header[:header.index("$enddefinitions $end\n")] + "$enddefinitions $end\n"
+
+        import vcd.gtkw
+        self.vcd_file, self.close_vcd = self.open_vcd_file(self.capture_vcd_file)
+        self.gtkw_file, self.close_gtkw = self.open_gtkw_file(self.capture_gtkw_file)
+        self.gtkw_save = self.gtkw_file and vcd.gtkw.GTKWSave(self.gtkw_file)
+
+        buffer = self.buffer
+        buffer.append(header)
+        buffer.append(f"#{self.ring_start}\n$dumpvars\n")
+        for format_change, value in self.ring_values.values():
+            buffer.append(format_change(value))
+        buffer.append("$end\n")
+        last_timestamp = self.ring_start
+        for timestamp, changes in self.ring:
+            if not changes:
+                continue
+            buffer.append(f"#{timestamp}\n")
+            for vcd_var, format_change, value in changes:
+                buffer.append(format_change(value))
+            last_timestamp = timestamp
+        self.flush()
+        self.ring.clear()
+
+        self.header_written = True
+        self.timestamp_written = last_timestamp == self.timestamp
+        self.triggered = True
+
+    def close(self, timestamp):
+        if self.triggered:
+            super().close(timestamp)
+
+
 def _run_wakers(wakers: list, *args):
     # Python doesn't have `.retain()` :(
     index = 0
@@ -349,36 +652,108 @@ def _run_wakers(wakers: list, *args):
     del wakers[index:]
 
 
+class _PyEdgeWakers:
+    # Wakes up the processes and runs the wakers that wait for edges of a signal. These are grouped
+    # by the bit and the polarity of the edge, and this object is registered as the only waker of
+    # the signal for all of them, so that e.g. an edge of a clock that drives many processes is
+    # handled in one call instead of one call per process.
+    __slots__ = ("ready", "groups")
+
+    def __init__(self, ready):
+        self.ready  = ready
+        # Maps `(bit, polarity)` to a list of processes and a list of wakers.
+        self.groups = dict()
+
+    def _group(self, bit, polarity):
+        try:
+            return self.groups[(bit, polarity)]
+        except KeyError:
+            group = self.groups[(bit, polarity)] = (list(), list())
+            return group
+
+    def add_process(self, bit, polarity, process):
+        processes, _wakers = self._group(bit, polarity)
+        assert process not in processes
+        processes.append(process)
+
+    def add_waker(self, bit, polarity, waker):
+        _processes, wakers = self._group(bit, polarity)
+        assert waker not in wakers
+        wakers.append(waker)
+
+    def _wake(self, processes, wakers):
+        ready = self.ready
+        for process in processes:
+            if not process.runnable:
+                process.runnable = True
+                ready.append(process)
+        if wakers:
+            _run_wakers(wakers)
+
+    def __call__(self, curr, next):
+        changed = curr ^ next
+        for (bit, polarity), (processes, wakers) in self.groups.items():
+            if (changed >> bit) & 1 and (next >> bit) & 1 == polarity:
+                self._wake(processes, wakers)
+        return True
+
+
 class _PySignalState(BaseSignalState):
-    __slots__ = ("signal", "is_comb", "curr", "next", "wakers", "pending")
+    # The values of the signal are stored in the `curr` and `next` lists of the engine state,
+    # at the index of its slot, where compiled code accesses them directly.
+    __slots__ = ("signal", "is_comb", "wakers", "edge_wakers", "state", "index")
 
-    def __init__(self, signal, pending):
+    def __init__(self, signal, state, index):
         self.signal  = signal
         self.is_comb = False
-        self.pending = pending
+        self.state   = state
+        self.index   = index
         self.wakers  = list()
+        self.edge_wakers = None
         self.reset()
 
+    @property
+    def curr(self):
+        return self.state.curr[self.index]
+
+    @property
+    def next(self):
+        return self.state.next[self.index]
+
     def reset(self):
-        self.curr = self.next = self.signal.init
+        self.state.curr[self.index] = self.state.next[self.index] = self.signal.init
 
     def add_waker(self, waker):
         assert waker not in self.wakers
         self.wakers.append(waker)
 
+    def add_edge_waker(self, bit, polarity, *, process=None, waker=None):
+        # Wakes up `process`, or runs `waker` (until it returns `False`), whenever `bit` of
+        # the signal changes to `polarity`.
+        if self.edge_wakers is None:
+            self.edge_wakers = _PyEdgeWakers(self.state.ready)
+            self.add_waker(self.edge_wakers)
+        if process is not None:
+            self.edge_wakers.add_process(bit, polarity, process)
+        if waker is not None:
+            self.edge_wakers.add_waker(bit, polarity, waker)
+
     def update(self, value, mask=~0):
-        value = (self.next & ~mask) | (value & mask)
-        if self.next != value:
-            self.next = value
-            self.pending.add(self)
+        next, index = self.state.next, self.index
+        value = (next[index] & ~mask) | (value & mask)
+        if next[index] != value:
+            next[index] = value
+            self.state.mark(index)
 
     def commit(self):
-        if self.curr == self.next:
+        curr, index = self.state.curr, self.index
+        value = self.state.next[index]
+        if curr[index] == value:
             return False
 
-        _run_wakers(self.wakers, self.curr, self.next)
+        _run_wakers(self.wakers, curr[index], value)
 
-        self.curr = self.next
+        curr[index] = value
         return True
 
 
@@ -391,19 +766,40 @@ class _PyMemoryChange:
 
 
 class _PyMemoryState(BaseMemoryState):
-    __slots__ = ("memory", "shape", "data", "write_queue", "wakers", "pending")
+    __slots__ = ("memory", "shape", "init", "data", "shared", "write_queue", "wakers", "state",
+                 "index")
 
-    def __init__(self, memory, pending):
+    def __init__(self, memory, state, index):
         self.memory  = memory
         self.shape   = Shape.cast(memory.shape)
-        self.pending = pending
+        self.init    = memory_storage(memory)
+        self.state   = state
+        self.index   = index
         self.wakers  = list()
         self.reset()
 
+    # The contents are copied on write: after a reset or a restore, `data` is shared with `init`
+    # or with the snapshot (`shared` is true), and is only copied once the memory is written to.
+
     def reset(self):
-        self.data = list(self.memory._init._raw)
+        self.data = self.init
+        self.shared = True
         self.write_queue = {}
 
+    def snapshot(self):
+        self.shared = True
+        return (self.data, self.write_queue.copy())
+
+    def restore(self, snapshot):
+        data, write_queue = snapshot
+        self.data = data
+        self.shared = True
+        self.write_queue = write_queue.copy()
+
+    def _unshare(self):
+        self.data = copy.copy(self.data)
+        self.shared = False
+
     def add_waker(self, waker):
         assert waker not in self.wakers
         self.wakers.append(waker)
@@ -413,6 +809,18 @@ class _PyMemoryState(BaseMemoryState):
             return self.data[addr]
         return 0
 
+    def load(self, addr, rows):
+        # Unlike `write()`, changes the contents immediately; only used by testbenches, which run
+        # after the simulation converges, so nothing else can be in the write queue.
+        assert not self.write_queue
+        _run_wakers(self.wakers)
+        if self.shared:
+            self._unshare()
+        load_rows(self.data, addr, rows)
+
+    def dump(self, addr, count):
+        return dump_rows(self.data, addr, addr + count)
+
     def write(self, addr, value, mask=None):
         if addr in range(self.memory.depth):
             if addr not in self.write_queue:
@@ -425,7 +833,7 @@ class _PyMemoryState(BaseMemoryState):
                 else:
                     value &= (1 << (self.shape.width)) - 1
             self.write_queue[addr] = value
-            self.pending.add(self)
+            self.state.mark(self.index)
 
     def commit(self):
         assert self.write_queue # `commit()` is only called if `self` is pending
@@ -435,6 +843,8 @@ class _PyMemoryState(BaseMemoryState):
         changed = False
         for addr, value in self.write_queue.items():
             if self.data[addr] != value:
+                if self.shared:
+                    self._unshare()
                 self.data[addr] = value
                 changed = True
         self.write_queue.clear()
@@ -442,25 +852,68 @@ class _PyMemoryState(BaseMemoryState):
 
 
 class _PyEngineState(BaseEngineState):
-    def __init__(self):
+    def __init__(self, *, lanes=None):
+        # If not None, the number of instances of the design that are simulated in lockstep.
+        self.lanes    = lanes
         self.timeline = _PyTimeline()
         self.signals  = SignalDict()
         self.memories = dict()
         self.slots    = list()
-        self.pending  = set()
+        # The current and next values of each signal, indexed by slot (`None` for memories).
+        self.curr     = list()
+        self.next     = list()
+        # The indexes of slots with queued updates, and for each slot, whether it is in `pending`.
+        self.pending  = list()
+        self.dirty    = bytearray()
+        self.ready    = list()
 
     def reset(self):
         self.timeline.reset()
         for state in self.slots:
             state.reset()
         self.pending.clear()
+        self.dirty[:] = bytes(len(self.dirty))
+        self.ready.clear()
+
+    def snapshot(self):
+        return (self.timeline.snapshot(), self.curr.copy(), self.next.copy(),
+                [(index, self.slots[index].snapshot()) for index in self.memories.values()],
+                self.pending.copy(), self.ready.copy())
+
+    def restore(self, snapshot):
+        timeline, curr, next, memories, pending, ready = snapshot
+        self.timeline.restore(timeline)
+        # The lists are shared with (and captured by) other objects, and must be updated in place.
+        self.curr[:len(curr)] = curr
+        self.next[:len(next)] = next
+        for index, state_snapshot in memories:
+            self.slots[index].restore(state_snapshot)
+        # Signals and memories first used after the snapshot was taken have their initial values.
+        for state in self.slots[len(curr):]:
+            state.reset()
+        self.pending[:] = pending
+        self.dirty[:] = bytes(len(self.dirty))
+        for index in pending:
+            self.dirty[index] = 1
+        self.ready[:] = ready
+
+    def _add_slot(self):
+        index = len(self.slots)
+        self.curr.append(None)
+        self.next.append(None)
+        self.dirty.append(0)
+        return index
 
     def get_signal(self, signal):
         try:
             return self.signals[signal]
         except KeyError:
-            index = len(self.slots)
-            self.slots.append(_PySignalState(signal, self.pending))
+            index = self._add_slot()
+            if self.lanes is None:
+                self.slots.append(_PySignalState(signal, self, index))
+            else:
+                from ._pylanes import PyLaneSignalState
+                self.slots.append(PyLaneSignalState(signal, self, index, lanes=self.lanes))
             self.signals[signal] = index
             return index
 
@@ -468,24 +921,40 @@ class _PyEngineState(BaseEngineState):
         try:
             return self.memories[memory]
         except KeyError:
-            index = len(self.slots)
-            self.slots.append(_PyMemoryState(memory, self.pending))
+            index = self._add_slot()
+            if self.lanes is None:
+                self.slots.append(_PyMemoryState(memory, self, index))
+            else:
+                from ._pylanes import PyLaneMemoryState
+                self.slots.append(PyLaneMemoryState(memory, self, index, lanes=self.lanes))
             self.memories[memory] = index
             return index
 
+    def mark(self, index):
+        # Queues the slot to be committed; compiled code inlines this.
+        if not self.dirty[index]:
+            self.dirty[index] = 1
+            self.pending.append(index)
+
     def set_delay_waker(self, interval, waker):
         self.timeline.set_waker(interval, waker)
 
     def add_signal_waker(self, signal, waker):
         self.slots[self.get_signal(signal)].add_waker(waker)
 
+    def add_edge_waker(self, signal, bit, polarity, *, process=None, waker=None):
+        self.slots[self.get_signal(signal)].add_edge_waker(bit, polarity,
+                                                           process=process, waker=waker)
+
     def add_memory_waker(self, memory, waker):
         self.slots[self.get_memory(memory)].add_waker(waker)
 
     def commit(self, changed=None):
         converged = True
-        for state in self.pending:
-            if changed is not None:
+        slots, curr, next, dirty = self.slots, self.curr, self.next, self.dirty
+        if changed is not None:
+            for index in self.pending:
+                state = slots[index]
                 if isinstance(state, _PyMemoryState):
                     for addr in state.write_queue:
                         changed.add(_PyMemoryChange(state, addr))
@@ -493,7 +962,19 @@ class _PyEngineState(BaseEngineState):
                     changed.add(state)
                 else:
                     assert False # :nocov:
-            if state.commit():
+        for index in self.pending:
+            dirty[index] = 0
+            value = next[index]
+            if value is None or self.lanes is not None:
+                # A memory, or a signal whose values are arrays.
+                if slots[index].commit():
+                    converged = False
+            elif curr[index] != value:
+                # Inlined `_PySignalState.commit()`.
+                wakers = slots[index].wakers
+                if wakers:
+                    _run_wakers(wakers, curr[index], value)
+                curr[index] = value
                 converged = False
         self.pending.clear()
         return converged
@@ -508,18 +989,22 @@ class _PyTriggerState:
 
         self._result = None
         self._broken = False
+        # Indexes of the edge and delay triggers that have been hit.
         self._triggers_hit = set()
         self._delay_wakers = dict()
+        # A function that computes the result (see `PySimEngine._compiled_sampler()`), `False` if
+        # the result is computed by `compute_result()` itself, or `None` if not yet known.
+        self._sampler = None
 
-        for trigger in combination._triggers:
+        for index, trigger in enumerate(combination._triggers):
             if isinstance(trigger, SampleTrigger):
                 pass # does not cause a wakeup
             elif isinstance(trigger, ChangedTrigger):
                 self.add_changed_waker(trigger)
             elif isinstance(trigger, EdgeTrigger):
-                self.add_edge_waker(trigger)
+                self.add_edge_waker(index, trigger)
             elif isinstance(trigger, DelayTrigger):
-                self.add_delay_waker(trigger)
+                self.add_delay_waker(index, trigger)
             else:
                 assert False # :nocov:
 
@@ -531,24 +1016,21 @@ class _PyTriggerState:
             return not self._oneshot
         self._engine.state.add_signal_waker(trigger.signal, waker)
 
-    def add_edge_waker(self, trigger):
-        def waker(curr, next):
+    def add_edge_waker(self, index, trigger):
+        def waker():
             if self._broken:
                 return False
-            curr_bit = (curr >> trigger.bit) & 1
-            next_bit = (next >> trigger.bit) & 1
-            if curr_bit == next_bit or next_bit != trigger.polarity:
-                return True # wait until next edge
-            self._triggers_hit.add(trigger)
+            self._triggers_hit.add(index)
             self.activate()
             return not self._oneshot
-        self._engine.state.add_signal_waker(trigger.signal, waker)
+        self._engine.state.add_edge_waker(trigger.signal, trigger.bit, trigger.polarity,
+                                          waker=waker)
 
-    def add_delay_waker(self, trigger):
+    def add_delay_waker(self, index, trigger):
         def waker():
             if self._broken:
                 return
-            self._triggers_hit.add(trigger)
+            self._triggers_hit.add(index)
             self.activate()
         self._engine.state.set_delay_waker(trigger.interval.femtoseconds, waker)
         self._delay_wakers[waker] = trigger.interval.femtoseconds
@@ -560,24 +1042,39 @@ class _PyTriggerState:
             self._broken = True
 
     def compute_result(self):
+        if self._sampler is None:
+            self._sampler = self._engine._compiled_sampler(self._combination._triggers)
+        if self._sampler:
+            self._result = self._sampler(self._triggers_hit)
+            return
+
         result = []
-        for trigger in self._combination._triggers:
+        for index, trigger in enumerate(self._combination._triggers):
             if isinstance(trigger, (SampleTrigger, ChangedTrigger)):
                 value = self._engine.get_value(trigger.value)
                 if isinstance(trigger.shape, ShapeCastable):
-                    result.append(trigger.shape.from_bits(value))
+                    if self._engine.state.lanes is None:
+                        result.append(trigger.shape.from_bits(value))
+                    else:
+                        result.append([trigger.shape.from_bits(int(lane_value))
+                                       for lane_value in value])
                 else:
                     result.append(value)
             elif isinstance(trigger, (EdgeTrigger, DelayTrigger)):
-                result.append(trigger in self._triggers_hit)
+                result.append(index in self._triggers_hit)
             else:
                 assert False # :nocov:
         self._result = tuple(result)
 
     def run(self):
         self.compute_result()
-        self._combination._process.runnable = True
-        self._combination._process.waits_on = None
+        process = self._combination._process
+        if not process.runnable:
+            process.runnable = True
+            # Testbenches are scheduled by `PySimEngine.advance()` in a deterministic order instead.
+            if not process.testbench:
+                self._engine.state.ready.append(process)
+        process.waits_on = None
         self._triggers_hit.clear()
         for waker, interval_fs in self._delay_wakers.items():
             self._engine.state.set_delay_waker(interval_fs, waker)
@@ -598,16 +1095,104 @@ class _PyTriggerState:
         return self._result
 
 
+class _PySnapshot:
+    def __init__(self, engine, *, state, processes, testbenches, delta_cycles):
+        self.engine       = engine
+        self.state        = state
+        # Maps each process to its state, or for async processes, to whether it has finished.
+        self.processes    = processes
+        self.testbenches  = testbenches
+        self.delta_cycles = delta_cycles
+
+
 class PySimEngine(BaseEngine):
-    def __init__(self, design):
+    # Options:
+    # * `levelize`: evaluate combinational processes in the order of their dependencies, committing
+    #   the outputs of each one immediately, so that a chain of combinational logic spanning many
+    #   fragments settles in a single delta cycle instead of one delta cycle per fragment.
+    # * `flatten`: disregard the design hierarchy, and compile all combinational logic into one
+    #   function and all synchronous logic of each clock domain into one function, reducing
+    #   the overhead of process scheduling and allowing values of combinational signals to be
+    #   passed between fragments in local variables.
+    # * `lanes`: simulate this many instances of the design in lockstep, storing the value of each
+    #   signal in every instance in a NumPy array. Every instance runs the same processes and
+    #   testbenches, but `get_value()` returns, and `set_value()` accepts, an array with one value
+    #   for each lane. Clock signals must have the same value in every lane, values may be at most
+    #   63 bits wide, and waveforms cannot be written. Combinational logic is evaluated in every
+    #   lane whenever its inputs change in any lane, so `Print` statements in combinational logic
+    #   may print more often than they would in a separate simulation of each lane.
+    # * `cycle_based`: for designs with at most one clock domain and no asynchronous resets,
+    #   flatten the design, order combinational logic by statement rather than by fragment, and
+    #   evaluate it together with the flip-flops on each clock edge, so that the design settles in
+    #   one evaluation of "clock all flip-flops, settle combinational logic" per clock edge.
+    #   Combinational cycles are permitted, but are evaluated as slowly as without this option.
+    # * `prune`: only simulate the logic that affects an observed signal: a signal named in
+    #   the top-level module, a signal in `keep` (an iterable of values), an input of a memory, or
+    #   an input of a `Print` or a `Property` statement. Other signals driven by the design (e.g.
+    #   unused status registers in a submodule) are not simulated, and accessing them from
+    #   a testbench or a process, or tracing them, raises an error; signals that are not simulated
+    #   are omitted from waveforms.
+    def __init__(self, design, *, levelize=False, flatten=False, lanes=None, cycle_based=False,
+                 prune=False, keep=()):
+        if cycle_based and lanes is not None:
+            raise ValueError("Cycle-based simulation cannot be combined with lanes")
+        if keep and not prune:
+            raise ValueError("Signals to keep can only be specified when pruning the design")
+        if lanes is not None:
+            if not isinstance(lanes, int) or lanes <= 0:
+                raise TypeError(f"Number of lanes must be a positive integer, not {lanes!r}")
+            try:
+                import numpy
+            except ImportError: # :nocov:
+                raise ImportError("Simulating with lanes requires NumPy") from None
+
         self._design = design
 
-        self._state = _PyEngineState()
-        self._processes = _FragmentCompiler(self._state)(self._design.fragment)
+        self._state = _PyEngineState(lanes=lanes)
+        if prune:
+            statements, pruned = prune_statements(design, keep)
+        else:
+            statements, pruned = None, SignalSet()
+        compiler = _FragmentCompiler(self._state, flatten=flatten, cycle_based=cycle_based,
+                                     statements=statements)
+        self._init_runtime_state(compiler(self._design.fragment))
+        self._pruned = pruned
+        # Signals driven by flip-flops do not wake up the combinational logic process in
+        # cycle-based simulation; if they are set by a testbench, it is woken up explicitly.
+        self._cycle_comb_process = compiler.cycle_comb_process
+        self._cycle_registers = compiler.cycle_registers
+        if levelize:
+            self._comb_ranks = rank_comb_processes(self._processes)
+        # Idle clock cycles are skipped unless doing so would skip printing or checking properties.
+        self._idle_skip = not any(_has_side_effects(stmts)
+                                  for fragment in self._design.fragments
+                                  for stmts in fragment.statements.values())
+
+    def _init_runtime_state(self, processes):
+        # Initializes the state that does not depend on how the design is compiled, and the state
+        # of every option as if it was disabled. Shared with `CxxSimEngine`, which does not
+        # compile the design itself.
+        self._processes = processes
         self._testbenches = []
+        self._external_waits = []
+        self._schedule_initial(self._processes)
+        self._getters = {}
+        self._setters = {}
+        self._samplers = {}
+        self._decoders = {}
         self._delta_cycles = 0
         self._vcd_writers = []
         self._active_triggers = set()
+        self._profiler = None
+        self._signal_names = None
+        self._pruned = SignalSet()
+        self._comb_ranks = None
+        self._cycle_comb_process = None
+        self._cycle_registers = SignalSet()
+        self._cycle_watched = SignalSet()
+        self._idle_skip = False
+        self._idle_since = None
+        self._triggers_ran = False
 
     @property
     def state(self) -> BaseEngineState:
@@ -617,82 +1202,407 @@ class PySimEngine(BaseEngine):
     def now(self):
         return self._state.timeline.now
 
+    @property
+    def external_waits(self):
+        return self._external_waits
+
     def _now_plus_deltas(self, fs_per_delta):
         return self._state.timeline.now + self._delta_cycles * fs_per_delta
 
+    def _schedule_initial(self, processes):
+        for process in processes:
+            if process.runnable:
+                self._state.ready.append(process)
+
     def reset(self):
         self._state.reset()
+        self._active_triggers.clear()
+        self._external_waits.clear()
+        self._idle_since = None
         for process in self._processes:
             process.reset()
+        self._schedule_initial(self._processes)
         for testbench in self._testbenches:
             testbench.reset()
 
+    def snapshot(self):
+        processes = {}
+        for process in self._processes:
+            if type(process) is AsyncProcess:
+                processes[process] = process.coroutine is None
+            else:
+                processes[process] = process.snapshot()
+        return _PySnapshot(self,
+            state=self._state.snapshot(),
+            processes=processes,
+            testbenches={testbench: testbench.coroutine is None for testbench in self._testbenches},
+            delta_cycles=self._delta_cycles)
+
+    def restore(self, snapshot):
+        assert isinstance(snapshot, _PySnapshot) and snapshot.engine is self
+        if self._vcd_writers:
+            raise ValueError("Cannot restore a snapshot while writing waveforms")
+
+        self._state.restore(snapshot.state)
+        self._active_triggers.clear()
+        self._delta_cycles = snapshot.delta_cycles
+        self._external_waits.clear()
+        self._idle_since = None
+
+        # Processes and testbenches added after the snapshot was taken are removed. Async processes
+        # are restarted, since their state is not captured; the triggers they were waiting on are
+        # broken, and are discarded when they next activate.
+        self._state.ready[:] = [process for process in self._state.ready
+                                if type(process) is not AsyncProcess]
+        for process in self._processes - snapshot.processes.keys():
+            if type(process) is AsyncProcess:
+                process.restart(finished=True)
+        self._processes = set(snapshot.processes)
+        for process, process_snapshot in snapshot.processes.items():
+            if type(process) is AsyncProcess:
+                process.restart(finished=process_snapshot)
+                self._schedule_initial([process])
+            else:
+                process.restore(process_snapshot)
+        for testbench in self._testbenches:
+            if testbench not in snapshot.testbenches:
+                testbench.restart(finished=True)
+        self._testbenches = list(snapshot.testbenches)
+        for testbench, finished in snapshot.testbenches.items():
+            testbench.restart(finished=finished)
+
     def add_clock_process(self, clock, *, phase, period):
         slot = self.state.get_signal(clock)
         if self.state.slots[slot].is_comb:
             raise DriverConflict("Clock signal is already driven by combinational logic")
 
-        self._processes.add(PyClockProcess(self._state, clock,
-                                           phase=phase, period=period))
+        process = PyClockProcess(self._state, clock, phase=phase, period=period)
+        self._processes.add(process)
+        self._schedule_initial([process])
 
     def add_async_process(self, simulator, process):
-        self._processes.add(AsyncProcess(self._design, self, process,
-                                         testbench=False, background=True))
+        process = AsyncProcess(self._design, self, process, testbench=False, background=True)
+        self._processes.add(process)
+        self._schedule_initial([process])
 
     def add_async_testbench(self, simulator, process, *, background):
         self._testbenches.append(AsyncProcess(self._design, self, process,
                                               testbench=True, background=background))
 
     def add_trigger_combination(self, combination, *, oneshot):
+        if self._pruned:
+            for trigger in combination._triggers:
+                if isinstance(trigger, (SampleTrigger, ChangedTrigger)):
+                    self._check_simulated(trigger.value)
+                elif isinstance(trigger, EdgeTrigger):
+                    self._check_simulated(trigger.signal)
         return _PyTriggerState(self, combination, self._active_triggers, oneshot=oneshot)
 
+    _MAX_COMPILED_EXPRS = 4096
+
+    def _compiled(self, cache, expr, compiler):
+        # Expressions are compiled the second time they are used. This avoids compiling the many
+        # expressions that are constructed in order to be evaluated only once, while the ones
+        # that are retained (e.g. signals and views in an interface) and repeatedly used are
+        # compiled. The cache is keyed by identity and also retains `expr` so that its `id()`
+        # cannot be reused. When simulating with lanes, expressions are always compiled, since
+        # the interpreter does not handle arrays of values.
+        try:
+            cached_expr, function = cache[id(expr)]
+        except KeyError:
+            cached_expr = None
+        if cached_expr is not expr:
+            if self._pruned:
+                self._check_simulated(expr)
+            if len(cache) >= self._MAX_COMPILED_EXPRS:
+                cache.clear()
+            cache[id(expr)] = (expr, None)
+            if self._state.lanes is None:
+                return None
+            function = None
+        if function is None:
+            try:
+                # A compiler returns `None` for expressions it does not handle; these, as well as
+                # e.g. `ClockSignal()` in an expression, are always interpreted.
+                function = compiler(self._state, Value.cast(expr)) or False
+            except (TypeError, NotImplementedError):
+                function = False
+            cache[id(expr)] = (expr, function)
+        return function
+
+    # Decoders with these implementations of `from_bits()` return immutable objects that depend only
+    # on the bits, and can be memoized.
+    _MEMOIZED_FROM_BITS = (data.Layout.from_bits, type(data.Struct).from_bits,
+                           enum.EnumType.from_bits)
+
+    def _decoder(self, shape):
+        if not isinstance(shape, ShapeCastable):
+            return None
+        try:
+            _shape, decoder = self._decoders[id(shape)]
+            return decoder
+        except KeyError:
+            pass
+        if getattr(type(shape), "from_bits", None) in self._MEMOIZED_FROM_BITS:
+            cache = {}
+            def decoder(bits, from_bits=shape.from_bits):
+                try:
+                    return cache[bits]
+                except KeyError:
+                    if len(cache) >= self._MAX_COMPILED_EXPRS:
+                        cache.clear()
+                    value = cache[bits] = from_bits(bits)
+                    return value
+        else:
+            decoder = shape.from_bits
+        # The cache retains `shape` so that its `id()` cannot be reused.
+        self._decoders[id(shape)] = (shape, decoder)
+        return decoder
+
+    def _compiled_sampler(self, triggers):
+        # Returns a function that computes the result of a trigger combination with `triggers` from
+        # the indexes of the triggers that have been hit, `None` if the function will be compiled
+        # the next time the same values are sampled, or `False` if it cannot be compiled. As with
+        # `_compiled()`, the cache is keyed by the identity of the sampled values (other than
+        # constants, which are often created for each wait) and shape-castable objects, and
+        # the function is compiled the second time they are used; this way, a one-shot wait that
+        # samples the same values every cycle is compiled once.
+        if self._state.lanes is not None:
+            return False
+        values = []
+        key = []
+        for trigger in triggers:
+            if isinstance(trigger, (SampleTrigger, ChangedTrigger)):
+                value, shape = trigger.value, trigger.shape
+                if type(value) is Const:
+                    value_key = (value.value, len(value), value.shape().signed)
+                else:
+                    value_key = id(value)
+                if isinstance(shape, ShapeCastable):
+                    values.append((value, shape))
+                    key.append((value_key, id(shape)))
+                else:
+                    values.append((value, None))
+                    key.append((value_key, None))
+            else:
+                values.append(None)
+                key.append(None)
+        key = tuple(key)
+        try:
+            _values, sampler = self._samplers[key]
+        except KeyError:
+            if len(self._samplers) >= self._MAX_COMPILED_EXPRS:
+                self._samplers.clear()
+            # The cache retains the values and the shapes so that their `id()` cannot be reused.
+            self._samplers[key] = (values, None)
+            return None
+        if sampler is None:
+            try:
+                sampler = compile_sampler(self._state,
+                    [None if item is None else item[0] for item in values],
+                    [None if item is None or item[1] is None else self._decoder(item[1])
+                     for item in values])
+            except (TypeError, NotImplementedError):
+                sampler = False
+            self._samplers[key] = (values, sampler)
+        return sampler
+
+    def _check_simulated(self, expr):
+        try:
+            signals = Value.cast(expr)._rhs_signals()
+        except NotImplementedError:
+            # Memory rows, which are never pruned, do not have a set of signals; an expression
+            # that includes one is not checked.
+            return
+        for signal in signals:
+            if signal in self._pruned:
+                raise ValueError(f"Signal {signal!r} is not simulated, since it does not affect "
+                                 f"any observed signal; add it to `keep` to observe it")
+
     def get_value(self, expr):
-        return eval_value(self._state, Value.cast(expr))
+        getter = self._compiled(self._getters, expr, compile_getter)
+        if getter:
+            value = getter()
+        else:
+            value = eval_value(self._state, Value.cast(expr))
+        if self._state.lanes is not None:
+            value = self._lane_values(value)
+        return value
 
     def set_value(self, expr, value):
-        assert isinstance(value, int)
+        if self._state.lanes is not None:
+            if isinstance(value, int):
+                value &= (1 << len(Value.cast(expr))) - 1
+            value = self._lane_values(value)
+        else:
+            assert isinstance(value, int)
+        if self._cycle_comb_process is not None:
+            self._watch_registers(expr)
+        setter = self._compiled(self._setters, expr, compile_setter)
+        if setter:
+            return setter(value)
         return eval_assign(self._state, Value.cast(expr), value)
 
+    def _watch_registers(self, expr):
+        # Wake up the combinational logic process once a register set from outside the design
+        # changes.
+        try:
+            signals = Value.cast(expr)._lhs_signals()
+        except NotImplementedError:
+            return # a memory row
+        for signal in signals:
+            if signal in self._cycle_registers and signal not in self._cycle_watched:
+                self._cycle_watched.add(signal)
+                self._state.add_signal_waker(signal, self._cycle_watcher(signal))
+
+    def _cycle_watcher(self, signal):
+        process = self._cycle_comb_process
+        def waker(curr, next):
+            self._cycle_watched.remove(signal)
+            if not process.runnable:
+                process.runnable = True
+                self._state.ready.append(process)
+            return False
+        return waker
+
+    def memory_load(self, memory, offset, buffer):
+        if self._state.lanes is not None:
+            raise ValueError("Memories cannot be loaded when simulating with lanes")
+        memory_state = self._state.slots[self._state.get_memory(memory)]
+        rows = rows_from_buffer(memory_state.shape, buffer)
+        if offset + len(rows) > memory.depth:
+            raise ValueError(f"Cannot load {len(rows)} rows at offset {offset} into a memory "
+                             f"with depth {memory.depth}")
+        memory_state.load(offset, rows)
+        for vcd_writer in self._vcd_writers:
+            if memory_state in vcd_writer.vcd_memory_vars:
+                now_plus_deltas = self._now_plus_deltas(vcd_writer.fs_per_delta)
+                for addr in range(offset, offset + len(rows)):
+                    vcd_writer.update_memory(now_plus_deltas, memory_state, addr)
+
+    def memory_dump(self, memory, offset, count):
+        if self._state.lanes is not None:
+            raise ValueError("Memories cannot be dumped when simulating with lanes")
+        memory_state = self._state.slots[self._state.get_memory(memory)]
+        rows = memory_state.dump(offset, count)
+        if isinstance(rows, list):
+            return rows
+        return rows.tolist()
+
+    def _lane_values(self, value):
+        import numpy
+        value = numpy.asarray(value, dtype=numpy.int64)
+        if value.ndim == 0:
+            return numpy.full(self._state.lanes, value)
+        if value.shape != (self._state.lanes,):
+            raise ValueError(f"Expected a value or an array of {self._state.lanes} values, "
+                             f"not an array of shape {value.shape}")
+        return value.copy()
+
+    def _run_levelized(self, levelized, changed):
+        # Run combinational processes in the order of their ranks, committing the outputs of each
+        # one immediately so that its readers (which are always ranked later, unless there is
+        # a combinational cycle) observe the new values within the same delta cycle.
+        ready = self._state.ready
+        profiler = self._profiler
+        while levelized:
+            _rank, process = heapq.heappop(levelized)
+            process.runnable = False
+            if profiler is None:
+                process.run()
+            else:
+                profiler.run(process, self._state.pending)
+                profiler.commit(self._state.pending)
+            self._state.commit(changed)
+
+            index = 0
+            for woken in ready:
+                if woken in self._comb_ranks:
+                    heapq.heappush(levelized, (self._comb_ranks[woken], woken))
+                else:
+                    ready[index] = woken
+                    index += 1
+            del ready[index:]
+
+            if ready or self._active_triggers:
+                # Something other than combinational logic has been woken up (e.g. a clock edge
+                # has been committed); it must observe the values from before the rest of
+                # combinational logic runs, so defer it to the next delta cycle.
+                ready.extend(process for _rank, process in levelized)
+                break
+
     def step_design(self):
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.step(self._state.pending)
+
         # Performs the three phases of a delta cycle in a loop:
         converged = False
         while not converged:
             changed = set() if self._vcd_writers else None
 
             # 1a. trigger: run every active trigger, sampling values and waking up processes;
-            for trigger_state in self._active_triggers:
-                trigger_state.run()
-            self._active_triggers.clear()
-
-            # 1b. eval: run every runnable processes once, queueing signal changes;
-            for process in self._processes:
-                if process.runnable:
-                    process.runnable = False
+            if self._active_triggers:
+                self._triggers_ran = True
+                for trigger_state in self._active_triggers:
+                    if profiler is None:
+                        trigger_state.run()
+                    else:
+                        profiler.run(trigger_state, self._state.pending,
+                                     key=(_PyTriggerState, trigger_state._combination._process))
+                self._active_triggers.clear()
+
+            # 1b. eval: run every process that was woken up once, queueing signal changes;
+            ready = self._state.ready
+            runnable = ready.copy()
+            ready.clear()
+            levelized = []
+            for process in runnable:
+                if self._comb_ranks is not None and process in self._comb_ranks:
+                    heapq.heappush(levelized, (self._comb_ranks[process], process))
+                    continue
+                process.runnable = False
+                if profiler is None:
                     process.run()
-                    if type(process) is AsyncProcess and process.waits_on is not None:
-                        assert type(process.waits_on) is _PyTriggerState, \
-                            "Async processes may only await simulation triggers"
+                else:
+                    profiler.run(process, self._state.pending)
+                if type(process) is AsyncProcess and process.waits_on is not None:
+                    assert type(process.waits_on) is _PyTriggerState, \
+                        "Async processes may only await simulation triggers"
+            if levelized:
+                self._run_levelized(levelized, changed)
 
             # 2. commit: apply queued signal changes, activating any awaited triggers.
-            converged = self._state.commit(changed)
+            if profiler is not None:
+                profiler.commit(self._state.pending)
+            converged = self._state.commit(changed) and not ready and not self._active_triggers
 
             for vcd_writer in self._vcd_writers:
                 now_plus_deltas = self._now_plus_deltas(vcd_writer.fs_per_delta)
                 for change in changed:
                     if type(change) is _PySignalState:
                         signal_state = change
-                        vcd_writer.update_signal(now_plus_deltas,
-                            signal_state.signal)
+                        vcd_writer.update_signal(now_plus_deltas, signal_state)
                     elif type(change) is _PyMemoryChange:
-                        vcd_writer.update_memory(now_plus_deltas, change.state.memory,
-                            change.addr)
+                        vcd_writer.update_memory(now_plus_deltas, change.state, change.addr)
                     else:
                         assert False # :nocov:
+                if not vcd_writer.triggered:
+                    vcd_writer.check_trigger()
 
             self._delta_cycles += 1
 
-    def advance(self):
+    def advance(self, *, deadline=None):
+        # A timestep is idle if only clocks toggle in it, and the rest of the design (aside from
+        # sampling the clocks) does nothing: no trigger activates, and the design converges in
+        # the delta cycle after the one that toggles the clocks.
+        idle = (self._idle_skip and not self._vcd_writers and not self._active_triggers and
+                all(type(process) is PyClockProcess and not process.initial
+                    for process in self._state.ready))
+        self._triggers_ran = False
+
         # Run triggers and processes until the simulation converges.
+        delta_cycles = self._delta_cycles
         self.step_design()
 
         # Run testbenches that have been awoken in `step_design()` by active triggers.
@@ -703,14 +1613,37 @@ class PySimEngine(BaseEngine):
             for testbench in self._testbenches:
                 if testbench.runnable:
                     testbench.runnable = False
-                    testbench.run()
+                    if self._profiler is None:
+                        testbench.run()
+                    else:
+                        self._profiler.run(testbench, self._state.pending)
                     if type(testbench) is AsyncProcess and testbench.waits_on is not None:
-                        assert type(testbench.waits_on) is _PyTriggerState, \
-                            "Async testbenches may only await simulation triggers"
+                        if type(testbench.waits_on) is _ExternalWait:
+                            self._external_waits.append(testbench.waits_on)
+                        else:
+                            assert type(testbench.waits_on) is _PyTriggerState, \
+                                "Async testbenches may only await simulation triggers"
                     converged = False
+                    idle = False
 
-        # Now that the simulation has converged for the current time, advance the timeline.
-        self._state.timeline.advance()
+        if self._profiler is not None:
+            self._profiler.timestep(self._delta_cycles - delta_cycles)
+
+        if self._external_waits:
+            # Testbenches waiting for the host event loop (see `Simulator.run_async()`) hold
+            # the simulation at the current point in time until they are resumed.
+            self._idle_since = None
+        else:
+            if idle and not self._triggers_ran and self._delta_cycles - delta_cycles == 2:
+                if self._idle_since is None:
+                    self._idle_since = self._state.timeline.now
+                else:
+                    self._skip_idle(deadline)
+            else:
+                self._idle_since = None
+
+            # Now that the simulation has converged for the current time, advance the timeline.
+            self._state.timeline.advance()
 
         # Check if the simulation has any critical processes or testbenches.
         for runnables in (self._processes, self._testbenches):
@@ -719,13 +1652,104 @@ class PySimEngine(BaseEngine):
                     return True
         return False
 
+    def _skip_idle(self, deadline):
+        # Once every clock has completed a whole number of periods since the design has become
+        # idle, the design will remain idle for as long as only the clocks toggle, so the clocks
+        # can be moved forward by a whole number of such periods, up to the next event that is not
+        # a clock edge (or `deadline`, which is not passed).
+        clocks = [process for process in self._processes if type(process) is PyClockProcess]
+        hyperperiod = 1
+        for clock in clocks:
+            if clock.started is None or clock.started > self._idle_since:
+                return
+            hyperperiod = math.lcm(hyperperiod, clock.period // 2 * 2)
+        timeline = self._state.timeline
+        if timeline.now - self._idle_since < hyperperiod:
+            return
+
+        clock_entries = []
+        limit = deadline
+        for waker, entry in timeline.wakers.items():
+            if isinstance(getattr(waker, "__self__", None), PyClockProcess):
+                clock_entries.append(entry)
+            elif limit is None or entry[0] < limit:
+                limit = entry[0]
+        if limit is None or not clock_entries:
+            return
+        periods = (limit - min(entry[0] for entry in clock_entries)) // hyperperiod
+        if periods <= 0:
+            return
+        for entry in clock_entries:
+            entry[0] += periods * hyperperiod
+        heapq.heapify(timeline.deadlines)
+
+    def _describe_runnable(self, runnable):
+        # Returns `(kind, name, domain)` of a process, testbench, or trigger for `profile()`.
+        if type(runnable) is _PyTriggerState:
+            return ("trigger", self._describe_runnable(runnable._combination._process)[1], None)
+        elif isinstance(runnable, AsyncProcess):
+            kind = "testbench" if runnable.testbench else "process"
+            return (kind, getattr(runnable.constructor, "__qualname__", repr(runnable.constructor)),
+                    None)
+        elif isinstance(runnable, PyClockProcess):
+            return ("clock", self._describe_state(runnable.slot), None)
+        elif getattr(runnable, "fragment", None) is not None:
+            fragment_info = self._design.fragments[runnable.fragment]
+            return ("rtl", ".".join(fragment_info.name), runnable.domain)
+        else:
+            return ("rtl", "(flattened)", getattr(runnable, "domain", None))
+
+    def _describe_state(self, index):
+        # Returns the hierarchical name of the signal or memory in a slot for `profile()`.
+        if self._signal_names is None:
+            self._signal_names = SignalDict()
+            self._memory_names = {}
+            for fragment, fragment_info in self._design.fragments.items():
+                for signal, signal_name in fragment_info.signal_names.items():
+                    if signal not in self._signal_names:
+                        self._signal_names[signal] = ".".join((*fragment_info.name, signal_name))
+                if isinstance(fragment, MemoryInstance):
+                    self._memory_names[fragment._data] = ".".join(fragment_info.name)
+        state = self._state.slots[index]
+        if isinstance(state, BaseMemoryState):
+            return self._memory_names.get(state.memory, state.memory.name)
+        elif state.signal in self._signal_names:
+            return self._signal_names[state.signal]
+        else:
+            return state.signal.name
+
     @contextmanager
-    def write_vcd(self, *, vcd_file, gtkw_file, traces, fs_per_delta):
-        vcd_writer = _VCDWriter(self._state, self._design,
-            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces, fs_per_delta=fs_per_delta)
+    def profile(self):
+        if self._profiler is not None:
+            raise ValueError("The simulation is already being profiled")
+        self._profiler = Profiler(describe_runnable=self._describe_runnable,
+                                  describe_state=self._describe_state)
+        try:
+            yield self._profiler.profile
+        finally:
+            self._profiler.stop()
+            self._profiler = None
+
+    @contextmanager
+    def write_vcd(self, *, vcd_file, gtkw_file, traces, fs_per_delta, window=None, trigger=None):
+        if self._state.lanes is not None:
+            raise ValueError("Waveforms cannot be written when simulating with lanes")
+        if window is None:
+            vcd_writer = _VCDWriter(self._state, self._design,
+                vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces, fs_per_delta=fs_per_delta,
+                pruned=self._pruned)
+        else:
+            vcd_writer = _VCDCaptureWriter(self._state, self._design,
+                vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces, fs_per_delta=fs_per_delta,
+                window=window, trigger=trigger, pruned=self._pruned)
         try:
             self._vcd_writers.append(vcd_writer)
             yield
+        except BaseException:
+            # Keep the waveforms leading up to a failure (or an interrupted simulation).
+            if not vcd_writer.triggered:
+                vcd_writer.capture()
+            raise
         finally:
             vcd_writer.close(self._now_plus_deltas(vcd_writer.fs_per_delta))
             self._vcd_writers.remove(vcd_writer)
@@ -1,10 +1,20 @@
 import os
+import copy
+import asyncio
+import json
+import re
+import gzip
+import tempfile
+import unittest.mock
 import warnings
 from contextlib import contextmanager, redirect_stdout
-from io import StringIO
+from io import StringIO, BytesIO
+from array import array
 from textwrap import dedent
 
 from amaranth._utils import flatten
+from amaranth._toolchain import has_tool
+from amaranth._toolchain.yosys import find_yosys, YosysError
 from amaranth.hdl._ast import *
 from amaranth.hdl._cd import  *
 from amaranth.hdl._dsl import *
@@ -12,12 +22,20 @@ from amaranth.hdl._mem import MemoryData
 from amaranth.hdl._ir import *
 from amaranth.sim import *
 from amaranth.sim._pyeval import eval_format
+from amaranth.sim.pysim import _PyTimeline
+from amaranth.sim._pymem import SPARSE_DEPTH, SparseStorage, memory_storage
+from amaranth.sim._vcdgz import read_index, read_vcd
 from amaranth.lib.memory import Memory
 from amaranth.lib import enum, data, wiring
 
 from .utils import *
 from amaranth._utils import _ignore_deprecated
 
+try:
+    import numpy
+except ImportError: # :nocov:
+    numpy = None
+
 
 class SimulatorUnitTestCase(FHDLTestCase):
     def assertStatement(self, stmt, inputs, output, init=0):
@@ -1540,6 +1558,2102 @@ class SimulatorTracesTestCase(FHDLTestCase):
         a = sig.create()
         self.assertDef(a, [a])
 
+    def test_value_changes(self):
+        class MyEnum(enum.Enum, shape=2):
+            A = 0
+            B = 1
+
+        a = Signal(signed(4))
+        b = Signal()
+        e = Signal(MyEnum)
+
+        async def testbench(ctx):
+            ctx.set(a, -2)
+            await ctx.delay(Period(fs=10))
+            ctx.set(a, 3)
+            ctx.set(b, 1)
+            await ctx.delay(Period(fs=10))
+            ctx.set(e, MyEnum.B)
+            ctx.set(a, 3)
+            await ctx.delay(Period(fs=10))
+
+        sim = Simulator(Module())
+        sim.add_testbench(testbench)
+        output = StringIO()
+        with unittest.mock.patch.object(output, "close"):
+            with sim.write_vcd(output, traces=[a, b, e]):
+                sim.run()
+        self.assertEqual(output.getvalue().split("$enddefinitions $end\n")[1], dedent("""\
+            #0
+            $dumpvars
+            b1110 !
+            0"
+            sA #
+            $end
+            #10
+            b11 !
+            1"
+            #20
+            sB #
+            #40
+        """))
+
+    def test_cached_strings(self):
+        calls = []
+        def decoder(value):
+            calls.append(value)
+            return f"v{value}"
+
+        a = Signal(2, decoder=decoder)
+        s = Signal(data.StructLayout({"x": signed(2), "y": 2}))
+
+        async def testbench(ctx):
+            for value in [1, 2, 1, 2, 1]:
+                ctx.set(a, value)
+                ctx.set(s.x, -value)
+                await ctx.delay(Period(fs=10))
+
+        sim = Simulator(Module())
+        sim.add_testbench(testbench)
+        output = StringIO()
+        with unittest.mock.patch.object(output, "close"):
+            with sim.write_vcd(output, traces=[a, s]):
+                sim.run()
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(output.getvalue().split("$enddefinitions $end\n")[1], dedent("""\
+            #0
+            $dumpvars
+            sv1 !
+            b11 "
+            b11 #
+            b0 $
+            $end
+            #10
+            sv2 !
+            b10 "
+            b10 #
+            #20
+            sv1 !
+            b11 "
+            b11 #
+            #30
+            sv2 !
+            b10 "
+            b10 #
+            #40
+            sv1 !
+            b11 "
+            b11 #
+            #60
+        """))
+
+
+class SimulatorIndexedVCDTestCase(FHDLTestCase):
+    def test_blocks(self):
+        m = Module()
+        ctr = Signal(16)
+        m.d.sync += ctr.eq(ctr + 1)
+        sim = Simulator(m)
+        sim.add_clock(Period(MHz=1))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vcd_path = os.path.join(tmpdir, "test.vcd.gz")
+            with unittest.mock.patch("amaranth.sim.pysim._VCDWriter.BLOCK_SIZE", 32):
+                with sim.write_vcd(vcd_path):
+                    sim.run_until(Period(us=100))
+
+            with gzip.open(vcd_path, "rt") as f:
+                text = f.read()
+            self.assertIn("$enddefinitions $end\n#0\n$dumpvars\n", text)
+            self.assertIn("#99500000000\n1!\nb1100100 #\n", text)
+
+            with open(vcd_path, "rb") as f:
+                index = read_index(f)
+                self.assertGreater(len(index), 5)
+                for (timestamp, _), (next_timestamp, _) in zip(index, index[1:]):
+                    self.assertLess(timestamp, next_timestamp)
+
+                block_timestamp, _ = index[3]
+                text = read_vcd(f, start=block_timestamp + 1)
+            self.assertIn("$enddefinitions $end\n", text)
+            self.assertNotIn("$dumpvars", text)
+            self.assertTrue(text.split("$enddefinitions $end\n")[1]
+                                .startswith(f"#{block_timestamp}\n$dumpall\n"))
+            self.assertIn("#99500000000\n1!\nb1100100 #\n", text)
+
+    def test_not_indexed(self):
+        with self.assertRaisesRegex(ValueError, r"^File is not an indexed VCD file$"):
+            read_index(BytesIO(bytes(64)))
+
+    def test_read_vcd_gz(self):
+        m = Module()
+        ctr = Signal(16)
+        m.d.sync += ctr.eq(ctr + 1)
+        sim = Simulator(m)
+        sim.add_clock(Period(MHz=1))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vcd_path = os.path.join(tmpdir, "test.vcd.gz")
+            with unittest.mock.patch("amaranth.sim.pysim._VCDWriter.BLOCK_SIZE", 32):
+                with sim.write_vcd(vcd_path):
+                    sim.run_until(Period(us=100))
+            with gzip.open(vcd_path, "rt") as f:
+                # The index is not a part of the waveforms.
+                self.assertEqual(read_vcd_gz(vcd_path),
+                                 f.read().split("$comment\namaranth-index ")[0])
+            with open(vcd_path, "rb") as f:
+                text = read_vcd_gz(f, start=Period(us=90))
+        self.assertNotIn("$dumpvars", text)
+        self.assertNotIn("#50500000000\n", text)
+        self.assertIn("#90500000000\n", text)
+        with self.assertRaisesRegex(TypeError, r"^Start time must be a Period, not 1$"):
+            read_vcd_gz(BytesIO(), start=1)
+
+
+class SimulatorCaptureVCDTestCase(FHDLTestCase):
+    def setUp(self):
+        self.ctr = Signal(16)
+        self.m = Module()
+        self.m.d.sync += self.ctr.eq(self.ctr + 1)
+
+    def simulate(self, testbench, **kwargs):
+        sim = Simulator(self.m)
+        sim.add_clock(Period(MHz=1))
+        sim.add_testbench(testbench)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vcd_path = os.path.join(tmpdir, "test.vcd")
+            try:
+                with sim.write_vcd(vcd_path, traces=self.ctr, **kwargs):
+                    sim.run()
+            finally:
+                if os.path.exists(vcd_path):
+                    with open(vcd_path) as f:
+                        self.vcd_text = f.read()
+                else:
+                    self.vcd_text = None
+
+    def get_ctr_changes(self):
+        header, body = self.vcd_text.split("$enddefinitions $end\n")
+        ctr_id = re.search(r"\$var wire 16 (\S+) ctr \$end", header)[1]
+        changes = []
+        timestamp = None
+        for line in body.splitlines():
+            if line.startswith("#"):
+                timestamp = int(line[1:])
+            elif line.endswith(f" {ctr_id}"):
+                changes.append((timestamp, int(line[1:].split()[0], 2)))
+        return changes
+
+    def test_trigger(self):
+        async def testbench(ctx):
+            await ctx.delay(Period(us=100))
+        self.simulate(testbench, window=Period(us=10), trigger=self.ctr == 50)
+        changes = self.get_ctr_changes()
+        # The trigger fires at 49.5 us; the value at the start of the window is written at the time
+        # of the last change before the window.
+        self.assertEqual(changes[0], (39_000_000_000, 39))
+        self.assertEqual(changes[1], (39_500_000_000, 40))
+        self.assertEqual([value for _, value in changes], list(range(39, 101)))
+
+    def test_exception(self):
+        async def testbench(ctx):
+            await ctx.delay(Period(us=60))
+            raise ValueError("failed")
+        with self.assertRaisesRegex(ValueError, r"^failed$"):
+            self.simulate(testbench, window=Period(us=5))
+        changes = self.get_ctr_changes()
+        self.assertEqual([value for _, value in changes], list(range(55, 61)))
+
+    def test_not_triggered(self):
+        async def testbench(ctx):
+            await ctx.delay(Period(us=10))
+        self.simulate(testbench, window=Period(us=5), trigger=self.ctr == 50)
+        self.assertIsNone(self.vcd_text)
+
+    def test_wrong(self):
+        sim = Simulator(self.m)
+        with self.assertRaisesRegex(TypeError,
+                r"^Capture window must be a Period, not 1$"):
+            with sim.write_vcd(StringIO(), window=1):
+                pass
+        with self.assertRaisesRegex(ValueError,
+                r"^Capture trigger can only be used together with a capture window$"):
+            with sim.write_vcd(StringIO(), trigger=self.ctr):
+                pass
+
+
+class PySimTimelineTestCase(FHDLTestCase):
+    def test_order(self):
+        timeline = _PyTimeline()
+        calls = []
+        for name, interval in [("a", 3), ("b", 1), ("c", 3), ("d", 2), ("e", 1)]:
+            timeline.set_waker(interval, lambda name=name: calls.append((timeline.now, name)))
+        while timeline.advance():
+            pass
+        self.assertEqual(calls, [(1, "b"), (1, "e"), (2, "d"), (3, "a"), (3, "c")])
+        self.assertEqual(timeline.now, 3)
+        self.assertFalse(timeline.advance())
+
+    def test_reschedule(self):
+        timeline = _PyTimeline()
+        calls = []
+        def waker():
+            calls.append(timeline.now)
+        timeline.set_waker(5, waker)
+        timeline.set_waker(2, waker)
+        while timeline.advance():
+            pass
+        self.assertEqual(calls, [2])
+
+    def test_cancel(self):
+        timeline = _PyTimeline()
+        calls = []
+        def waker_a():
+            calls.append("a")
+        def waker_b():
+            calls.append("b")
+        timeline.set_waker(1, waker_a)
+        timeline.set_waker(1, waker_b)
+        timeline.cancel_waker(waker_a)
+        timeline.cancel_waker(waker_a) # no-op
+        while timeline.advance():
+            pass
+        self.assertEqual(calls, ["b"])
+        self.assertEqual(timeline.wakers, {})
+
+    def test_cancel_many(self):
+        timeline = _PyTimeline()
+        wakers = [lambda: None for _ in range(1000)]
+        for waker in wakers:
+            timeline.set_waker(1, waker)
+        for waker in wakers[1:]:
+            timeline.cancel_waker(waker)
+        self.assertLess(len(timeline.deadlines), 100)
+        self.assertTrue(timeline.advance())
+        self.assertFalse(timeline.advance())
+
+    def test_waker_reschedules_itself(self):
+        timeline = _PyTimeline()
+        calls = []
+        def waker():
+            calls.append(timeline.now)
+            if len(calls) < 3:
+                timeline.set_waker(10, waker)
+        timeline.set_waker(10, waker)
+        while timeline.advance():
+            pass
+        self.assertEqual(calls, [10, 20, 30])
+
+
+class PySimSchedulerTestCase(FHDLTestCase):
+    def test_only_woken_processes_run(self):
+        m = Module()
+        inputs  = [Signal(8, name=f"i{n}") for n in range(8)]
+        outputs = [Signal(8, name=f"o{n}") for n in range(8)]
+        for i, o in zip(inputs, outputs):
+            sub = Module()
+            sub.d.comb += o.eq(i + 1)
+            m.submodules += sub
+
+        sim = Simulator(m)
+        runs = []
+        for process in sim._engine._processes:
+            def wrapper(process=process, run=process.run):
+                runs.append(process)
+                run()
+            process.run = wrapper
+
+        async def testbench(ctx):
+            runs.clear()
+            ctx.set(inputs[3], 10)
+            self.assertEqual(ctx.get(outputs[3]), 11)
+            self.assertEqual(len(runs), 1)
+            self.assertEqual(sim._engine._state.ready, [])
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_reset_reschedules(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8, init=3)
+        m.d.comb += a.eq(b + 1)
+
+        sim = Simulator(m)
+        async def testbench(ctx):
+            self.assertEqual(ctx.get(a), 4)
+            ctx.set(b, 7)
+            self.assertEqual(ctx.get(a), 8)
+        sim.add_testbench(testbench)
+        sim.run()
+        sim.reset()
+        sim.run()
+
+
+class PySimIdleTestCase(FHDLTestCase):
+    def setUp_design(self):
+        m = Module()
+        self.en = Signal()
+        self.count = Signal(16)
+        self.fast_count = Signal(16)
+        with m.If(self.en):
+            m.d.sync += self.count.eq(self.count + 1)
+        m.domains.fast = ClockDomain()
+        m.d.fast += self.fast_count.eq(Mux(self.en, self.fast_count + 1, self.fast_count))
+        return m
+
+    def test_skip(self):
+        sim = Simulator(self.setUp_design())
+        sim.add_clock(Period(MHz=1))
+        sim.add_clock(Period(MHz=4), domain="fast")
+        async def testbench(ctx):
+            ctx.set(self.en, 1)
+            await ctx.tick().repeat(5)
+            ctx.set(self.en, 0)
+            await ctx.delay(Period(ms=10))
+            self.assertEqual(ctx.get(self.count), 5)
+            self.assertEqual(ctx.get(self.fast_count), 18)
+            ctx.set(self.en, 1)
+            await ctx.tick().repeat(2)
+            self.assertEqual(ctx.get(self.count), 7)
+            self.assertEqual(ctx.elapsed_time(), Period(us=10006.5))
+            await ctx.tick("fast")
+            self.assertEqual(ctx.elapsed_time(), Period(us=10006.625))
+        sim.add_testbench(testbench)
+        with sim.profile() as profile:
+            sim.run()
+        self.assertLess(profile.timesteps, 100)
+
+    def test_deadline(self):
+        sim = Simulator(self.setUp_design())
+        sim.add_clock(Period(MHz=1))
+        sim.run_until(Period(us=1000.25))
+        self.assertEqual(sim._engine.now, Period(us=1000.5).femtoseconds)
+
+        sim.reset()
+        async def testbench(ctx):
+            await ctx.delay(Period(us=1000.25))
+            await ctx.tick()
+            self.assertEqual(ctx.elapsed_time(), Period(us=1000.5))
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_no_skip_print(self):
+        m = Module()
+        m.d.sync += Print("tick")
+        sim = Simulator(m)
+        sim.add_clock(Period(MHz=1))
+        output = StringIO()
+        with redirect_stdout(output):
+            sim.run_until(Period(us=100))
+        self.assertEqual(output.getvalue(), "tick\n" * 100)
+
+    def test_no_skip_process(self):
+        sim = Simulator(self.setUp_design())
+        sim.add_clock(Period(MHz=1))
+        ticks = 0
+        async def process(ctx):
+            nonlocal ticks
+            async for _ in ctx.tick():
+                ticks += 1
+        sim.add_process(process)
+        sim.run_until(Period(us=100))
+        self.assertEqual(ticks, 100)
+
+
+class PySimLevelizeTestCase(FHDLTestCase):
+    def setUp_chain(self, length):
+        m = Module()
+        signals = [Signal(8, name=f"s{n}") for n in range(length + 1)]
+        # Add the submodules in reverse order, so that the order of fragments does not happen to
+        # match the order of evaluation.
+        for i, o in reversed(list(zip(signals, signals[1:]))):
+            sub = Module()
+            sub.d.comb += o.eq(i + 1)
+            m.submodules += sub
+        return m, signals
+
+    def count_deltas(self, **kwargs):
+        m, signals = self.setUp_chain(10)
+        sim = Simulator(m, **kwargs)
+        deltas = None
+        async def testbench(ctx):
+            nonlocal deltas
+            self.assertEqual(ctx.get(signals[-1]), 10)
+            start = sim._engine._delta_cycles
+            ctx.set(signals[0], 5)
+            deltas = sim._engine._delta_cycles - start
+            self.assertEqual(ctx.get(signals[-1]), 15)
+        sim.add_testbench(testbench)
+        sim.run()
+        return deltas
+
+    def test_chain(self):
+        self.assertGreaterEqual(self.count_deltas(), 10)
+        self.assertLessEqual(self.count_deltas(levelize=True), 2)
+
+    def test_sync(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        c = Signal(8)
+        m.d.sync += a.eq(a + 1)
+        sub = Module()
+        sub.d.comb += b.eq(a * 2)
+        m.submodules += sub
+        m.d.sync += c.eq(b)
+
+        sim = Simulator(m, levelize=True)
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            for n in range(1, 10):
+                clk_hit, rst, a_value, b_value = await ctx.tick().sample(a, b)
+                self.assertEqual(a_value, n - 1)
+                self.assertEqual(b_value, (n - 1) * 2)
+                self.assertEqual(ctx.get(a), n)
+                self.assertEqual(ctx.get(b), n * 2)
+                self.assertEqual(ctx.get(c), (n - 1) * 2)
+        sim.add_testbench(testbench)
+        with sim.write_vcd("test.vcd"):
+            sim.run()
+
+    def test_comb_cycle(self):
+        m = Module()
+        a = Signal(4)
+        b = Signal(4)
+        x = Signal(4)
+        y = Signal(4)
+        sub1 = Module()
+        sub1.d.comb += x.eq(a)
+        sub1.d.comb += b.eq(y)
+        sub2 = Module()
+        sub2.d.comb += y.eq(x + 1)
+        m.submodules += [sub1, sub2]
+
+        sim = Simulator(m, levelize=True)
+        async def testbench(ctx):
+            ctx.set(a, 5)
+            self.assertEqual(ctx.get(b), 6)
+        sim.add_testbench(testbench)
+        sim.run()
+
+
+class PySimFlattenTestCase(FHDLTestCase):
+    def test_processes(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        c = Signal(8)
+        d = Signal(8)
+        m.domains.fast = ClockDomain()
+        for _ in range(4):
+            sub = Module()
+            sub.d.comb += b.eq(a + 1) if not _ else Signal(8).eq(b)
+            sub.d.sync += c.eq(c + 1) if not _ else Signal(8).eq(c)
+            sub.d.fast += d.eq(d + 1) if not _ else Signal(8).eq(d)
+            m.submodules += sub
+
+        sim = Simulator(m, flatten=True)
+        self.assertEqual(len(sim._engine._processes), 3)
+
+    def test_chain(self):
+        m = Module()
+        signals = [Signal(8, name=f"s{n}") for n in range(11)]
+        for i, o in reversed(list(zip(signals, signals[1:]))):
+            sub = Module()
+            sub.d.comb += o.eq(i + 1)
+            m.submodules += sub
+
+        sim = Simulator(m, flatten=True)
+        async def testbench(ctx):
+            self.assertEqual(ctx.get(signals[-1]), 10)
+            start = sim._engine._delta_cycles
+            ctx.set(signals[0], 5)
+            self.assertLessEqual(sim._engine._delta_cycles - start, 3)
+            self.assertEqual(ctx.get(signals[-1]), 15)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_comb_cycle(self):
+        m = Module()
+        a = Signal(4)
+        b = Signal(4)
+        x = Signal(4)
+        y = Signal(4)
+        sub1 = Module()
+        sub1.d.comb += x.eq(a)
+        sub1.d.comb += b.eq(y)
+        sub2 = Module()
+        sub2.d.comb += y.eq(x + 1)
+        m.submodules += [sub1, sub2]
+
+        sim = Simulator(m, flatten=True)
+        async def testbench(ctx):
+            ctx.set(a, 5)
+            self.assertEqual(ctx.get(b), 6)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_local_domains(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        m.d.sync += a.eq(a + 1)
+        sub = Module()
+        sub.domains.sync = cd_sync = ClockDomain("sync")
+        sub.d.sync += b.eq(b + 1)
+        m.submodules.sub = sub
+
+        sim = Simulator(m, flatten=True)
+        sim.add_clock(Period(MHz=1))
+        with self.assertWarnsRegex(UserWarning, r"distinct from an identically named domain"):
+            sim.add_clock(Period(MHz=3), domain=cd_sync)
+        async def testbench(ctx):
+            await ctx.tick().repeat(4)
+            self.assertEqual(ctx.get(a), 4)
+            self.assertEqual(ctx.get(b), 11)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_memory_print(self):
+        m = Module()
+        m.submodules.memory = memory = Memory(shape=8, depth=4, init=[1, 2, 3, 4])
+        rd = memory.read_port(domain="comb")
+        wr = memory.write_port()
+        o = Signal(8)
+        m.d.comb += o.eq(rd.data + 1)
+        sub = Module()
+        sub.d.comb += Print("o =", o)
+        m.submodules.sub = sub
+
+        sim = Simulator(m, flatten=True)
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            ctx.set(rd.addr, 2)
+            self.assertEqual(ctx.get(o), 4)
+            ctx.set(wr.addr, 2)
+            ctx.set(wr.data, 10)
+            ctx.set(wr.en, 1)
+            await ctx.tick()
+            self.assertEqual(ctx.get(o), 11)
+        sim.add_testbench(testbench)
+        output = StringIO()
+        with redirect_stdout(output):
+            sim.run()
+        self.assertIn("o = 4\n", output.getvalue())
+        self.assertTrue(output.getvalue().endswith("o = 11\n"))
+
+
+class PySimCycleBasedTestCase(FHDLTestCase):
+    def setUp_pipeline(self, length):
+        # Each stage has a register and combinational logic driven from both the register and
+        # the previous stage, and the stages are connected by combinational logic in the parent
+        # module, so the fragments form a combinational cycle while the signals do not.
+        m = Module()
+        count = Signal(8)
+        m.d.sync += count.eq(count + 1)
+        prev = count
+        outputs = []
+        for n in range(length):
+            stage = Module()
+            i = Signal(8, name=f"i{n}")
+            o = Signal(8, name=f"o{n}")
+            r = Signal(8, name=f"r{n}")
+            stage.d.sync += r.eq(i)
+            stage.d.comb += o.eq(r + i)
+            m.submodules[f"stage{n}"] = stage
+            m.d.comb += i.eq(prev)
+            prev = o
+            outputs.append((i, o, r))
+        return m, count, outputs
+
+    def test_pipeline(self):
+        m, count, outputs = self.setUp_pipeline(5)
+        sim = Simulator(m, cycle_based=True)
+        sim.add_clock(Period(MHz=1))
+        deltas = []
+        async def testbench(ctx):
+            prev_values = None
+            for _ in range(10):
+                start = sim._engine._delta_cycles
+                _clk, _rst, *sampled = await ctx.tick().sample(*(r for i, o, r in outputs))
+                deltas.append(sim._engine._delta_cycles - start)
+                if prev_values is not None:
+                    self.assertEqual(sampled, prev_values)
+                for i, o, r in outputs:
+                    self.assertEqual(ctx.get(o), (ctx.get(r) + ctx.get(i)) & 0xff)
+                self.assertEqual(ctx.get(outputs[0][0]), ctx.get(count))
+                prev_values = [ctx.get(r) for i, o, r in outputs]
+        sim.add_testbench(testbench)
+        sim.run()
+        self.assertLessEqual(max(deltas[1:]), 6)
+
+    def test_set_register(self):
+        m, count, outputs = self.setUp_pipeline(2)
+        sim = Simulator(m, cycle_based=True)
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            await ctx.tick().repeat(3)
+            ctx.set(outputs[1][2], 100)
+            self.assertEqual(ctx.get(outputs[1][1]), (100 + ctx.get(outputs[1][0])) & 0xff)
+            ctx.set(count, 0)
+            self.assertEqual(ctx.get(outputs[0][1]), ctx.get(outputs[0][2]))
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_same_delta(self):
+        m = Module()
+        a = Signal(8)
+        r = Signal(8)
+        o = Signal(8)
+        m.d.sync += r.eq(r + 1)
+        m.d.comb += o.eq(r + a)
+
+        sim = Simulator(m, cycle_based=True)
+        sim.add_clock(Period(MHz=1))
+        async def process(ctx):
+            # Change `a` at the same time as the clock edge, so that the combinational logic is
+            # woken up in the same delta cycle as the flip-flops.
+            await ctx.delay(Period(ns=500))
+            for n in range(1, 5):
+                ctx.set(a, n)
+                await ctx.delay(Period(us=1))
+        sim.add_process(process)
+        async def testbench(ctx):
+            for _ in range(5):
+                await ctx.tick()
+                self.assertEqual(ctx.get(o), ctx.get(r) + ctx.get(a))
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_comb_cycle(self):
+        m = Module()
+        a = Signal(4)
+        b = Signal(4)
+        x = Signal(4)
+        y = Signal(4)
+        m.d.comb += [
+            x.eq(a),
+            b.eq(y),
+        ]
+        with m.If(x):
+            m.d.comb += y.eq(x + 1)
+
+        sim = Simulator(m, cycle_based=True)
+        async def testbench(ctx):
+            ctx.set(a, 5)
+            self.assertEqual(ctx.get(b), 6)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_wrong_design(self):
+        m = Module()
+        m.domains.fast = ClockDomain()
+        m.d.sync += Signal().eq(1)
+        m.d.fast += Signal().eq(1)
+        with self.assertRaisesRegex(ValueError,
+                r"^Cycle-based simulation requires a design with at most one clock domain, "
+                r"not 'fast', 'sync'$"):
+            Simulator(m, cycle_based=True)
+
+        m = Module()
+        m.domains.sync = ClockDomain(async_reset=True)
+        m.d.sync += Signal().eq(1)
+        with self.assertRaisesRegex(ValueError,
+                r"^Cycle-based simulation requires a design without asynchronous resets, "
+                r"but domain 'sync' has one$"):
+            Simulator(m, cycle_based=True)
+
+        with self.assertRaisesRegex(ValueError,
+                r"^Cycle-based simulation cannot be combined with lanes$"):
+            Simulator(Module(), cycle_based=True, lanes=2)
+
+
+class PySimCodeCacheTestCase(FHDLTestCase):
+    def setUp_design(self, width):
+        m = Module()
+        a = Signal(width)
+        b = Signal(width)
+        m.d.comb += b.eq(a + 1)
+        m.d.sync += a.eq(b)
+        return m, a, b
+
+    def run_design(self, width, *, expect_compile=True):
+        m, a, b = self.setUp_design(width)
+        if expect_compile:
+            sim = Simulator(m)
+        else:
+            with unittest.mock.patch("amaranth.sim._pyrtl.compile", create=True) as compile:
+                sim = Simulator(m)
+                compile.assert_not_called()
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            await ctx.tick().repeat(3)
+            self.assertEqual(ctx.get(a), 3)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_hit(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_pysim_cache": cache_dir}):
+                self.run_design(8)
+                entries = os.listdir(cache_dir)
+                self.assertEqual(len(entries), 1)
+                self.assertTrue(entries[0].endswith(".pysim"))
+                # Testbench expressions are compiled separately (and are not cached); only check
+                # that the design itself is loaded from the cache.
+                self.run_design(8, expect_compile=False)
+                self.assertEqual(os.listdir(cache_dir), entries)
+
+    def test_corrupted(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_pysim_cache": cache_dir}):
+                self.run_design(8)
+                entry, = os.listdir(cache_dir)
+                with open(os.path.join(cache_dir, entry), "wb") as file:
+                    file.write(b"\xff")
+                self.run_design(8)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_pysim_cache": cache_dir,
+                                                       "AMARANTH_pysim_cache_size": "1"}):
+                self.run_design(8)
+                entry_8, = os.listdir(cache_dir)
+                self.run_design(9)
+                entry_9, = os.listdir(cache_dir)
+                self.assertNotEqual(entry_8, entry_9)
+
+    @unittest.skipUnless(os.name == "posix", "POSIX permissions are required")
+    def test_private(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_pysim_cache": cache_dir}):
+                self.run_design(8)
+                path, = (os.path.join(cache_dir, entry) for entry in os.listdir(cache_dir))
+                self.assertEqual(os.stat(path).st_mode & 0o022, 0)
+                # An entry writable by other users is replaced instead of being loaded.
+                os.chmod(path, 0o666)
+                self.run_design(8)
+                self.assertEqual(os.stat(path).st_mode & 0o022, 0)
+                # A cache directory writable by other users is not used at all.
+                os.chmod(cache_dir, 0o777)
+                os.remove(path)
+                self.run_design(8)
+                self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_disabled(self):
+        with unittest.mock.patch.dict(os.environ, {"AMARANTH_pysim_cache": ""}):
+            with unittest.mock.patch("amaranth.sim._pyrtl._compile_cached") as compile_cached:
+                self.run_design(8)
+                compile_cached.assert_not_called()
+
+
+class PySimCompiledAccessTestCase(FHDLTestCase):
+    def test_get_set(self):
+        layout = data.StructLayout({"a": 4, "b": signed(4), "c": 8})
+        s = Signal(layout)
+        arr = Array([Signal(4, name=f"arr{i}") for i in range(4)])
+        idx = Signal(2)
+        mem = MemoryData(shape=signed(8), depth=4, init=[1, -2, 3, -4])
+        m = Module()
+        m.submodules.mem = Memory(data=mem)
+        sim = Simulator(m)
+        async def testbench(ctx):
+            # Each access is done several times to exercise both the interpreted and the compiled
+            # paths.
+            for n in range(3):
+                ctx.set(s, {"a": n + 1, "b": -n - 1, "c": 0x80 + n})
+                self.assertEqual(ctx.get(s.a), n + 1)
+                self.assertEqual(ctx.get(s.b), -n - 1)
+                self.assertEqual(ctx.get(s.as_value()), (0x80 + n) << 8 | ((-n - 1) & 0xf) << 4 | n + 1)
+                ctx.set(s.c[2:6], 0xf)
+                self.assertEqual(ctx.get(s.c), 0x80 + n | 0x3c)
+                ctx.set(idx, n)
+                ctx.set(arr[idx], 10 + n)
+                self.assertEqual(ctx.get(arr[n]), 10 + n)
+                self.assertEqual(ctx.get(arr[idx]), 10 + n)
+                self.assertEqual(ctx.get(mem[n]), [1, -2, 3, -4][n])
+                ctx.set(mem[3][0:4], n)
+                self.assertEqual(ctx.get(mem[3]), -16 | n)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_driver_conflict(self):
+        a = Signal(4)
+        b = Signal(4)
+        m = Module()
+        m.d.comb += b.eq(a)
+        sim = Simulator(m)
+        async def testbench(ctx):
+            for _ in range(3):
+                with self.assertRaisesRegex(DriverConflict,
+                        r"^Combinationally driven signals cannot be overriden by testbenches$"):
+                    ctx.set(b, 1)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_not_compiled(self):
+        sim = Simulator(Module())
+        async def testbench(ctx):
+            for _ in range(3):
+                with self.assertRaisesRegex(ValueError,
+                        r"^Value \(clk sync\) cannot be used in simulation$"):
+                    ctx.get(ClockSignal() + 1)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_sample(self):
+        class Kind(enum.Enum, shape=2):
+            A = 0
+            B = 1
+            C = 2
+            D = 3
+        layout = data.StructLayout({"kind": Kind, "value": 6})
+        s = Signal(layout)
+        k = Signal(Kind)
+        a = Signal(8)
+        expr = a * 2
+        m = Module()
+        m.d.sync += a.eq(a + 1)
+        m.d.comb += [
+            s.value.eq(a),
+            s.kind.eq(a[0:2]),
+            k.eq(a[1:3]),
+        ]
+        sim = Simulator(m)
+        sim.add_clock(Period(MHz=1))
+        from amaranth.sim.pysim import compile_sampler
+        compiles = []
+        def counting_compile_sampler(state, values, decoders):
+            compiles.append(values)
+            return compile_sampler(state, values, decoders)
+        async def testbench(ctx):
+            with unittest.mock.patch("amaranth.sim.pysim.compile_sampler",
+                                     counting_compile_sampler):
+                # One-shot waits are compiled on the second use of the same values, and multi-shot
+                # waits on the second activation.
+                for n in range(5):
+                    clk, rst, s_value, k_value, a_value, expr_value = \
+                        await ctx.tick().sample(s, k, a, expr)
+                    self.assertEqual((clk, rst), (True, False))
+                    self.assertEqual(s_value.value, n)
+                    self.assertEqual(s_value.kind, Kind(n & 3))
+                    self.assertEqual(k_value, Kind((n >> 1) & 3))
+                    self.assertEqual(a_value, n)
+                    self.assertEqual(expr_value, n * 2)
+                    if n >= 2:
+                        # Decoded values that depend only on the bits are memoized.
+                        self.assertIs(s_value, next_s_value)
+                    _delay, next_s_value = await ctx.delay(Period(ns=10)).sample(s)
+                n = 6
+                async for a_value, expr_value, edge in ctx.changed(a).sample(expr).posedge(a[0]):
+                    self.assertEqual(a_value, n)
+                    self.assertEqual(expr_value, n * 2)
+                    self.assertEqual(edge, n % 2 == 1)
+                    n += 1
+                    if n == 10:
+                        break
+        sim.add_testbench(testbench)
+        sim.run()
+        self.assertEqual(len(compiles), 3)
+
+    def test_compiled_once(self):
+        a = Signal(8)
+        expr = a + 1
+        sim = Simulator(Module())
+        from amaranth.sim.pysim import compile_getter
+        compiles = []
+        def counting_compile_getter(state, value):
+            compiles.append(value)
+            return compile_getter(state, value)
+        async def testbench(ctx):
+            with unittest.mock.patch("amaranth.sim.pysim.compile_getter", counting_compile_getter):
+                for n in range(5):
+                    ctx.set(a, n)
+                    self.assertEqual(ctx.get(expr), n + 1)
+        sim.add_testbench(testbench)
+        sim.run()
+        self.assertEqual(len(compiles), 1)
+
+
+class PySimEngineStateTestCase(FHDLTestCase):
+    def test_update_commit(self):
+        from amaranth.sim.pysim import _PyEngineState
+        a = Signal(8, init=1)
+        b = Signal(8)
+        state = _PyEngineState()
+        a_index, b_index = state.get_signal(a), state.get_signal(b)
+        self.assertEqual(state.curr, [1, 0])
+        self.assertEqual(state.next, [1, 0])
+        changes = []
+        state.add_signal_waker(a, lambda curr, next: changes.append((curr, next)) or True)
+        state.slots[a_index].update(5)
+        state.slots[a_index].update(0x30, 0xf0)
+        self.assertEqual(state.next[a_index], 0x35)
+        self.assertEqual(state.pending, [a_index])
+        self.assertFalse(state.commit())
+        self.assertEqual(state.curr[a_index], 0x35)
+        self.assertEqual(changes, [(1, 0x35)])
+        self.assertEqual(state.pending, [])
+        self.assertEqual(state.dirty, bytearray(2))
+        # An update that is undone before it is committed does not change anything.
+        state.slots[b_index].update(1)
+        state.slots[b_index].update(0)
+        self.assertEqual(state.pending, [b_index])
+        self.assertTrue(state.commit())
+
+    def test_edge_wakers(self):
+        from amaranth.sim.pysim import _PyEngineState
+        from amaranth.sim._pyrtl import PyRTLProcess
+        a = Signal(2)
+        state = _PyEngineState()
+        rising = [PyRTLProcess(is_comb=False) for _ in range(3)]
+        falling = PyRTLProcess(is_comb=False)
+        for process in rising:
+            state.add_edge_waker(a, 1, 1, process=process)
+        state.add_edge_waker(a, 1, 0, process=falling)
+        edges = []
+        state.add_edge_waker(a, 0, 1, waker=lambda: edges.append("once") and False)
+        state.add_edge_waker(a, 0, 1, waker=lambda: edges.append("always") or True)
+        signal_state = state.slots[state.get_signal(a)]
+        # Every edge of the signal is handled by one waker.
+        self.assertEqual(signal_state.wakers, [signal_state.edge_wakers])
+
+        signal_state.update(0b01)
+        state.commit()
+        self.assertEqual(state.ready, [])
+        self.assertEqual(edges, ["once", "always"])
+        signal_state.update(0b10)
+        state.commit()
+        self.assertEqual(state.ready, rising)
+        self.assertTrue(all(process.runnable for process in rising))
+        signal_state.update(0b11)
+        state.commit()
+        self.assertEqual(state.ready, rising)
+        self.assertEqual(edges, ["once", "always", "always"])
+        signal_state.update(0b00)
+        state.commit()
+        self.assertEqual(state.ready, [*rising, falling])
+
+    def test_compiled_setter(self):
+        from amaranth.sim.pysim import _PyEngineState
+        from amaranth.sim._pyrtl import compile_setter
+        a = Signal(8, init=0x12)
+        state = _PyEngineState()
+        compile_setter(state, a[4:8])(0xf)
+        self.assertEqual(state.next[state.get_signal(a)], 0xf2)
+        self.assertEqual(state.pending, [state.get_signal(a)])
+        compile_setter(state, a)(0x34)
+        self.assertEqual(state.pending, [state.get_signal(a)])
+        self.assertFalse(state.commit())
+        self.assertEqual(state.curr[state.get_signal(a)], 0x34)
+
+    def test_snapshot(self):
+        from amaranth.sim.pysim import _PyEngineState
+        a = Signal(8)
+        b = Signal(8, init=3)
+        state = _PyEngineState()
+        a_index = state.get_signal(a)
+        state.slots[a_index].update(1)
+        snapshot = state.snapshot()
+        self.assertFalse(state.commit())
+        b_index = state.get_signal(b)
+        state.slots[b_index].update(4)
+        state.restore(snapshot)
+        self.assertEqual(state.curr, [0, 3])
+        self.assertEqual(state.next, [1, 3])
+        self.assertEqual(state.pending, [a_index])
+        self.assertEqual(state.dirty, bytearray([1, 0]))
+
+
+class PySimCodegenTestCase(FHDLTestCase):
+    def compile(self, stmts):
+        from amaranth.sim.pysim import _PyEngineState
+        from amaranth.sim._pyrtl import _StatementCompiler
+        from amaranth.hdl._ast import _StatementList
+        self.state = _PyEngineState()
+        return _StatementCompiler.compile(self.state, _StatementList(stmts))
+
+    def index(self, signal):
+        return self.state.get_signal(signal)
+
+    def test_redundant_masks(self):
+        a = Signal(8)
+        b = Signal(8)
+        y = Signal(9)
+        z = Signal(signed(10))
+        code = self.compile([y.eq(a + b), z.eq(-a[4:])])
+        a, b, y, z = map(self.index, (a, b, y, z))
+        self.assertIn(f"next_{y} = (curr[{a}] + curr[{b}])\n", code)
+        self.assertIn(f"next_{z} = (-(curr[{a}] >> 4))\n", code)
+
+    def test_const_fold(self):
+        a = Signal(8)
+        b = Signal(8)
+        y = Signal(8)
+        code = self.compile([
+            y.eq(Mux(Const(1), a, b) + (Const(3) * Const(4))),
+        ])
+        a, y = map(self.index, (a, y))
+        self.assertIn(f"next_{y} = 0xff & (curr[{a}] + 12)\n", code)
+        self.assertNotIn("test", code)
+
+    def test_const_switch(self):
+        a = Signal(8)
+        y = Signal(8)
+        code = self.compile([
+            Switch(Const(2, 2), [
+                ((1,), [y.eq(a)], None),
+                ((2,), [y.eq(1)], None),
+            ]),
+        ])
+        self.assertIn(f"next_{self.index(y)} = 1\n", code)
+        self.assertNotIn("curr", code)
+
+    def test_common(self):
+        a = Signal(8)
+        b = Signal(8)
+        y = Signal(8)
+        z = Signal(8)
+        # Copies of the same expression are evaluated once.
+        code = self.compile([
+            y.eq((a ^ b) + 1),
+            Switch(a[0], [((1,), [z.eq((a ^ b) - 1)], None)]),
+        ])
+        a, b = map(self.index, (a, b))
+        self.assertEqual(code.count(f"(curr[{a}] ^ curr[{b}])"), 1)
+        self.assertEqual(code.count("common_0"), 3)
+
+
+class PySimPruneTestCase(FHDLTestCase):
+    def setUp_design(self):
+        self.out   = Signal(8)
+        self.live  = Signal(8)
+        self.dead  = Signal(8)
+        self.debug = Signal(8)
+        self.addr  = Signal(2)
+        sub = Module()
+        sub.d.sync += [
+            self.live.eq(self.live + 1),
+            self.dead.eq(self.dead + 3),
+            self.debug.eq(self.debug + 2),
+            self.addr.eq(self.addr + 1),
+        ]
+        sub.d.sync += Print("debug", self.debug)
+        sub.submodules.mem = self.mem = Memory(shape=8, depth=4, init=[])
+        wr_port = self.mem.write_port()
+        sub.d.comb += [
+            wr_port.addr.eq(self.addr),
+            wr_port.data.eq(self.live),
+            wr_port.en.eq(1),
+        ]
+        m = Module()
+        m.submodules.sub = sub
+        m.d.comb += self.out.eq(self.live)
+        return m
+
+    def test_prune(self):
+        sim = Simulator(self.setUp_design(), prune=True)
+        self.assertEqual(list(sim._engine._pruned), [self.dead])
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            await ctx.tick().repeat(5)
+            self.assertEqual(ctx.get(self.out), 5)
+            self.assertEqual(ctx.get(self.debug), 10)
+            self.assertEqual(ctx.get(self.mem.data[0]), 4)
+            self.assertEqual(ctx.get(self.mem.data[1] + 1), 2)
+        sim.add_testbench(testbench)
+        output = StringIO()
+        with redirect_stdout(output):
+            sim.run()
+        self.assertEqual(output.getvalue(), "".join(f"debug {n}\n" for n in range(0, 10, 2)))
+
+    def test_keep(self):
+        sim = Simulator(self.setUp_design(), prune=True, keep=[self.dead])
+        self.assertEqual(list(sim._engine._pruned), [])
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            await ctx.tick().repeat(5)
+            self.assertEqual(ctx.get(self.dead), 15)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_keep_wrong(self):
+        with self.assertRaisesRegex(ValueError,
+                r"^Signals to keep can only be specified when pruning the design$"):
+            Simulator(self.setUp_design(), keep=[self.dead])
+
+    def test_access_pruned(self):
+        sim = Simulator(self.setUp_design(), prune=True)
+        async def testbench(ctx):
+            with self.assertRaisesRegex(ValueError,
+                    r"^Signal \(sig dead\) is not simulated, since it does not affect any "
+                    r"observed signal; add it to `keep` to observe it$"):
+                ctx.get(self.dead + 1)
+            with self.assertRaisesRegex(ValueError,
+                    r"^Signal \(sig dead\) is not simulated"):
+                ctx.set(self.dead, 1)
+            with self.assertRaisesRegex(ValueError,
+                    r"^Signal \(sig dead\) is not simulated"):
+                await ctx.changed(self.dead)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_trace_pruned(self):
+        sim = Simulator(self.setUp_design(), prune=True)
+        with self.assertRaisesRegex(ValueError,
+                r"^Signal \(sig dead\) is not simulated, since it does not affect any "
+                r"observed signal; add it to `keep` to trace it$"):
+            with sim.write_vcd(StringIO(), traces=[self.dead]):
+                pass
+        sim.add_clock(Period(MHz=1))
+        vcd_file = StringIO()
+        with sim.write_vcd(vcd_file):
+            sim.run_until(Period(us=3))
+        self.assertIn(" live ", vcd_file.getvalue())
+        self.assertNotIn(" dead ", vcd_file.getvalue())
+
+
+@unittest.skipUnless(numpy, "NumPy is not installed")
+class PySimMemoryStorageTestCase(FHDLTestCase):
+    def test_dense(self):
+        storage = memory_storage(MemoryData(shape=8, depth=4, init=[1, 2, 3, 4]))
+        self.assertIsInstance(storage, array)
+        self.assertEqual(storage.typecode, "B")
+        self.assertEqual(list(storage), [1, 2, 3, 4])
+        storage = memory_storage(MemoryData(shape=signed(12), depth=2, init=[-1, 5]))
+        self.assertEqual(storage.typecode, "h")
+        self.assertEqual(list(storage), [-1, 5])
+
+    def test_wide(self):
+        storage = memory_storage(MemoryData(shape=100, depth=2, init=[1 << 99]))
+        self.assertIsInstance(storage, list)
+        self.assertEqual(storage, [1 << 99, 0])
+
+    def test_sparse(self):
+        depth = SPARSE_DEPTH * 2
+        storage = memory_storage(MemoryData(shape=32, depth=depth, init=[1, 2]))
+        self.assertIsInstance(storage, SparseStorage)
+        self.assertEqual(len(storage), depth)
+        self.assertEqual((storage[0], storage[1], storage[depth - 1]), (1, 2, 0))
+        self.assertEqual(len(storage.init), depth // 4096)
+        self.assertEqual(list(storage.pages), [0])
+        storage[depth - 1] = 3
+        self.assertEqual(storage[depth - 1], 3)
+        self.assertEqual(list(storage.pages), [0, depth // 4096 - 1])
+
+    def test_copy_on_write(self):
+        m = Module()
+        m.submodules.mem = mem = Memory(shape=8, depth=4, init=[1, 2, 3, 4])
+        sim = Simulator(m)
+        async def testbench(ctx):
+            ctx.set(mem.data[0], ctx.get(mem.data[0]) + 10)
+        sim.add_testbench(testbench)
+        memory_state = sim._engine.state.slots[sim._engine.state.get_memory(mem.data)]
+        self.assertIs(memory_state.data, memory_state.init)
+        snapshot = sim.snapshot()
+        sim.run()
+        self.assertIsNot(memory_state.data, memory_state.init)
+        self.assertEqual(list(memory_state.data), [11, 2, 3, 4])
+        self.assertEqual(list(memory_state.init), [1, 2, 3, 4])
+        sim.restore(snapshot)
+        self.assertIs(memory_state.data, memory_state.init)
+        sim.run()
+        self.assertEqual(list(memory_state.data), [11, 2, 3, 4])
+        self.assertEqual(list(memory_state.init), [1, 2, 3, 4])
+        sim.reset()
+        self.assertIs(memory_state.data, memory_state.init)
+        sim.run()
+        self.assertEqual(list(memory_state.data), [11, 2, 3, 4])
+        self.assertEqual(list(memory_state.init), [1, 2, 3, 4])
+
+    def test_sparse_copy(self):
+        storage = memory_storage(MemoryData(shape=32, depth=SPARSE_DEPTH, init=[1, 2]))
+        storage[0] = 10
+        other = copy.copy(storage)
+        storage[1] = 20
+        other[0] = 30
+        self.assertEqual((storage[0], storage[1]), (10, 20))
+        self.assertEqual((other[0], other[1]), (30, 2))
+
+    def test_sparse_simulation(self):
+        m = Module()
+        m.submodules.mem = mem = Memory(shape=16, depth=SPARSE_DEPTH * 4, init=[1, 2, 3])
+        wp = mem.write_port()
+        rp = mem.read_port(domain="comb")
+        sim = Simulator(m)
+        sim.add_clock(Period(MHz=1))
+        results = []
+        async def testbench(ctx):
+            ctx.set(rp.addr, 2)
+            results.append(ctx.get(rp.data))
+            ctx.set(wp.addr, 2)
+            ctx.set(wp.data, 0x1234)
+            ctx.set(wp.en, 1)
+            await ctx.tick()
+            results.append(ctx.get(rp.data))
+            ctx.set(mem.data[SPARSE_DEPTH * 4 - 1], 0x5678)
+            results.append(ctx.get(mem.data[SPARSE_DEPTH * 4 - 1]))
+        sim.add_testbench(testbench)
+        sim.run()
+        sim.reset()
+        sim.run()
+        self.assertEqual(results, [3, 0x1234, 0x5678] * 2)
+
+
+class SimulatorMemoryLoadTestCase(FHDLTestCase):
+    def setUp_memory(self, shape=8, depth=8):
+        self.m = Module()
+        self.m.submodules.mem = self.mem = Memory(shape=shape, depth=depth, init=[])
+        self.rp = self.mem.read_port(domain="comb")
+
+    def run_testbench(self, testbench, **kwargs):
+        sim = Simulator(self.m)
+        sim.add_testbench(testbench)
+        if kwargs:
+            with sim.write_vcd(**kwargs):
+                sim.run()
+        else:
+            sim.run()
+
+    def test_bytes(self):
+        self.setUp_memory(shape=16)
+        async def testbench(ctx):
+            ctx.memory_load(self.mem, b"\x01\x02\x03\x04", offset=2)
+            self.assertEqual(ctx.memory_dump(self.mem), [0, 0, 0x0201, 0x0403, 0, 0, 0, 0])
+            ctx.memory_load(self.mem.data, memoryview(bytearray(b"\xff\xff")))
+            self.assertEqual(ctx.memory_dump(self.mem, 0, 3), [0xffff, 0, 0x0201])
+        self.run_testbench(testbench)
+
+    def test_bytes_odd_width(self):
+        self.setUp_memory(shape=signed(12))
+        async def testbench(ctx):
+            ctx.memory_load(self.mem, b"\xff\x0f\x34\x12")
+            self.assertEqual(ctx.memory_dump(self.mem, count=2), [-1, 0x234])
+        self.run_testbench(testbench)
+
+    def test_integers(self):
+        self.setUp_memory(shape=8)
+        async def testbench(ctx):
+            ctx.memory_load(self.mem, [1, 2, 0x103])
+            ctx.memory_load(self.mem, array("H", [4, 5]), offset=3)
+            ctx.memory_load(self.mem, array("B", [6, 7]), offset=5)
+            self.assertEqual(ctx.memory_dump(self.mem), [1, 2, 3, 4, 5, 6, 7, 0])
+        self.run_testbench(testbench)
+
+    @unittest.skipUnless(numpy, "NumPy is not installed")
+    def test_numpy(self):
+        self.setUp_memory(shape=32)
+        async def testbench(ctx):
+            ctx.memory_load(self.mem, numpy.arange(8, dtype=numpy.uint32) * 3)
+            ctx.memory_load(self.mem, numpy.array([-1], dtype=numpy.int64), offset=7)
+            self.assertEqual(ctx.memory_dump(self.mem), [0, 3, 6, 9, 12, 15, 18, 0xffffffff])
+        self.run_testbench(testbench)
+
+    def test_sparse(self):
+        self.setUp_memory(shape=32, depth=SPARSE_DEPTH * 2)
+        async def testbench(ctx):
+            rows = list(range(1, 10001))
+            ctx.memory_load(self.mem, rows, offset=SPARSE_DEPTH - 5000)
+            self.assertEqual(ctx.memory_dump(self.mem, SPARSE_DEPTH - 5001, 10002),
+                             [0, *rows, 0])
+            ctx.set(self.rp.addr, SPARSE_DEPTH)
+            self.assertEqual(ctx.get(self.rp.data), 5001)
+        self.run_testbench(testbench)
+
+    def test_wakeup(self):
+        self.setUp_memory()
+        async def testbench(ctx):
+            ctx.set(self.rp.addr, 1)
+            self.assertEqual(ctx.get(self.rp.data), 0)
+            ctx.memory_load(self.mem, b"\x11\x22")
+            self.assertEqual(ctx.get(self.rp.data), 0x22)
+        self.run_testbench(testbench)
+
+    def test_vcd(self):
+        self.setUp_memory()
+        async def testbench(ctx):
+            await ctx.delay(Period(us=1))
+            ctx.memory_load(self.mem, b"\x11\x22", offset=6)
+        vcd_file = StringIO()
+        self.run_testbench(testbench, vcd_file=vcd_file, traces=[self.mem.data])
+        vcd = vcd_file.getvalue()
+        self.assertIn("#1000000000\nb10001 )\nb100010 *\n", vcd)
+
+    def test_process(self):
+        self.setUp_memory()
+        sim = Simulator(self.m)
+        async def process(ctx):
+            with self.assertRaisesRegex(TypeError,
+                    r"^`\.memory_load\(\)` cannot be used in simulator processes$"):
+                ctx.memory_load(self.mem, b"")
+            with self.assertRaisesRegex(TypeError,
+                    r"^`\.memory_dump\(\)` cannot be used in simulator processes$"):
+                ctx.memory_dump(self.mem)
+        sim.add_process(process)
+        sim.run()
+
+    def test_wrong(self):
+        self.setUp_memory(shape=16)
+        async def testbench(ctx):
+            with self.assertRaisesRegex(TypeError,
+                    r"^Memory must be a MemoryData or a Memory, not \(sig rp__addr\)$"):
+                ctx.memory_load(self.rp.addr, b"")
+            with self.assertRaisesRegex(ValueError,
+                    r"^Offset 9 is out of range for a memory with depth 8$"):
+                ctx.memory_load(self.mem, b"", offset=9)
+            with self.assertRaisesRegex(ValueError,
+                    r"^Cannot load 3 rows at offset 6 into a memory with depth 8$"):
+                ctx.memory_load(self.mem, [1, 2, 3], offset=6)
+            with self.assertRaisesRegex(ValueError,
+                    r"^Buffer length 3 is not a multiple of the row size \(2 bytes\)$"):
+                ctx.memory_load(self.mem, b"abc")
+            with self.assertRaisesRegex(ValueError,
+                    r"^Cannot dump 3 rows at offset 6 from a memory with depth 8$"):
+                ctx.memory_dump(self.mem, 6, 3)
+        self.run_testbench(testbench)
+
+
+class PySimLanesTestCase(FHDLTestCase):
+    def setUp_design(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(signed(6))
+        sel = Signal(3)
+        o = Signal(signed(12))
+        p = Signal(4)
+        q = Signal(16)
+        r = Signal(8, init=5)
+        arr = Array(Signal(4, name=f"x{i}", init=i) for i in range(5))
+        with m.Switch(sel):
+            with m.Case(0):
+                m.d.comb += o.eq(a * b)
+            with m.Case(1, 2):
+                m.d.comb += o.eq(a // b)
+            with m.Case("1-1"):
+                m.d.comb += o.eq(a % b)
+            with m.Default():
+                m.d.comb += o.eq(-b)
+        m.d.comb += p.eq(Cat(a.xor(), a.any(), a.all(), a.bool()))
+        m.d.comb += q.eq(a.bit_select(sel, 5) | (a << sel) | (b >> sel).as_unsigned() << 8)
+        m.d.comb += arr[sel].eq(a)
+        with m.If(a[0]):
+            m.d.sync += r.eq(r + arr[sel ^ 1] + (a < b) + (a >= b) + (a == 3) + (b != 2))
+            with m.If(a[1]):
+                m.d.sync += r[2:5].eq(a)
+        with m.Elif(a[1]):
+            m.d.sync += Cat(r[0:3], r[3:8]).eq(b)
+        m.submodules.mem = mem = Memory(shape=8, depth=4, init=[1, 254, 3, 4])
+        wp = mem.write_port(granularity=4)
+        rp = mem.read_port(transparent_for=[wp])
+        m.d.comb += [
+            wp.addr.eq(sel),
+            wp.data.eq(a),
+            wp.en.eq(a[2:4]),
+            rp.addr.eq(sel + 1),
+            rp.en.eq(a[4]),
+        ]
+        return m, (a, b, sel), (o, p, q, r, rp.data, *arr)
+
+    def test_lockstep(self):
+        lanes = 8
+        rng = numpy.random.default_rng(0)
+        stimulus = [(rng.integers(0, 256, lanes), rng.integers(-32, 32, lanes),
+                     rng.integers(0, 8, lanes)) for _ in range(20)]
+
+        def run(lane):
+            m, inputs, outputs = self.setUp_design()
+            if lane is None:
+                sim = Simulator(m, lanes=lanes)
+            else:
+                sim = Simulator(m)
+            sim.add_clock(Period(MHz=1))
+            trace = []
+            async def testbench(ctx):
+                for values in stimulus:
+                    for signal, value in zip(inputs, values):
+                        ctx.set(signal, value if lane is None else int(value[lane]))
+                    trace.append([ctx.get(signal) for signal in outputs])
+                    await ctx.tick()
+                    trace.append([ctx.get(signal) for signal in outputs])
+            sim.add_testbench(testbench)
+            sim.run()
+            return trace
+
+        lanes_trace = run(None)
+        for lane in range(lanes):
+            lane_trace = [[int(value[lane]) for value in values] for values in lanes_trace]
+            self.assertEqual(lane_trace, run(lane))
+
+    def test_get_set(self):
+        layout = data.StructLayout({"a": 4, "b": signed(4)})
+        s = Signal(layout)
+        t = Signal(8)
+        m = Module()
+        m.d.comb += t.eq(s.a + s.b)
+        sim = Simulator(m, lanes=3)
+        async def testbench(ctx):
+            ctx.set(s.a, 1)
+            ctx.set(s.b, numpy.array([1, -1, -2]))
+            self.assertEqual(ctx.get(t).tolist(), [2, 0, 0xff])
+            ctx.set(s, numpy.array([{"a": 3, "b": 0}, {"a": 2, "b": 1}, {"a": 1, "b": 2}]))
+            self.assertEqual(ctx.get(t).tolist(), [3, 3, 3])
+            self.assertEqual([value.a for value in ctx.get(s)], [3, 2, 1])
+            with self.assertRaisesRegex(ValueError,
+                    r"^Expected a value or an array of 3 values, not an array of shape \(2,\)$"):
+                ctx.set(t, numpy.array([1, 2]))
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_assert(self):
+        a = Signal(4)
+        m = Module()
+        m.d.comb += Assert(a != 2, Format("a is {}", a))
+        sim = Simulator(m, lanes=4)
+        async def testbench(ctx):
+            ctx.set(a, numpy.array([0, 1, 3, 1]))
+            with self.assertRaisesRegex(AssertionError,
+                    r"^Assertion violated in lane 1: a is 2$"):
+                ctx.set(a, numpy.array([0, 2, 3, 2]))
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_print(self):
+        a = Signal(4)
+        m = Module()
+        with m.If(a[0]):
+            m.d.comb += Print("a =", a)
+        sim = Simulator(m, lanes=4)
+        async def testbench(ctx):
+            ctx.set(a, numpy.array([1, 2, 3, 4]))
+        sim.add_testbench(testbench)
+        output = StringIO()
+        with redirect_stdout(output):
+            sim.run()
+        self.assertEqual(output.getvalue(), "a = 1\na = 3\n")
+
+    def test_clock_uniform(self):
+        m = Module()
+        m.domains.sync = sync = ClockDomain()
+        a = Signal()
+        m.d.sync += a.eq(~a)
+        sim = Simulator(m, lanes=2)
+        async def testbench(ctx):
+            ctx.set(sync.clk, numpy.array([0, 1]))
+        sim.add_testbench(testbench)
+        with self.assertRaisesRegex(ValueError,
+                r"^Signal \(sig clk\) is used as a clock or in an edge trigger, and must have "
+                r"the same value in every lane$"):
+            sim.run()
+
+    def test_wide(self):
+        a = Signal(64)
+        m = Module()
+        m.d.sync += a.eq(a + 1)
+        with self.assertRaisesRegex(OverflowError,
+                r"^Signal \(sig a\) is 64 bits wide, which is more than the 63 bits supported "
+                r"when simulating with lanes$"):
+            Simulator(m, lanes=2)
+
+    def test_wrong_lanes(self):
+        with self.assertRaisesRegex(TypeError,
+                r"^Number of lanes must be a positive integer, not 0$"):
+            Simulator(Module(), lanes=0)
+
+    def test_vcd(self):
+        sim = Simulator(Module(), lanes=2)
+        with self.assertRaisesRegex(ValueError,
+                r"^Waveforms cannot be written when simulating with lanes$"):
+            with sim.write_vcd(StringIO()):
+                pass
+
+
+class SimulatorSnapshotTestCase(FHDLTestCase):
+    def setUp_design(self):
+        self.count = Signal(8)
+        self.m = Module()
+        self.m.d.sync += self.count.eq(self.count + 1)
+        self.m.submodules.mem = self.mem = Memory(shape=8, depth=4, init=[1, 2, 3, 4])
+        self.wp = self.mem.write_port()
+        self.rp = self.mem.read_port(domain="comb")
+
+    def test_restore(self):
+        self.setUp_design()
+        sim = Simulator(self.m)
+        sim.add_clock(Period(MHz=1))
+        boots = []
+        async def boot(ctx):
+            boots.append(ctx.get(self.count))
+            await ctx.tick().repeat(10)
+            ctx.set(self.wp.addr, 2)
+            ctx.set(self.wp.data, 33)
+            ctx.set(self.wp.en, 1)
+            await ctx.tick()
+            ctx.set(self.wp.en, 0)
+        sim.add_testbench(boot)
+        sim.run()
+        booted = sim.snapshot()
+
+        results = []
+        async def scenario(ctx):
+            ctx.set(self.rp.addr, 2)
+            results.append((ctx.get(self.count), ctx.get(self.rp.data)))
+            ctx.set(self.wp.addr, 2)
+            ctx.set(self.wp.data, 44)
+            ctx.set(self.wp.en, 1)
+            await ctx.tick().repeat(5)
+            results.append((ctx.get(self.count), ctx.get(self.rp.data)))
+        for _ in range(2):
+            sim.restore(booted)
+            sim.add_testbench(scenario)
+            sim.run()
+        self.assertEqual(boots, [0])
+        self.assertEqual(results, [(11, 33), (16, 44), (11, 33), (16, 44)])
+
+    def test_restart(self):
+        self.setUp_design()
+        sim = Simulator(self.m)
+        sim.add_clock(Period(MHz=1))
+        starts = []
+        async def process(ctx):
+            started = False
+            async for _clk, _rst, count in ctx.tick().sample(self.count):
+                if not started:
+                    starts.append(count)
+                    started = True
+        sim.add_process(process)
+        async def testbench(ctx):
+            await ctx.tick().repeat(3)
+        sim.add_testbench(testbench)
+        sim.run()
+        snapshot = sim.snapshot()
+        sim.restore(snapshot)
+        sim.add_testbench(testbench)
+        sim.run()
+        self.assertEqual(starts, [0, 3])
+
+    def test_clock_removed(self):
+        self.setUp_design()
+        sim = Simulator(self.m)
+        snapshot = sim.snapshot()
+        sim.add_clock(Period(MHz=1))
+        sim.run_until(Period(us=5))
+        sim.restore(snapshot)
+        sim.add_clock(Period(MHz=2))
+        async def testbench(ctx):
+            await ctx.delay(Period(us=5))
+            self.assertEqual(ctx.get(self.count), 10)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_wrong_snapshot(self):
+        self.setUp_design()
+        sim = Simulator(self.m)
+        snapshot = Simulator(self.m).snapshot()
+        with self.assertRaisesRegex(TypeError,
+                r"^Object <.+> is not a snapshot of this simulation$"):
+            sim.restore(snapshot)
+
+    def test_restore_vcd(self):
+        self.setUp_design()
+        sim = Simulator(self.m)
+        snapshot = sim.snapshot()
+        with self.assertRaisesRegex(ValueError,
+                r"^Cannot restore a snapshot while writing waveforms$"):
+            with sim.write_vcd(StringIO()):
+                sim.restore(snapshot)
+
+    @unittest.skipUnless(numpy, "NumPy is not installed")
+    def test_lanes(self):
+        self.setUp_design()
+        sim = Simulator(self.m, lanes=2)
+        sim.add_clock(Period(MHz=1))
+        async def boot(ctx):
+            ctx.set(self.wp.addr, numpy.array([0, 1]))
+            ctx.set(self.wp.data, numpy.array([5, 6]))
+            ctx.set(self.wp.en, 1)
+            await ctx.tick()
+            ctx.set(self.wp.en, 0)
+        sim.add_testbench(boot)
+        sim.run()
+        booted = sim.snapshot()
+        results = []
+        async def scenario(ctx):
+            ctx.set(self.rp.addr, numpy.array([0, 1]))
+            results.append(ctx.get(self.rp.data).tolist())
+            ctx.set(self.wp.addr, numpy.array([0, 1]))
+            ctx.set(self.wp.data, 7)
+            ctx.set(self.wp.en, 1)
+            await ctx.tick()
+            results.append(ctx.get(self.rp.data).tolist())
+        for _ in range(2):
+            sim.restore(booted)
+            sim.add_testbench(scenario)
+            sim.run()
+        self.assertEqual(results, [[5, 6], [7, 7], [5, 6], [7, 7]])
+
+
+class SimulatorBatchTestCase(FHDLTestCase):
+    class Counter(Elaboratable):
+        def __init__(self):
+            self.count = Signal(8)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.d.sync += self.count.eq(self.count + 1)
+            return m
+
+    @staticmethod
+    def setup(sim, dut):
+        sim.add_clock(Period(MHz=1))
+
+    @staticmethod
+    async def count_ticks(ctx, dut, parameter):
+        await ctx.tick().repeat(parameter)
+        assert parameter != 3, "unlucky"
+        return ctx.get(dut.count)
+
+    def check_results(self, results):
+        self.assertEqual([result.parameter for result in results], [1, 2, 3, 4])
+        self.assertEqual([result.passed for result in results], [True, True, False, True])
+        self.assertEqual([result.value for result in results], [1, 2, None, 4])
+        self.assertIn("AssertionError: unlucky", results[2].failure)
+        self.assertEqual(repr(results[0]), "BatchResult(1, value=1)")
+        self.assertEqual(repr(results[2]), "BatchResult(3, failed)")
+
+    def test_in_process(self):
+        results = run_batch(self.Counter, self.count_ticks, [1, 2, 3, 4],
+                            setup=self.setup, processes=1)
+        self.check_results(results)
+        self.assertEqual([result.vcd_file for result in results], [None] * 4)
+
+    def test_pool(self):
+        with tempfile.TemporaryDirectory() as vcd_dir:
+            results = run_batch(self.Counter, self.count_ticks, [1, 2, 3, 4],
+                                setup=self.setup, processes=2, vcd_dir=vcd_dir)
+            self.check_results(results)
+            for index, result in enumerate(results):
+                self.assertEqual(result.vcd_file, os.path.join(vcd_dir, f"{index}.vcd"))
+                self.assertTrue(os.path.exists(result.vcd_file))
+
+    def test_deadline(self):
+        async def testbench(ctx, dut, parameter):
+            await ctx.tick().repeat(parameter)
+            return ctx.get(dut.count)
+        results = run_batch(self.Counter, testbench, [1, 100], setup=self.setup,
+                            processes=1, deadline=Period(us=10))
+        self.assertEqual([result.value for result in results], [1, None])
+
+    def test_warm_up(self):
+        def setup(sim, dut):
+            sim.add_clock(Period(MHz=1))
+            async def boot(ctx):
+                await ctx.tick().repeat(10)
+            sim.add_testbench(boot)
+            sim.run()
+        for processes in (1, 2):
+            results = run_batch(self.Counter, self.count_ticks, [1, 2, 3, 4],
+                                setup=setup, processes=processes)
+            self.assertEqual([result.value for result in results], [11, 12, None, 14])
+
+
+class SimulatorProfileTestCase(FHDLTestCase):
+    class Counter(Elaboratable):
+        def __init__(self):
+            self.count = Signal(8)
+            self.next  = Signal(8)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.mem = mem = Memory(shape=8, depth=4, init=[])
+            wr_port = mem.write_port()
+            m.d.comb += [
+                self.next.eq(self.count + 1),
+                wr_port.addr.eq(self.count),
+                wr_port.data.eq(self.count),
+                wr_port.en.eq(1),
+            ]
+            m.d.sync += self.count.eq(self.next)
+            return m
+
+    def simulate(self, **engine_options):
+        dut = self.Counter()
+        sim = Simulator(dut, **engine_options)
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            await ctx.tick().repeat(4)
+            ctx.set(dut.count, 10)
+        sim.add_testbench(testbench)
+        with sim.profile() as profile:
+            self.assertEqual(profile.runnables, [])
+            sim.run()
+        return profile
+
+    def find(self, profile, kind, name, domain=None):
+        for entry in profile.runnables:
+            if (entry["kind"], entry["name"], entry["domain"]) == (kind, name, domain):
+                return entry
+        self.fail(f"no {kind} {name!r} in {profile.runnables!r}")
+
+    def test_profile(self):
+        profile = self.simulate()
+        testbench = self.find(profile, "testbench",
+                              "SimulatorProfileTestCase.simulate.<locals>.testbench")
+        self.assertEqual(testbench["activations"], 5)
+        self.assertEqual(testbench["commits"], 1)
+        trigger = self.find(profile, "trigger",
+                            "SimulatorProfileTestCase.simulate.<locals>.testbench")
+        self.assertEqual(trigger["activations"], 4)
+        clock = self.find(profile, "clock", "top.clk")
+        self.assertEqual(clock["activations"], 8)
+        self.assertEqual(clock["commits"], 7)
+        sync = self.find(profile, "rtl", "top", "sync")
+        self.assertEqual(sync["activations"], 4)
+        self.assertEqual(sync["commits"], 4)
+        self.find(profile, "rtl", "top", "comb")
+        self.find(profile, "rtl", "top.mem", "sync")
+        self.assertEqual([entry["time"] for entry in profile.runnables],
+                         sorted((entry["time"] for entry in profile.runnables), reverse=True))
+
+        self.assertEqual(profile.signals["top.clk"], 7)
+        self.assertEqual(profile.signals["top.count"], 5)
+        self.assertEqual(profile.signals["top.mem"], 4)
+        self.assertEqual(list(profile.signals.values()),
+                         sorted(profile.signals.values(), reverse=True))
+
+        self.assertEqual(profile.timesteps, 8)
+        self.assertEqual(sum(profile.delta_cycles.values()), 8)
+        self.assertGreater(profile.elapsed, 0)
+
+    def test_flatten(self):
+        profile = self.simulate(flatten=True)
+        self.find(profile, "rtl", "(flattened)", "comb")
+        self.find(profile, "rtl", "(flattened)", "sync")
+        self.find(profile, "rtl", "top.mem", "sync")
+
+    def test_report(self):
+        profile = self.simulate()
+        report = json.loads(profile.to_json())
+        self.assertEqual(report["timesteps"], 8)
+        self.assertEqual(report["runnables"], profile.runnables)
+        self.assertEqual(report["signals"], profile.signals)
+        self.assertEqual(report["delta_cycles"],
+                         {str(count): times for count, times in profile.delta_cycles.items()})
+
+        table = profile.format(top=1)
+        self.assertIn(" 8 timesteps, ", table)
+        self.assertIn(f"  {profile.runnables[0]['kind']:<9}  ", table)
+        self.assertNotIn(f"  {profile.runnables[1]['kind']:<9}  {profile.runnables[1]['name']}",
+                         table)
+        self.assertIn("         7  top.clk", table)
+        self.assertNotIn("top.count", table)
+        self.assertEqual(str(profile), profile.format())
+        self.assertRegex(repr(profile),
+            r"^SimulationProfile\(elapsed=\d+\.\d+, timesteps=8, runnables=\d+, signals=\d+\)$")
+
+    def test_nested(self):
+        sim = Simulator(self.Counter())
+        with sim.profile():
+            with self.assertRaisesRegex(ValueError,
+                    r"^The simulation is already being profiled$"):
+                with sim.profile():
+                    pass
+        with sim.profile():
+            pass
+
+
+
+class SimulatorRunAsyncTestCase(FHDLTestCase):
+    def setUp(self):
+        self.m = Module()
+        self.count = Signal(8)
+        self.m.d.sync += self.count.eq(self.count + 1)
+
+    def test_run_async(self):
+        results = []
+        async def main():
+            queue = asyncio.Queue()
+            sim = Simulator(self.m)
+            sim.add_clock(Period(MHz=1))
+            async def testbench(ctx):
+                for _ in range(3):
+                    before = ctx.elapsed_time()
+                    value = await ctx.external(queue.get())
+                    self.assertEqual(ctx.elapsed_time(), before)
+                    results.append((value, ctx.get(self.count)))
+                    await ctx.tick().repeat(2)
+            sim.add_testbench(testbench)
+            async def producer():
+                for value in range(3):
+                    await asyncio.sleep(0.001)
+                    await queue.put(value)
+            await asyncio.gather(sim.run_async(), producer())
+        asyncio.run(main())
+        self.assertEqual(results, [(0, 0), (1, 2), (2, 4)])
+
+    def test_external_exception(self):
+        async def main():
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(ValueError("host"))
+            sim = Simulator(self.m)
+            async def testbench(ctx):
+                with self.assertRaisesRegex(ValueError, r"^host$"):
+                    await ctx.external(future)
+            sim.add_testbench(testbench)
+            await sim.run_async()
+        asyncio.run(main())
+
+    def test_external_holds_time(self):
+        times = []
+        async def main():
+            future = asyncio.get_running_loop().create_future()
+            sim = Simulator(self.m)
+            sim.add_clock(Period(MHz=1))
+            async def testbench_1(ctx):
+                self.assertEqual(await ctx.external(future), 1)
+                times.append(ctx.elapsed_time())
+            async def testbench_2(ctx):
+                future.set_result(1)
+                await ctx.tick()
+                times.append(ctx.elapsed_time())
+            sim.add_testbench(testbench_1)
+            sim.add_testbench(testbench_2)
+            await sim.run_async()
+        asyncio.run(main())
+        self.assertEqual(times, [Period(), Period(ns=500)])
+
+    def test_external_background(self):
+        cancelled = []
+        async def main():
+            sim = Simulator(self.m)
+            sim.add_clock(Period(MHz=1))
+            async def forever():
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+            async def testbench_1(ctx):
+                await ctx.external(forever())
+            async def testbench_2(ctx):
+                await ctx.external(asyncio.sleep(0.001))
+            sim.add_testbench(testbench_1, background=True)
+            sim.add_testbench(testbench_2)
+            await sim.run_async()
+            await asyncio.sleep(0)
+        asyncio.run(main())
+        self.assertEqual(cancelled, [True])
+
+    def test_external_wrong(self):
+        sim = Simulator(self.m)
+        async def testbench(ctx):
+            await ctx.external(None)
+        sim.add_testbench(testbench)
+        with self.assertRaisesRegex(RuntimeError,
+                r"^Testbenches may only await `ctx.external\(\)` when the simulation is run using "
+                r"`Simulator.run_async\(\)`$"):
+            sim.run()
+
+    def test_external_process(self):
+        sim = Simulator(self.m)
+        async def process(ctx):
+            with self.assertRaisesRegex(TypeError,
+                    r"^`.external\(\)` cannot be used in simulator processes$"):
+                ctx.external(None)
+        sim.add_process(process)
+        sim.run()
+
+def _has_cxxsim():
+    try:
+        find_yosys(lambda ver: ver >= (0, 40))
+    except YosysError:
+        return False
+    return has_tool("c++")
+
+
+@unittest.skipUnless(_has_cxxsim(), "Yosys 0.40 or a C++ compiler is not available")
+class CxxSimTestCase(FHDLTestCase):
+    def setUp_design(self):
+        self.m = Module()
+        self.en = Signal()
+        self.count = Signal(8)
+        self.neg = Signal(signed(8))
+        self.wide = Signal(100)
+        self.m.d.comb += self.neg.eq(-self.count)
+        self.m.d.comb += self.wide.eq(self.count << 90)
+        with self.m.If(self.en):
+            self.m.d.sync += self.count.eq(self.count + 1)
+        self.m.submodules.mem = self.mem = Memory(shape=8, depth=4, init=[1, 2, 3, 4])
+        self.wp = self.mem.write_port()
+        self.rp = self.mem.read_port(domain="comb")
+        self.m.d.comb += [
+            self.wp.addr.eq(self.count),
+            self.wp.data.eq(self.count),
+            self.wp.en.eq(self.en),
+            self.rp.addr.eq(self.count),
+        ]
+
+    def run_design(self, engine):
+        self.setUp_design()
+        sim = Simulator(self.m, engine=engine)
+        sim.add_clock(Period(MHz=1))
+        results = []
+        async def testbench(ctx):
+            ctx.set(self.en, 1)
+            for _ in range(5):
+                await ctx.tick()
+                results.append((ctx.get(self.count), ctx.get(self.neg), ctx.get(self.wide),
+                                ctx.get(self.rp.data), ctx.get(self.mem.data[0])))
+            ctx.set(self.en, 0)
+            ctx.set(self.mem.data[1], 99)
+            await ctx.tick()
+            results.append((ctx.get(self.count), ctx.get(self.rp.data)))
+        sim.add_testbench(testbench)
+        sim.run()
+        return results
+
+    def test_engine(self):
+        self.assertEqual(self.run_design("cxxsim"), self.run_design("pysim"))
+
+    def test_options_wrong(self):
+        with self.assertRaisesRegex(ValueError,
+                r"^The cxxsim engine does not support `prune`$"):
+            Simulator(Module(), engine="cxxsim", prune=True)
+        with self.assertRaisesRegex(ValueError,
+                r"^The cxxsim engine does not support `lanes`$"):
+            Simulator(Module(), engine="cxxsim", lanes=4)
+
+    def test_print_assert(self):
+        m = Module()
+        count = Signal(4)
+        m.d.sync += count.eq(count + 1)
+        m.d.sync += Print("count:", count)
+        m.d.sync += Assert(count != 2, Format("count is {}", count))
+        sim = Simulator(m, engine="cxxsim")
+        sim.add_clock(Period(MHz=1))
+        output = StringIO()
+        with redirect_stdout(output):
+            with self.assertRaisesRegex(AssertionError, r"^Assertion violated: count is 2$"):
+                sim.run_until(Period(us=10))
+        self.assertEqual(output.getvalue(), "count: 0\ncount: 1\ncount: 2\n")
+
+    def test_triggers(self):
+        m = Module()
+        count = Signal(8)
+        m.d.sync += count.eq(count + 1)
+        sim = Simulator(m, engine="cxxsim")
+        sim.add_clock(Period(MHz=1))
+        changes = []
+        async def process(ctx):
+            async for value, in ctx.changed(count):
+                changes.append(value)
+        sim.add_process(process)
+        async def testbench(ctx):
+            await ctx.tick().until(count == 3)
+            self.assertEqual(ctx.get(count), 4)
+        sim.add_testbench(testbench)
+        sim.run()
+        self.assertEqual(changes, [0, 1, 2, 3, 4])
+
+    def test_vcd(self):
+        self.setUp_design()
+        sim = Simulator(self.m, engine="cxxsim")
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            ctx.set(self.en, 1)
+            await ctx.tick().repeat(2)
+        sim.add_testbench(testbench)
+        with StringIO() as vcd_file:
+            with sim.write_vcd(vcd_file):
+                sim.run()
+            vcd = vcd_file.getvalue()
+        self.assertIn("$var wire 8 , \\mem[0] $end", vcd)
+        # `count` and `mem[0]` change at the first clock edge.
+        self.assertRegex(vcd, r"#500000000\n(?:.+\n)*b0 ,\n")
+        self.assertRegex(vcd, r"#500000000\n(?:.+\n)*b1 \$\n")
+
+    def test_vcd_untrack(self):
+        self.setUp_design()
+        sim = Simulator(self.m, engine="cxxsim")
+        sim.add_clock(Period(MHz=1))
+        async def testbench(ctx):
+            ctx.set(self.en, 1)
+            await ctx.tick().repeat(2)
+        sim.add_testbench(testbench)
+        model = sim._engine._state.model
+        with unittest.mock.patch.object(model, "track", wraps=model.track) as track, \
+                unittest.mock.patch.object(model, "untrack", wraps=model.untrack) as untrack:
+            with sim.write_vcd(StringIO()), sim.write_vcd(StringIO()):
+                sim.run_until(Period(us=1))
+                untrack.assert_not_called()
+            track.assert_called_once()
+            untrack.assert_called_once_with(track.call_args.args[0])
+        sim.run()
+        self.assertEqual(sim._engine.get_value(self.mem.data[1]), 1)
+
+    def test_snapshot_reset(self):
+        self.setUp_design()
+        sim = Simulator(self.m, engine="cxxsim")
+        sim.add_clock(Period(MHz=1))
+        async def boot(ctx):
+            ctx.set(self.en, 1)
+            await ctx.tick().repeat(2)
+        sim.add_testbench(boot)
+        sim.run()
+        booted = sim.snapshot()
+        results = []
+        async def scenario(ctx):
+            results.append((ctx.get(self.count), ctx.get(self.mem.data[0])))
+            await ctx.tick().repeat(3)
+            results.append((ctx.get(self.count), ctx.get(self.mem.data[0])))
+        for _ in range(2):
+            sim.restore(booted)
+            sim.add_testbench(scenario)
+            sim.run()
+        self.assertEqual(results, [(2, 0), (5, 4), (2, 0), (5, 4)])
+        sim.reset()
+        results.clear()
+        sim.run()
+        self.assertEqual(results, [(0, 1), (3, 0)])
+
+    def test_memory_load(self):
+        self.setUp_design()
+        sim = Simulator(self.m, engine="cxxsim")
+        async def testbench(ctx):
+            ctx.memory_load(self.mem, bytes([5, 6, 7]), offset=1)
+            self.assertEqual(ctx.memory_dump(self.mem), [1, 5, 6, 7])
+            self.assertEqual(ctx.get(self.rp.data), 1)
+            ctx.memory_load(self.mem, [8])
+            self.assertEqual(ctx.memory_dump(self.mem, count=2), [8, 5])
+            self.assertEqual(ctx.get(self.rp.data), 8)
+        sim.add_testbench(testbench)
+        sim.run()
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_cxxsim_cache": cache_dir}):
+                self.assertEqual(self.run_design("cxxsim")[-1], (5, 99))
+                entries = os.listdir(cache_dir)
+                self.assertEqual(len(entries), 1)
+                with unittest.mock.patch("amaranth.sim.cxxsim.subprocess.run") as run:
+                    self.assertEqual(self.run_design("cxxsim")[-1], (5, 99))
+                    run.assert_not_called()
+                self.assertEqual(os.listdir(cache_dir), entries)
+
+    @unittest.skipUnless(os.name == "posix", "POSIX permissions are required")
+    def test_cache_private(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {"AMARANTH_cxxsim_cache": cache_dir}):
+                self.run_design("cxxsim")
+                path, = (os.path.join(cache_dir, entry) for entry in os.listdir(cache_dir))
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+                # A model writable by other users is rebuilt instead of being loaded.
+                os.chmod(path, 0o722)
+                self.assertEqual(self.run_design("cxxsim")[-1], (5, 99))
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+                os.chmod(cache_dir, 0o777)
+                with self.assertRaisesRegex(RuntimeError,
+                        r"^Cannot use '.+' as the CXXRTL model cache, since it is not owned by "
+                        r"the current user or is writable by other users$"):
+                    self.run_design("cxxsim")
+
 
 class SimulatorRegressionTestCase(FHDLTestCase):
     def test_bug_325(self):